@@ -0,0 +1,41 @@
+import sys
+import timeit
+
+import pandas as pd
+
+from data_manipulation.transform import compute_symbol_change
+from synthetic import synthetic_ticker_frame
+
+"""
+Compares the per-symbol list scans the join used to run over the ticker_data keys with the vectorized
+compute_symbol_change, for growing universes of symbols.
+
+    PYTHONPATH=src python benchmarks/bench_ticker_change.py [500 1000 2000 5000]
+"""
+
+
+def legacy_change_by_symbol(ticker_data: dict, symbols: list) -> pd.DataFrame:
+    ticker_keys: list = list(ticker_data)
+    open_keys: list = [key for key in ticker_keys if str(key).__contains__('Open')]
+    close_keys: list = [key for key in ticker_keys if str(key).__contains__('Adj Close')]
+    volume_keys: list = [key for key in ticker_keys if str(key).__contains__('Volume')]
+    change_by_symbol: list = []
+    for symbol in symbols:
+        open_value: float = list(ticker_data.get([o for o in open_keys if o[1] == symbol][0]).values())[0]
+        close_value: float = list(ticker_data.get([c for c in close_keys if c[1] == symbol][0]).values())[0]
+        volume_value: float = list(ticker_data.get([v for v in volume_keys if v[1] == symbol][0]).values())[0]
+        change_by_symbol.append({"Symbol": symbol, "Open": open_value, "Close": close_value, "Volume": volume_value,
+                                 "Change": (close_value - open_value) * volume_value})
+    return pd.DataFrame(change_by_symbol)
+
+
+if __name__ == "__main__":
+    sizes: list = [int(size) for size in sys.argv[1:]] or [500, 1000, 2000, 5000]
+    print(f"{'symbols':>8} {'legacy (s)':>12} {'vectorized (s)':>15} {'speedup':>8}")
+    for size in sizes:
+        frame: pd.DataFrame = synthetic_ticker_frame(size)
+        as_dict: dict = frame.to_dict()
+        symbols: list = frame.columns.get_level_values(1).unique().tolist()
+        legacy: float = min(timeit.repeat(lambda: legacy_change_by_symbol(as_dict, symbols), number=1, repeat=3))
+        vectorized: float = min(timeit.repeat(lambda: compute_symbol_change(frame, symbols), number=1, repeat=3))
+        print(f"{size:>8} {legacy:>12.4f} {vectorized:>15.4f} {legacy / vectorized:>7.0f}x")
@@ -0,0 +1,84 @@
+import json
+import os
+import tracemalloc
+
+import pytest
+
+from synthetic import synthetic_places, synthetic_sp_companies, synthetic_ticker_frame
+
+"""
+Fixtures of the pytest-benchmark suite. The scale is set on the command line, the timings are compared against
+baselines saved by pytest-benchmark itself and the peak memory of every benchmark against a baseline file:
+
+    PYTHONPATH=src pytest benchmarks --companies 500,2000,10000 --places 30000 --benchmark-autosave
+    PYTHONPATH=src pytest benchmarks --benchmark-compare --benchmark-compare-fail=mean:15% --memory-baseline benchmarks/memory.json
+"""
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("market_change benchmarks")
+    group.addoption("--companies", default="500,2000", help="comma separated numbers of companies to benchmark")
+    group.addoption("--places", type=int, default=3000, help="number of place polygons across all states")
+    group.addoption("--memory-baseline", default=None,
+                    help="json file of peak bytes per benchmark; fail on a regression against it, record missing entries")
+    group.addoption("--memory-tolerance", type=float, default=0.2, help="allowed relative growth of the peak memory")
+
+
+def pytest_generate_tests(metafunc):
+    if "company_count" in metafunc.fixturenames:
+        counts = [int(count) for count in metafunc.config.getoption("companies").split(",")]
+        metafunc.parametrize("company_count", counts, ids=[f"{count}_companies" for count in counts], scope="session")
+
+
+@pytest.fixture(scope="session")
+def geo_data(request):
+    return synthetic_places(request.config.getoption("places"))
+
+
+@pytest.fixture(scope="session")
+def sp_companies(geo_data, company_count):
+    return synthetic_sp_companies(company_count, geo_data)
+
+
+@pytest.fixture(scope="session")
+def ticker_data(sp_companies):
+    return synthetic_ticker_frame(sp_companies["Symbol"].tolist())
+
+
+@pytest.fixture(scope="session")
+def memory_baseline(request):
+    path = request.config.getoption("memory_baseline")
+    baseline = dict()
+    if path is not None and os.path.exists(path):
+        with open(path) as f:
+            baseline = json.load(f)
+    yield baseline
+    if path is not None:
+        with open(path, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+
+
+@pytest.fixture
+def peak_memory(request, benchmark, memory_baseline):
+    """
+    Runs a function once more under tracemalloc, outside of the timed rounds, and records its peak allocation in the
+    benchmark's extra_info. With --memory-baseline, a peak more than --memory-tolerance above the baseline fails.
+    """
+
+    def measure(func, *args, **kwargs):
+        tracemalloc.start()
+        try:
+            func(*args, **kwargs)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info["peak_bytes"] = peak
+
+        name = request.node.name
+        tolerance = request.config.getoption("memory_tolerance")
+        if name in memory_baseline and peak > memory_baseline[name] * (1 + tolerance):
+            pytest.fail(f"{name} peaked at {peak:,} bytes, {peak / memory_baseline[name] - 1:.0%} above its baseline of {memory_baseline[name]:,}")
+        memory_baseline.setdefault(name, peak)
+        return peak
+
+    return measure
@@ -0,0 +1,104 @@
+import io
+import zipfile
+
+import numpy as np
+import pandas as pd
+import shapefile
+
+from states import states
+
+"""
+Generators of synthetic, nationwide stand-ins for the S&P constituent table, the yfinance download and the census
+place geometry, at any scale. Every company is headquartered in one of the generated places, so the join matches
+all of them, and everything is seeded so that two runs benchmark the same data.
+"""
+
+
+def synthetic_places(place_count: int, vertices: int = 32, seed: int = 0) -> dict:
+    """
+    :param place_count: number of place polygons, spread over every state
+    :param vertices: number of vertices of every polygon ring
+    :param seed: random seed
+    :return: a dictionary of state fips to the FeatureCollection of its places, like retrieve_us_city_shape_files
+    """
+
+    rng: np.random.Generator = np.random.default_rng(seed)
+    fips_codes: list = states.get_states_df()["fips"].tolist()
+    angles: np.ndarray = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    geo_data: dict = {fips: {"type": "FeatureCollection", "features": []} for fips in fips_codes}
+    for i in range(place_count):
+        fips: str = fips_codes[i % len(fips_codes)]
+        x, y = rng.uniform(-124, -67), rng.uniform(25, 49)
+        radius: np.ndarray = rng.uniform(0.01, 0.1) * rng.uniform(0.8, 1.2, size=vertices)
+        ring: list = np.column_stack([x + radius * np.cos(angles), y + radius * np.sin(angles)]).round(6).tolist()
+        geo_data[fips]["features"].append({
+            "type": "Feature",
+            "properties": {"STATEFP": fips, "PLACEFP": f"{i:05d}", "NAME": f"Place {i}"},
+            "geometry": {"type": "Polygon", "coordinates": [ring + ring[:1]]},
+        })
+    return {fips: collection for fips, collection in geo_data.items() if collection["features"]}
+
+
+def synthetic_sp_companies(company_count: int, geo_data: dict, seed: int = 0) -> pd.DataFrame:
+    """
+    :param company_count: number of companies
+    :param geo_data: the output of synthetic_places, the companies are headquartered in its places
+    :param seed: random seed
+    :return: a constituent table with the columns of the scraped S&P 500 list
+    """
+
+    rng: np.random.Generator = np.random.default_rng(seed)
+    state_names: dict = dict(zip(states.get_states_df()["fips"], states.get_states_df()["name"]))
+    places: list = [(feature["properties"]["NAME"], state_names[fips]) for fips, collection in geo_data.items()
+                    for feature in collection["features"]]
+    headquarters: np.ndarray = rng.integers(0, len(places), size=company_count)
+    return pd.DataFrame({
+        "Symbol": [f"S{i:05d}" for i in range(company_count)],
+        "Security": [f"Security {i}" for i in range(company_count)],
+        "GICS Sector": "Information Technology",
+        "GICS Sub-Industry": "Systems Software",
+        "Headquarters Location": [f"{places[h][0]}, {places[h][1]}" for h in headquarters],
+        "Date Added": "2000-01-01",
+        "CIK": [f"{i:010d}" for i in range(company_count)],
+        "Founded": "1970",
+    })
+
+
+def synthetic_ticker_frame(symbols: int | list, sessions: int = 1, seed: int = 0) -> pd.DataFrame:
+    """
+    :param symbols: the symbols in the download, or the number of symbols to make up
+    :param sessions: number of trading sessions (rows)
+    :param seed: random seed
+    :return: a frame shaped like yfinance.download, with (metric, ticker) columns
+    """
+
+    rng: np.random.Generator = np.random.default_rng(seed)
+    symbols = [f"S{i:05d}" for i in range(symbols)] if isinstance(symbols, int) else list(symbols)
+    columns: pd.MultiIndex = pd.MultiIndex.from_product([["Adj Close", "Close", "High", "Low", "Open", "Volume"], symbols],
+                                                        names=["Price", "Ticker"])
+    values: np.ndarray = rng.uniform(10, 500, size=(sessions, len(columns)))
+    index: pd.DatetimeIndex = pd.date_range("2024-08-01", periods=sessions, freq="B")
+    return pd.DataFrame(values, index=index, columns=columns)
+
+
+def synthetic_place_zip(fips: str, collection: dict) -> bytes:
+    """
+    :param fips: the state fips code
+    :param collection: the FeatureCollection of the state's places, e.g. from synthetic_places
+    :return: a zip archive laid out like the census tl_2019_<fips>_place.zip
+    """
+
+    shp, shx, dbf = io.BytesIO(), io.BytesIO(), io.BytesIO()
+    with shapefile.Writer(shp=shp, shx=shx, dbf=dbf, shapeType=shapefile.POLYGON) as writer:
+        writer.field("STATEFP", "C", size=2)
+        writer.field("PLACEFP", "C", size=5)
+        writer.field("NAME", "C", size=100)
+        for feature in collection["features"]:
+            writer.poly(feature["geometry"]["coordinates"])
+            writer.record(*(feature["properties"][name] for name in ("STATEFP", "PLACEFP", "NAME")))
+
+    archive: io.BytesIO = io.BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as z:
+        for extension, member in (("shp", shp), ("shx", shx), ("dbf", dbf)):
+            z.writestr(f"tl_2019_{fips}_place.{extension}", member.getvalue())
+    return archive.getvalue()
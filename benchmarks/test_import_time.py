@@ -0,0 +1,41 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+"""
+Benchmarks of the start-up of a fresh interpreter importing the entry points of the map build: the console script,
+the pipeline, the modules the process pool workers import, and the interpreter alone for reference. The cumulative
+import time of the heaviest modules, as reported by python -X importtime, is kept in the benchmark's extra_info.
+"""
+
+SRC: str = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+
+MODULES: list = [None, "pipeline.cli", "pipeline.stages", "data_manipulation.parallel", "data_visualization.tiles",
+                 "data_manipulation.fetch"]
+
+
+def _import(module: str | None, *options: str) -> subprocess.CompletedProcess:
+    return subprocess.run([sys.executable, *options, "-c", f"import {module}" if module else "pass"],
+                          env={**os.environ, "PYTHONPATH": os.path.abspath(SRC)}, capture_output=True, text=True, check=True)
+
+
+def _slowest_imports(importtime: str, limit: int = 10) -> dict:
+    # lines look like "import time:       412 |      30954 |   pandas", self and cumulative microseconds
+    cumulative: dict = dict()
+    for line in importtime.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, us, name = line.split("|")
+        cumulative[name.strip()] = int(us)
+    return dict(sorted(cumulative.items(), key=lambda item: -item[1])[:limit])
+
+
+@pytest.mark.parametrize("module", MODULES, ids=[module or "interpreter" for module in MODULES])
+def test_import_time(benchmark, module):
+    benchmark.pedantic(_import, args=(module,), rounds=5, iterations=1, warmup_rounds=1)
+
+    benchmark.extra_info["slowest_imports_us"] = _slowest_imports(_import(module, "-X", "importtime").stderr)
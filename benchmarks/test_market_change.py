@@ -0,0 +1,95 @@
+import json
+
+import pytest
+from requests import Response
+
+pytest.importorskip("pytest_benchmark")
+
+from data_manipulation import fetch
+from data_manipulation import transform
+from data_manipulation.geostore import places_to_geodataframe
+from data_manipulation.providers import Provider
+from data_visualization import mapping
+from synthetic import synthetic_place_zip
+
+"""
+Benchmarks of the stages of the map build on synthetic nationwide data, see conftest.py for how to run them.
+"""
+
+
+class ZipProvider(Provider):
+    """
+    Serves the synthetic place zips in place of the census server.
+    """
+
+    def __init__(self, zips: dict):
+        self.zips = zips
+
+    def get(self, url, timeout=None, headers=None):
+        r = Response()
+        r.status_code, r._content = 200, self.zips[url.rsplit("/", 1)[-1]]
+        return r
+
+    def download_prices(self, symbols, period="1d", interval="1d", start=None, end=None):
+        raise NotImplementedError("the place benchmarks never download prices")
+
+
+@pytest.fixture(scope="session")
+def joined(sp_companies, ticker_data, geo_data):
+    return transform.join_ticker_data_to_geodata(sp_companies, ticker_data, places_to_geodataframe(geo_data))
+
+
+@pytest.fixture(scope="session")
+def city_frame(sp_companies, ticker_data, geo_data):
+    prepped = transform.prepare_sp_companies(sp_companies)
+    change = transform.compute_symbol_change(ticker_data, prepped["Symbol"].unique())
+    return transform.aggregate_city_frame(transform.geoenhance_companies(prepped, places_to_geodataframe(geo_data)), change)
+
+
+def test_join_ticker_data_to_geodata(benchmark, peak_memory, sp_companies, ticker_data, geo_data):
+    places = places_to_geodataframe(geo_data)
+
+    map_geometry, map_data = benchmark(transform.join_ticker_data_to_geodata, sp_companies, ticker_data, places)
+    peak_memory(transform.join_ticker_data_to_geodata, sp_companies, ticker_data, places)
+
+    assert len(json.loads(map_geometry)["features"]) >= len(map_data) > 0
+
+
+def test_join_ticker_data_to_geojson_string(benchmark, peak_memory, sp_companies, ticker_data, geo_data):
+    geo_json = json.dumps(geo_data)
+
+    benchmark(transform.join_ticker_data_to_geodata, sp_companies, ticker_data, geo_json)
+    peak_memory(transform.join_ticker_data_to_geodata, sp_companies, ticker_data, geo_json)
+
+
+def test_forge_geojson(benchmark, peak_memory, city_frame):
+    map_geometry, _ = benchmark(transform.forge_geojson, city_frame)
+    peak_memory(transform.forge_geojson, city_frame)
+
+    assert json.loads(map_geometry)["features"]
+
+
+def test_load_place_shapefiles(benchmark, peak_memory, geo_data):
+    # one state's zip at a time, parsed like the census downloads are
+    provider = ZipProvider({f"tl_2019_{fips}_place.zip": synthetic_place_zip(fips, collection) for fips, collection in geo_data.items()})
+
+    def load():
+        return {fips: fetch._fetch_state_place_shapes(fips, timeout=1, retries=1, backoff=0, provider=provider)["geojson"]
+                for fips in geo_data}
+
+    shapes = benchmark(load)
+    peak_memory(load)
+
+    assert sum(len(collection["features"]) for collection in shapes.values()) == sum(len(c["features"]) for c in geo_data.values())
+
+
+def test_generate_chloropleth_map(benchmark, peak_memory, joined):
+    map_geometry, map_data = joined
+
+    def render():
+        return mapping.generate_chloropleth_map(map_geometry, map_data).get_root().render()
+
+    html = benchmark.pedantic(render, rounds=3, iterations=1)
+    peak_memory(render)
+
+    assert "<html>" in html
@@ -1,45 +1,12 @@
-from data_manipulation import fetch
-from data_manipulation import transform
-from data_visualization import mapping
+import sys
 
-import logging
-import os
+from pipeline import cli
 
-# create logger
-logger = logging.getLogger('market_change')
-logger.setLevel(logging.INFO)
-
-# create console handler and set level to debug
-ch = logging.StreamHandler()
-ch.setLevel(logging.INFO)
-
-# create formatter
-formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-
-# add formatter to ch
-ch.setFormatter(formatter)
-
-# add ch to logger
-logger.addHandler(ch)
+"""
+Renders the S&P market change map like it always did, ~/Documents/maps/chloropleth_map.html by default. This is the
+market-change console script (see pipeline/cli.py), run with the render subcommand when no arguments are given; the
+MARKET_DATA_*, MAP_* and MARKET_CHANGE_* environment variables still select the same modes as the matching options.
+"""
 
 if __name__ == "__main__":
-    sp_data = fetch.retrieve_sp_500()
-    logger.info("Successfully fetched sp data")
-
-    sp_market_data = fetch.retrieve_ticker_data(sp_data)
-    logger.info("Successfully fetched ticker data")
-
-    geo_data = fetch.retrieve_us_city_shape_files()
-    logger.info("Successfully fetched us_city_shape_files")
-
-    map_ready_geo_data, map_data = transform.join_ticker_data_to_geodata(sp_data, sp_market_data, geo_data)
-    logger.info("Successfully joined us_city_shape_files, market data")
-
-    m = mapping.generate_chloropleth_map(map_ready_geo_data, map_data)
-    logger.info("Successfully generated chloropleth map")
-
-    try:
-        os.mkdir(f"{os.environ['HOME']}/Documents/maps")
-    except FileExistsError:
-        pass
-    m.save(f"{os.environ['HOME']}/Documents/maps/chloropleth_map.html")
\ No newline at end of file
+    sys.exit(cli.main(sys.argv[1:] or ["render"]))
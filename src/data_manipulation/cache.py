@@ -0,0 +1,331 @@
+import atexit
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import threading
+import time
+import weakref
+from collections import Counter
+from typing import Any
+
+"""
+The purpose of this module is to keep a persistent, on-disk copy of remote payloads (the census zip files and the
+wikipedia tables) together with a pre-parsed form of them, so that repeated runs do not download or parse anything
+that has not changed.
+"""
+
+
+DEFAULT_CACHE_DIR: str = os.path.join(os.path.expanduser("~"), ".cache", "GeoSpatialVisualization")
+DEFAULT_MAX_BYTES: int = 2 * 1024 ** 3
+
+# the caches with access times not yet written to their index, flushed when the interpreter exits
+_open_caches: weakref.WeakSet = weakref.WeakSet()
+
+
+class ShapeCache:
+    """
+    A content-addressed cache of raw downloads plus their parsed representation.
+
+    Raw payloads are stored once per sha256 of their content under blobs/, while the index maps each url to the
+    content hash and the ETag/Last-Modified validators the server returned for it. The parsed representation of a
+    url (for example the geojson of a state's places) is pickled under parsed/ and dropped whenever the raw content
+    of that url changes. When the total size on disk exceeds max_bytes the least recently used urls are evicted.
+
+    A cache hit only updates the access time of its url in memory; the index is written with the next store, by
+    flush() at the end of a batch of lookups, on close() or when the interpreter exits, whichever comes first.
+    """
+
+    def __init__(self, directory: str = DEFAULT_CACHE_DIR, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.directory: str = directory
+        self.max_bytes: int = max_bytes
+        self.hits: dict = {"raw": 0, "parsed": 0}
+        self.misses: dict = {"raw": 0, "parsed": 0}
+        self._lock: threading.RLock = threading.RLock()
+        self._dirty: bool = False
+        os.makedirs(os.path.join(directory, "blobs"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "parsed"), exist_ok=True)
+        self._index_path: str = os.path.join(directory, "index.json")
+        try:
+            with open(self._index_path) as f:
+                self._index: dict = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._index = dict()
+        _open_caches.add(self)
+
+    def __enter__(self) -> "ShapeCache":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    @staticmethod
+    def key(url: str) -> str:
+        """
+        :param url: the url of a cached payload
+        :return: the stable key the url is stored under
+        """
+        return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+    def _blob_path(self, content_hash: str) -> str:
+        return os.path.join(self.directory, "blobs", f"{content_hash}.bin")
+
+    def _parsed_path(self, key: str, variant: str = "") -> str:
+        suffix: str = f"-{hashlib.sha256(variant.encode('utf-8')).hexdigest()[:16]}" if variant else ""
+        return os.path.join(self.directory, "parsed", f"{key}{suffix}.pickle")
+
+    def _save_index(self) -> None:
+        tmp_path: str = f"{self._index_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self._index_path)
+        self._dirty = False
+
+    def _touch(self, entry: dict) -> None:
+        entry["last_access"] = time.time()
+        self._dirty = True
+
+    def flush(self) -> None:
+        """
+        Writes the access times of the cache hits since the index was last written, if there were any.
+        """
+        with self._lock:
+            if self._dirty:
+                self._save_index()
+
+    def close(self) -> None:
+        """
+        Flushes the index; the cache can still be used afterwards.
+        """
+        self.flush()
+        _open_caches.discard(self)
+
+    def blob_path(self, url: str) -> str | None:
+        """
+        :param url: the url of a cached payload
+        :return: the path of the raw payload on disk, or None if it is not cached
+        """
+        with self._lock:
+            entry: dict | None = self._index.get(self.key(url))
+            if entry is None or entry.get("sha256") is None:
+                return None
+            path: str = self._blob_path(entry["sha256"])
+            return path if os.path.exists(path) else None
+
+    def get_raw(self, url: str) -> bytes | None:
+        """
+        :param url: the url of a cached payload
+        :return: the raw payload as downloaded, or None on a cache miss
+        """
+        with self._lock:
+            path: str | None = self.blob_path(url)
+            if path is None:
+                self.misses["raw"] += 1
+                return None
+            self.hits["raw"] += 1
+            self._touch(self._index[self.key(url)])
+            # under the lock, so that a concurrent put_raw or eviction cannot delete the blob before it is opened
+            with open(path, "rb") as f:
+                return f.read()
+
+    def map_raw(self, url: str) -> mmap.mmap | None:
+        """
+        Same as get_raw, but memory-maps the cached payload instead of reading it, so that large archives are paged
+        in lazily. The caller is responsible for closing the returned map.
+
+        :param url: the url of a cached payload
+        :return: a read-only memory map of the raw payload, or None on a cache miss
+        """
+        with self._lock:
+            path: str | None = self.blob_path(url)
+            if path is None:
+                self.misses["raw"] += 1
+                return None
+            self.hits["raw"] += 1
+            self._touch(self._index[self.key(url)])
+            # once mapped, the blob stays readable even if it is deleted from the cache
+            with open(path, "rb") as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def put_raw(self, url: str, content: bytes, etag: str | None = None, last_modified: str | None = None) -> str:
+        """
+        Stores a raw payload for url. If the content differs from what was cached before, the parsed form of the
+        url is invalidated.
+
+        :param url: the url the payload was downloaded from
+        :param content: the payload itself
+        :param etag: the ETag response header, if any
+        :param last_modified: the Last-Modified response header, if any
+        :return: the sha256 of the content
+        """
+        content_hash: str = hashlib.sha256(content).hexdigest()
+        blob_path: str = self._blob_path(content_hash)
+        with self._lock:
+            # under the lock, so that another url releasing the same blob cannot delete it before it is referenced
+            if not os.path.exists(blob_path):
+                tmp_path: str = f"{blob_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+                with open(tmp_path, "wb") as f:
+                    f.write(content)
+                os.replace(tmp_path, blob_path)
+
+            key: str = self.key(url)
+            entry: dict = self._index.get(key, {"url": url})
+            if entry.get("sha256") != content_hash:
+                self._drop_parsed(key, entry)
+                self._release_blob(key, entry)
+            entry.update(sha256=content_hash, raw_bytes=len(content), etag=etag, last_modified=last_modified,
+                         last_access=time.time())
+            self._index[key] = entry
+            self._evict()
+            self._save_index()
+        return content_hash
+
+    def conditional_headers(self, url: str) -> dict:
+        """
+        :param url: the url of a cached payload
+        :return: the If-None-Match/If-Modified-Since headers to revalidate the cached payload with the server
+        """
+        with self._lock:
+            entry: dict = self._index.get(self.key(url), dict())
+            if self.blob_path(url) is None:
+                return dict()
+            headers: dict = dict()
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+            return headers
+
+    def get_parsed(self, url: str, variant: str = "") -> Any:
+        """
+        :param url: the url of a cached payload
+        :param variant: which of the parsed forms of url to return, e.g. a filtered subset of it
+        :return: the parsed form stored for url, or None on a cache miss
+        """
+        with self._lock:
+            key: str = self.key(url)
+            entry: dict | None = self._index.get(key)
+            if entry is None or variant not in entry.get("parsed_bytes", dict()):
+                self.misses["parsed"] += 1
+                return None
+            try:
+                with open(self._parsed_path(key, variant), "rb") as f:
+                    parsed: Any = pickle.load(f)
+            except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+                self._drop_parsed(key, entry)
+                self._save_index()
+                self.misses["parsed"] += 1
+                return None
+            self.hits["parsed"] += 1
+            self._touch(entry)
+            return parsed
+
+    def put_parsed(self, url: str, parsed: Any, variant: str = "") -> None:
+        """
+        Stores a parsed form of url. The url does not need to have a raw payload cached alongside it. Every variant
+        of the parsed form is dropped together once the raw content of the url changes.
+
+        :param url: the url the parsed object was derived from
+        :param parsed: any picklable object
+        :param variant: a name distinguishing several parsed forms of the same url, e.g. a filtered subset of it
+        """
+        with self._lock:
+            key: str = self.key(url)
+            path: str = self._parsed_path(key, variant)
+            tmp_path: str = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(parsed, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, path)
+            entry: dict = self._index.get(key, {"url": url})
+            entry.setdefault("parsed_bytes", dict())[variant] = os.path.getsize(path)
+            entry["last_access"] = time.time()
+            self._index[key] = entry
+            self._evict()
+            self._save_index()
+
+    def invalidate(self, url: str) -> None:
+        """
+        Forgets everything cached for url, forcing the next retrieval to go back to the network.
+
+        :param url: the url to invalidate
+        """
+        with self._lock:
+            key: str = self.key(url)
+            entry: dict | None = self._index.pop(key, None)
+            if entry is not None:
+                self._drop_parsed(key, entry)
+                self._release_blob(key, entry)
+                self._save_index()
+
+    def clear(self) -> None:
+        """
+        Empties the whole cache.
+        """
+        with self._lock:
+            for entry in list(self._index.values()):
+                self.invalidate(entry["url"])
+
+    def size(self) -> int:
+        """
+        :return: the number of bytes the cache currently occupies on disk
+        """
+        with self._lock:
+            blobs: dict = {entry["sha256"]: entry.get("raw_bytes", 0) for entry in self._index.values() if entry.get("sha256")}
+            parsed: int = sum(sum(entry.get("parsed_bytes", dict()).values()) for entry in self._index.values())
+            return sum(blobs.values()) + parsed
+
+    def stats(self) -> dict:
+        """
+        :return: hit and miss counters by kind of payload, the number of cached urls and the bytes on disk
+        """
+        with self._lock:
+            return {"hits": dict(self.hits), "misses": dict(self.misses), "entries": len(self._index), "bytes": self.size()}
+
+    def _drop_parsed(self, key: str, entry: dict) -> None:
+        for variant in entry.pop("parsed_bytes", dict()):
+            try:
+                os.remove(self._parsed_path(key, variant))
+            except FileNotFoundError:
+                pass
+
+    def _release_blob(self, key: str, entry: dict) -> None:
+        content_hash: str | None = entry.get("sha256")
+        if content_hash is None:
+            return
+        # blobs are content addressed, only delete one once no other url refers to it
+        if not any(other.get("sha256") == content_hash for other_key, other in self._index.items() if other_key != key):
+            try:
+                os.remove(self._blob_path(content_hash))
+            except FileNotFoundError:
+                pass
+
+    def _evict(self) -> None:
+        size: int = self.size()
+        if size <= self.max_bytes:
+            return
+        # the size and the references to every blob are counted once and kept up to date as entries are evicted
+        references: Counter = Counter(entry["sha256"] for entry in self._index.values() if entry.get("sha256"))
+        by_age: list = sorted(self._index.items(), key=lambda item: item[1].get("last_access", 0))
+        # never evict the most recently used entry, it is the one that was just stored
+        for key, entry in by_age[:-1]:
+            if size <= self.max_bytes:
+                break
+            self._index.pop(key)
+            size -= sum(entry.get("parsed_bytes", dict()).values())
+            self._drop_parsed(key, entry)
+            content_hash: str | None = entry.get("sha256")
+            if content_hash is not None:
+                references[content_hash] -= 1
+                if references[content_hash] == 0:
+                    size -= entry.get("raw_bytes", 0)
+                    try:
+                        os.remove(self._blob_path(content_hash))
+                    except FileNotFoundError:
+                        pass
+
+
+@atexit.register
+def _flush_open_caches() -> None:
+    for cache in list(_open_caches):
+        cache.flush()
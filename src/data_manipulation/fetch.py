@@ -1,44 +1,101 @@
+from __future__ import annotations
+
+import hashlib
 import io
 import json
-import os
-import pandas as pd
-import pandas_datareader as web
-import requests
-import shapefile
-import yfinance as yf
+import logging
+import mmap
+import re
+import sys
+import time
 import zipfile
-from bs4 import BeautifulSoup
-from requests import Response
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Iterator
+from data_manipulation import geostore
+from data_manipulation.providers import LIVE_PROVIDER, Provider
+from states import states
+from data_manipulation.cache import ShapeCache
 from zipfile import ZipFile
+from data_manipulation.lazy import lazy_import
+
+lxml_html = lazy_import("lxml.html")
+gpd = lazy_import("geopandas")
+pd = lazy_import("pandas")
+requests = lazy_import("requests")
+shapefile = lazy_import("shapefile")
+yf = lazy_import("yfinance")
 
 """
 The purpose of this module is to centrally consolidate data getter methods that will return 
 a source of data for data transformation methods.
 """
 
+logger: logging.Logger = logging.getLogger("market_change.fetch")
+
+DEFAULT_VINTAGE: int = 2019
+
+
+def tiger_place_url(fip: str, vintage: int = DEFAULT_VINTAGE) -> str:
+    """
+    :param fip: the two-digit state FIPS code
+    :param vintage: the year of the TIGER/Line release
+    :return: the url of the state's PLACE shapefile zip of that release, e.g. .../TIGER2019/PLACE/tl_2019_08_place.zip
+    """
+
+    return f"https://www2.census.gov/geo/tiger/TIGER{vintage}/PLACE/tl_{vintage}_{fip}_place.zip"
+
+
+_TABLE_TAG: re.Pattern = re.compile(r"<(/?)table\b([^>]*)>", re.IGNORECASE)
+
+
+def _isolate_table(html: str, table_class: str = "wikitable sortable") -> str | None:
+    """
+    :param html: the html of a whole page
+    :param table_class: the class attribute of the table to find
+    :return: the html of the first table with exactly that class attribute, nested tables included, or None
+    """
+
+    depth: int = 0
+    start: int | None = None
+    for tag in _TABLE_TAG.finditer(html):
+        closing: bool = tag.group(1) == "/"
+        if start is None:
+            if not closing and re.search(rf"""\bclass\s*=\s*["']{re.escape(table_class)}["']""", tag.group(2)):
+                start, depth = tag.start(), 1
+            continue
+        depth += -1 if closing else 1
+        if depth == 0:
+            return html[start:tag.end()]
+    return None
+
 
-def process_wikipedia_table(url: str) -> list:
+def process_wikipedia_table(url: str, provider: Provider | None = None) -> list:
     """
     This function works for getting data from wikipedia tables that are of the type wikitable sortable.
 
+    Only the target table is cut out of the page and handed to lxml, instead of building a tree of the whole page.
+
     :param url: a wikipedia url to go scrub a table from
+    :param provider: where to get the page from, defaults to the live site
     :return: a list of lists of the displayed wikipedia table
     """
 
-    res: str = requests.get(url).text
-    soup: BeautifulSoup = BeautifulSoup(res,'lxml')
-    table: BeautifulSoup.Tag = soup.find("table", class_="wikitable sortable")
+    res: str = (provider or LIVE_PROVIDER).get(url).text
+    table_html: str | None = _isolate_table(res)
+    if table_html is None:
+        return []
+    table: lxml_html.HtmlElement = lxml_html.fragment_fromstring(table_html)
     table_as_list_of_lists: list = []
-    try:
-        for items in table.find_all("tr")[:]:
-            data: list = [' '.join(item.text.split()) for item in items.find_all(['th', 'td'])]
-            table_as_list_of_lists.append(data)
-    except AttributeError:
-        pass
+    # only the table's own rows, the rows of a table nested in a cell are part of that cell's text
+    for row in table.xpath("./tr|./thead/tr|./tbody/tr|./tfoot/tr"):
+        data: list = [' '.join(item.text_content().split()) for item in row if item.tag in ("th", "td")]
+        table_as_list_of_lists.append(data)
     return table_as_list_of_lists
 
 
-def retrieve_sp_500() -> pd.DataFrame:
+def retrieve_sp_500(provider: Provider | None = None) -> pd.DataFrame:
     """
     This is a simple getter function that scrapes Wikipedia for the contents of the table that represent 
     the stocks of the 500 largest companies that compose the S&P 500. Note that it may contain MORE than
@@ -46,70 +103,479 @@ def retrieve_sp_500() -> pd.DataFrame:
     composition (2024-08-15), this table was 503 records long
     
 
+    :param provider: where to get the page from, defaults to the live site
     :return: A pandas dataframe containing companies from SP 500.
     """
 
     url: str = f"https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
-    table_as_list_of_lists: list = process_wikipedia_table(url = url)
+    table_as_list_of_lists: list = process_wikipedia_table(url = url, provider = provider)
     return pd.DataFrame(table_as_list_of_lists[1:], columns=table_as_list_of_lists[0])
 
 
-def retrieve_us_city_shape_files() -> str:
+def _is_transient(e: Exception) -> bool:
+    """
+    :param e: the exception a download failed with
+    :return: whether asking again may succeed: a network error or timeout, a 5xx or a 429 Too Many Requests response,
+        or a yfinance rate limit; client errors, bad payloads and programming errors are permanent
+    """
+
+    status: int | None = getattr(getattr(e, "response", None), "status_code", None)
+    if status is not None:
+        return status >= 500 or status == 429
+    if isinstance(e, (requests.RequestException, ConnectionError, TimeoutError)):
+        return True
+    # only a provider backed by yfinance raises its errors, in which case it is imported already
+    return "yfinance" in sys.modules and isinstance(e, yf.exceptions.YFRateLimitError)
+
+
+def _download_with_retry(url: str, timeout: float, retries: int, backoff: float, headers: dict | None = None,
+                         provider: Provider | None = None) -> tuple:
+    """
+    Issues a GET against url, retrying transient network failures with an exponential backoff. Client errors (4xx,
+    except 429 Too Many Requests) will not go away by asking again, so they are raised immediately, and so are
+    non-network failures (bad payloads, programming errors). A raised RequestException carries the number of
+    attempts that were made in its attempts attribute.
+
+    :param url: the url to download
+    :param timeout: per-request timeout in seconds, applied to both connect and read
+    :param retries: the total number of attempts to make before giving up
+    :param backoff: base delay in seconds between attempts, doubled after every failed attempt
+    :param headers: optional request headers, e.g. the validators of a conditional GET
+    :param provider: where to get the payload from, defaults to the live site
+    :return: a tuple of the successful response and the number of attempts it took
+    """
+
+    attempt: int = 1
+    while True:
+        try:
+            r: requests.Response = (provider or LIVE_PROVIDER).get(url, timeout=timeout, headers=headers)
+            r.raise_for_status()
+            return r, attempt
+        except requests.RequestException as e:
+            if attempt >= retries or not _is_transient(e):
+                e.attempts = attempt
+                raise
+            delay: float = backoff * 2 ** (attempt - 1)
+            logger.warning(f"Attempt {attempt} of {retries} for {url} failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
+
+
+class _MappedFile:
+    """
+    Lets zipfile read straight from a memory map; mmap only grew the seekable() method zipfile probes for in 3.13.
+    """
+
+    def __init__(self, mapped: mmap.mmap):
+        self._mapped: mmap.mmap = mapped
+
+    def seekable(self) -> bool:
+        return True
+
+    def __getattr__(self, name: str):
+        return getattr(self._mapped, name)
+
+
+def _read_zipped_shapefile(z: ZipFile, base_name: str) -> shapefile.Reader:
+    """
+    Opens a shapefile directly from the members of a zip archive. The .shp, .shx and .dbf members are decompressed
+    into memory and handed to the reader as file-like objects, so nothing is extracted to disk and concurrent runs
+    cannot trample each other's files. The members are buffered rather than streamed because the reader seeks
+    backwards through the .shp file, which a compressed zip stream can only do by decompressing from the start.
+
+    :param z: an open zip archive containing the shapefile
+    :param base_name: the member name of the shapefile without extension, e.g. tl_2019_01_place
+    :return: a shapefile reader over the in-memory members
+    """
+
+    members: dict = {extension: io.BytesIO(z.read(f"{base_name}.{extension}")) for extension in ["shp", "shx", "dbf"]}
+    return shapefile.Reader(**members)
+
+
+def _read_place_features(geometry: shapefile.Reader, names: set | None = None) -> dict:
+    """
+    Converts the places of a shapefile into a geojson FeatureCollection. When names are given, the .dbf records are
+    scanned first and only the shapes of matching places are decoded, so the polygons of every other place in the
+    state are never materialized.
+
+    :param geometry: a reader over a census PLACE shapefile
+    :param names: optional set of place NAMEs to keep
+    :return: the geojson FeatureCollection of the (matching) places
+    """
+
+    if names is None:
+        return geometry.__geo_interface__
+
+    matches: list = [i for i, record in enumerate(geometry.iterRecords(fields=["NAME"])) if record["NAME"] in names]
+    features: list = [shapefile.ShapeRecord(shape=geometry.shape(i), record=geometry.record(i)).__geo_interface__ for i in matches]
+    return {"type": "FeatureCollection", "bbox": list(geometry.bbox), "features": features}
+
+
+def _fetch_state_place_shapes(fip: str, timeout: float, retries: int, backoff: float, cache: ShapeCache | None = None,
+                              refresh: bool = False, names: set | None = None, provider: Provider | None = None,
+                              vintage: int = DEFAULT_VINTAGE) -> dict:
+    """
+    Downloads and parses the census PLACE shapefile for a single state. With a cache, an already parsed state is
+    returned without touching the network, and a cached zip is parsed without being downloaded again. Refreshing
+    revalidates the cached zip with the server through a conditional GET instead of trusting it.
+
+    :param fip: the two-digit state FIPS code
+    :param timeout: per-request timeout in seconds
+    :param retries: the total number of download attempts
+    :param backoff: base delay in seconds between attempts
+    :param cache: optional cache of the raw zips and their parsed geojson
+    :param refresh: revalidate the cached zip with the server before using it
+    :param names: optional set of place NAMEs to keep, every other place is skipped while parsing
+    :param provider: where to get the zip from, defaults to the census server
+    :param vintage: the year of the TIGER/Line release to download
+    :return: a dictionary with the geojson FeatureCollection under "geojson", the attempt count under "attempts"
+        and how the cache was used under "cache" ("parsed", "raw", "revalidated", "miss" or None without a cache)
+    """
+
+    zip_file_url: str = tiger_place_url(fip, vintage)
+    file_name_structure: str = zip_file_url.rsplit("/", 1)[-1]
+    content: bytes | mmap.mmap | None = None
+    cache_status: str | None = None
+    # a filtered parse is cached as its own variant of the url, keyed by the names it kept
+    variant: str = "" if names is None else "NAME=" + hashlib.sha256("|".join(sorted(names)).encode("utf-8")).hexdigest()
+
+    if cache is not None and not refresh:
+        parsed: dict | None = cache.get_parsed(zip_file_url, variant)
+        if parsed is not None:
+            return {"geojson": parsed, "attempts": 0, "cache": "parsed"}
+        content = cache.map_raw(zip_file_url)
+        cache_status = "raw" if content is not None else "miss"
+
+    attempts: int = 0
+    if content is None:
+        logger.info(f"Retrieving {fip} from {zip_file_url}")
+        headers: dict | None = cache.conditional_headers(zip_file_url) if cache is not None else None
+        r, attempts = _download_with_retry(zip_file_url, timeout=timeout, retries=retries, backoff=backoff, headers=headers,
+                                          provider=provider)
+        if cache is not None and r.status_code == 304:
+            parsed = cache.get_parsed(zip_file_url, variant)
+            if parsed is not None:
+                return {"geojson": parsed, "attempts": attempts, "cache": "revalidated"}
+            content = cache.map_raw(zip_file_url)
+            cache_status = "revalidated"
+        else:
+            content = r.content
+            if cache is not None:
+                cache.put_raw(zip_file_url, content, etag=r.headers.get("ETag"), last_modified=r.headers.get("Last-Modified"))
+                cache_status = "miss"
+
+    # a cached zip arrives memory-mapped, a fresh download as bytes; either way nothing is written to disk
+    try:
+        with zipfile.ZipFile(_MappedFile(content) if isinstance(content, mmap.mmap) else io.BytesIO(content)) as z:
+            geometry: shapefile.Reader = _read_zipped_shapefile(z, file_name_structure.replace(".zip", ""))
+        ## geometry.records() has the link between the shape # and the Name of the city and interpolated lat longs
+        ## geometry.shapes() has the polygons we will need, the __geo_interface__ will make this conveniently geojson for plotting
+        geojson_data: dict = _read_place_features(geometry, names)
+    except Exception as e:
+        # a bad payload is not retried, the attempts reported are the ones it took to download it
+        e.attempts = attempts
+        raise
+    finally:
+        if isinstance(content, mmap.mmap):
+            content.close()
+    if cache is not None:
+        cache.put_parsed(zip_file_url, geojson_data, variant)
+    return {"geojson": geojson_data, "attempts": attempts, "cache": cache_status}
+
+
+def _states_to_fetch(cache: ShapeCache | None, refresh: bool, provider: Provider | None, use_builtin_states: bool,
+                     places: set | None) -> tuple:
+    """
+    :return: the fips codes of the states to retrieve, and the place names to keep per state (None to keep all)
+    """
+
+    if use_builtin_states:
+        state_fips_iterator: list = sorted(states.get_states_df()["fips"])
+    else:
+        wiki_url: str = f"https://en.wikipedia.org/wiki/Federal_Information_Processing_Standard_state_code"
+        state_fips_codes: list | None = cache.get_parsed(wiki_url) if cache is not None and not refresh else None
+        if state_fips_codes is None:
+            state_fips_codes = process_wikipedia_table(url = wiki_url, provider = provider)
+            if cache is not None and len(state_fips_codes) > 1:
+                cache.put_parsed(wiki_url, state_fips_codes)
+        state_fips_df: pd.DataFrame = pd.DataFrame(state_fips_codes[1:], columns=state_fips_codes[0])
+        # in fips order, like the builtin states, which is the order the streamed states are numbered in
+        state_fips_iterator: list = sorted(state_fips_df["Numeric code"])
+    names_by_fips: dict | None = None
+    if places is not None:
+        names_by_fips = dict()
+        for fip, name in places:
+            names_by_fips.setdefault(fip, set()).add(name)
+        state_fips_iterator = [fip for fip in state_fips_iterator if fip in names_by_fips]
+    return state_fips_iterator, names_by_fips
+
+
+def _fetch_state_record(fip: str, names: set | None, timeout: float, retries: int, backoff: float,
+                        cache: ShapeCache | None, refresh: bool, provider: Provider | None,
+                        vintage: int = DEFAULT_VINTAGE) -> tuple:
+    """
+    :return: the report record of the state's retrieval and its geojson, None when it failed
+    """
+
+    started: float = time.perf_counter()
+    record: dict = {"fips": fip, "url": tiger_place_url(fip, vintage), "status": "ok",
+                    "attempts": 0, "seconds": 0.0, "cache": None, "error": None}
+    geojson_data: dict | None = None
+    try:
+        fetched: dict = _fetch_state_place_shapes(fip, timeout=timeout, retries=retries, backoff=backoff, cache=cache,
+                                                  refresh=refresh, names=names, provider=provider, vintage=vintage)
+        record.update(attempts=fetched["attempts"], cache=fetched["cache"])
+        geojson_data = fetched["geojson"]
+    except Exception as e:
+        # the failures of _fetch_state_place_shapes carry the attempts that were actually made
+        record.update(status="failed", attempts=getattr(e, "attempts", 0), error=f"{type(e).__name__}: {e}")
+    record["seconds"] = time.perf_counter() - started
+    if record["status"] == "failed":
+        logger.warning(f"Failed to retrieve {fip} after {record['attempts']} attempt(s): {record['error']}")
+    return record, geojson_data
+
+
+def retrieve_us_city_shape_files(max_workers: int = 8, timeout: float = 60.0, retries: int = 3, backoff: float = 1.0,
+                                 report: list | None = None, cache: ShapeCache | None = None, refresh: bool = False,
+                                 places: set | None = None, serialize: bool = True, provider: Provider | None = None,
+                                 use_builtin_states: bool = False, vintage: int = DEFAULT_VINTAGE) -> str | dict:
     """
     This function will fetch the zip files from the US census records on boundaries of US cities 
-    (https://www2.census.gov/geo/tiger/TIGER2019/PLACE/). The zip files are by STATE_FIPS code
-    (two-digit code following the year 2019 in the file names). The intended output of this retrieval
+    (https://www2.census.gov/geo/tiger/TIGER2019/PLACE/ for the 2019 vintage). The zip files are by STATE_FIPS code
+    (two-digit code following the year in the file names). The intended output of this retrieval
     will be combined with S&P 500 company headquarters information to ultimately perform visualization
     on the largest market cap by city in the US. State FIPS codes can be found here:
     https://en.wikipedia.org/wiki/Federal_Information_Processing_Standard_state_code .
-    
+
+    States are downloaded concurrently on a bounded thread pool. A state that still fails after its retries
+    is left out of the result and recorded in the report rather than aborting the whole retrieval. With a cache,
+    a warm run neither downloads nor parses anything: the FIPS table and every state's geojson are served from disk.
+    Passing the places of interest pushes the filter down into the parse: states without any of the places are not
+    downloaded at all, and within a state only the shapes of the requested places are decoded and serialized.
+
+    :param max_workers: the maximum number of states to download at the same time
+    :param timeout: per-request timeout in seconds
+    :param retries: the total number of download attempts per state
+    :param backoff: base delay in seconds between attempts, doubled after every failed attempt
+    :param report: optional list that receives one dictionary per state with its fips, url, status
+        ("ok" or "failed"), attempts, elapsed seconds, cache usage and error message
+    :param cache: optional persistent cache of the downloaded zips and their parsed geojson
+    :param refresh: revalidate every cached zip with the census server (conditional GET) instead of trusting it
+    :param places: optional set of (state fips, place NAME) tuples to restrict the output to, see
+        transform.places_of_interest
+    :param serialize: return the json string; False returns the dictionary of state fips to FeatureCollection
+    :param provider: where to get the FIPS table and the zips from, defaults to wikipedia and the census server
+    :param use_builtin_states: take the state fips codes from states.states instead of scraping them from wikipedia
+    :param vintage: the year of the TIGER/Line release to retrieve, every vintage is cached under its own urls
     :return: A json string representation of US City boundaries represented as polygons on Earth's surface
     """
 
-    wiki_url: str = f"https://en.wikipedia.org/wiki/Federal_Information_Processing_Standard_state_code"
-    state_fips_codes: list = process_wikipedia_table(url = wiki_url)
-    state_fips_df: pd.DataFrame = pd.DataFrame(state_fips_codes[1:], columns=state_fips_codes[0])
-    state_fips_iterator: list = state_fips_df["Numeric code"]
+    state_fips_iterator, names_by_fips = _states_to_fetch(cache, refresh, provider, use_builtin_states, places)
     geojson_dict: dict = dict()
 
-    try:
-        os.mkdir(f"{os.getcwd()}/tmp")
-    except FileExistsError:
-        pass
+    def timed_fetch(fip: str) -> dict:
+        record, geojson_data = _fetch_state_record(fip, None if names_by_fips is None else names_by_fips[fip], timeout,
+                                                   retries, backoff, cache, refresh, provider, vintage)
+        if geojson_data is not None:
+            geojson_dict[fip] = geojson_data
+        return record
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        records: list = list(executor.map(timed_fetch, state_fips_iterator))
 
-    for fip in state_fips_iterator:
+    logger.info(f"Retrieved {len(geojson_dict)} of {len(records)} states")
+    if cache is not None:
+        # the cache hits of the batch are written to the index once, instead of once per hit
+        cache.flush()
+        logger.info(f"Shape cache stats: {cache.stats()}")
+    if report is not None:
+        report.extend(records)
+
+    # keep the output ordered by fips regardless of which download finished first
+    ordered_geojson: dict = {fip: geojson_dict[fip] for fip in state_fips_iterator if fip in geojson_dict}
+    return json.dumps(ordered_geojson) if serialize else ordered_geojson
+
+
+def iter_us_city_shape_files(max_workers: int = 1, timeout: float = 60.0, retries: int = 3, backoff: float = 1.0,
+                             report: list | None = None, cache: ShapeCache | None = None, refresh: bool = False,
+                             places: set | None = None, provider: Provider | None = None,
+                             use_builtin_states: bool = False, vintage: int = DEFAULT_VINTAGE) -> Iterator[tuple]:
+    """
+    This function is the streaming counterpart of retrieve_us_city_shape_files: it yields the places one state at a
+    time, in fips order, and never holds more than max_workers states in memory, so that the peak is bounded by the
+    largest states instead of the whole country. A state that fails is skipped and recorded in the report.
+
+    The other arguments are those of retrieve_us_city_shape_files.
+
+    :param max_workers: the number of states in memory at once, counting the one being consumed; 1 fetches a state
+        only after the consumer is done with the previous one
+    :param report: optional list that receives one dictionary per state, see retrieve_us_city_shape_files
+    :return: an iterator over (state fips, FeatureCollection of its places) tuples
+    """
+
+    state_fips_iterator, names_by_fips = _states_to_fetch(cache, refresh, provider, use_builtin_states, places)
+    pending: deque = deque()
+    retrieved: int = 0
+
+    def submit(executor: ThreadPoolExecutor, fip: str) -> None:
+        pending.append(executor.submit(_fetch_state_record, fip, None if names_by_fips is None else names_by_fips[fip],
+                                       timeout, retries, backoff, cache, refresh, provider, vintage))
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        upcoming: Iterator = iter(state_fips_iterator)
+        for fip in islice(upcoming, max_workers):
+            submit(executor, fip)
+        while pending:
+            record, geojson_data = pending.popleft().result()
+            if report is not None:
+                report.append(record)
+            if geojson_data is not None:
+                retrieved += 1
+                yield record["fips"], geojson_data
+            # only once the consumer is done with a state is it dropped and the next one started, so the states in
+            # flight plus the one being consumed never exceed max_workers
+            del geojson_data
+            for fip in islice(upcoming, 1):
+                submit(executor, fip)
+
+    logger.info(f"Streamed {retrieved} of {len(state_fips_iterator)} states")
+    if cache is not None:
+        cache.flush()
+
+
+def retrieve_us_city_geodataframe(store_path: str, places: set | None = None, refresh: bool = False,
+                                  **retrieve_kwargs) -> gpd.GeoDataFrame:
+    """
+    This function serves the census places as a GeoDataFrame backed by a GeoParquet store. The first run retrieves
+    the shape files and writes the store; later runs memory-map the store and read only the requested places, as
+    long as the store was written for (a superset of) them.
+
+    :param store_path: the GeoParquet file holding the places
+    :param places: optional set of (state fips, place NAME) tuples to restrict the output to
+    :param refresh: rebuild the store from the census files even if it already covers the places
+    :param retrieve_kwargs: further keyword arguments for retrieve_us_city_shape_files, e.g. cache, max_workers or vintage
+    :return: a GeoDataFrame with one row per place and its STATEFP, NAME, dbf attributes and geometry; the places of
+        states that failed to download are missing and, not being covered by the store, are retried on the next run
+    """
+
+    if not refresh and geostore.place_store_covers(store_path, places):
+        logger.info(f"Reading places from {store_path}")
+        return geostore.read_place_store(store_path, places=places)
+
+    report: list | None = retrieve_kwargs.pop("report", None)
+    report = [] if report is None else report
+    geo_data: dict = retrieve_us_city_shape_files(places=places, refresh=refresh, serialize=False, report=report, **retrieve_kwargs)
+    place_data: gpd.GeoDataFrame = geostore.places_to_geodataframe(geo_data)
+    # a state that failed to download must not be recorded as covered, or its places would be missing until refresh
+    failed: set = {record["fips"] for record in report if record["status"] != "ok"}
+    coverage: set | None = places
+    if failed:
+        logger.warning(f"The store at {store_path} does not cover the places of {sorted(failed)}, they failed to download")
+        coverage = ({place for place in places if place[0] not in failed} if places is not None
+                    else set(zip(place_data["STATEFP"], place_data["NAME"])))
+    geostore.write_place_store(place_data, store_path, coverage=coverage)
+    logger.info(f"Wrote {len(place_data)} places to {store_path}")
+    return geostore.read_place_store(store_path, places=places)
+
+
+def retrieve_place_vintage(store_dir: str, vintage: int = DEFAULT_VINTAGE, places: set | None = None,
+                           refresh: bool = False, **retrieve_kwargs) -> gpd.GeoDataFrame:
+    """
+    This function serves one census vintage of the places from a vintage store shared by all vintages (see
+    geostore.write_place_vintage). A vintage missing from the store is retrieved in full, every place of every
+    state, and only its changed polygons are added to the store. A vintage is only stored once every state of it was
+    retrieved; when any state fails, nothing is written and a RuntimeError is raised.
+
+    :param store_dir: the directory of the vintage store
+    :param vintage: the year of the TIGER/Line release
+    :param places: optional set of (state fips, place NAME) tuples to restrict the output to
+    :param refresh: retrieve the vintage again even if the store holds it
+    :param retrieve_kwargs: further keyword arguments for retrieve_us_city_shape_files, e.g. cache or max_workers
+    :return: a GeoDataFrame with one row per place and its STATEFP, NAME, GEOID, dbf attributes and geometry
+    """
+
+    if refresh or vintage not in geostore.place_vintages(store_dir):
+        report: list | None = retrieve_kwargs.pop("report", None)
+        report = [] if report is None else report
+        geo_data: dict = retrieve_us_city_shape_files(refresh=refresh, serialize=False, vintage=vintage, report=report, **retrieve_kwargs)
+        # a stored vintage is never retrieved again and diffs against its full set of places, so it is all or nothing
+        failed: list = sorted(record["fips"] for record in report if record["status"] != "ok")
+        if failed:
+            raise RuntimeError(f"Not storing vintage {vintage}, the places of {', '.join(failed)} failed to download")
+        summary: dict = geostore.write_place_vintage(store_dir, vintage, geostore.places_to_geodataframe(geo_data))
+        logger.info(f"Stored the {summary['places']} places of {vintage} in {store_dir}: "
+                    f"{summary['new_geometries']} new and {summary['reused_geometries']} reused geometries")
+    return geostore.read_place_vintage(store_dir, vintage, places=places)
+
+
+def _download_ticker_chunk(symbols: list, period: str | None, interval: str, start: str | None, end: str | None,
+                           retries: int, backoff: float, provider: Provider | None = None) -> tuple:
+    """
+    Downloads one batch of symbols, retrying transient failures (see _is_transient) with an exponential backoff like
+    _download_with_retry. Any other error is raised immediately, carrying the attempts made in its attempts attribute.
+
+    :return: a tuple of the (metric, ticker) column DataFrame and the number of attempts it took
+    """
+
+    attempt: int = 1
+    while True:
         try:
-            url_base: str = f"https://www2.census.gov/geo/tiger/TIGER2019/PLACE/"
-            file_name_structure: str = f"tl_2019_{fip}_place.zip"
-            zip_file_url: str = url_base + file_name_structure
-            print(f"Retrieving {fip} from {zip_file_url}")
-            r: Response = requests.get(zip_file_url)
-            z: ZipFile = zipfile.ZipFile(io.BytesIO(r.content))
-            z.extract(file_name_structure.replace(".zip", ".shp"), path = f"""{os.getcwd()}/tmp/""")
-            z.extract(file_name_structure.replace(".zip", ".dbf"), path=f"""{os.getcwd()}/tmp/""")
-            geometry: shapefile.Reader = shapefile.Reader(f"""{os.getcwd()}/tmp/{file_name_structure.replace(".zip", ".shp")}""")
-            ## geometry.records() has the link between the shape # and the Name of the city and interpolated lat longs
-            ## geometry.shapes() has the polygons we will need, the __geo_interface__ will make this conveniently geojson for plotting
-            geojson_data = geometry.__geo_interface__
-            geojson_dict[fip] = geojson_data
+            data: pd.DataFrame = (provider or LIVE_PROVIDER).download_prices(symbols, period=period, interval=interval,
+                                                                             start=start, end=end)
+            return data, attempt
         except Exception as e:
-            print(f"Exception: {e}")
-            pass
+            if attempt >= retries or not _is_transient(e):
+                e.attempts = attempt
+                raise
+            delay: float = backoff * 2 ** (attempt - 1)
+            logger.warning(f"Attempt {attempt} of {retries} for {len(symbols)} symbols failed ({e}); retrying in {delay:.1f}s")
+            time.sleep(delay)
+            attempt += 1
 
-    return json.dumps(geojson_dict)
 
-
-def retrieve_ticker_data(sp_data: pd.DataFrame) -> dict:
+def retrieve_ticker_data(sp_data: pd.DataFrame, period: str | None = "1d", interval: str = "1d",
+                         start: str | None = None, end: str | None = None, chunk_size: int = 100,
+                         max_workers: int = 4, retries: int = 3, backoff: float = 1.0,
+                         report: list | None = None, provider: Provider | None = None) -> pd.DataFrame:
     """
     This function serves to a getter to pull stock data for a relevant list of S&P 500 companies
 
+    The symbols are downloaded in batches of chunk_size on a bounded thread pool, every batch being retried on its
+    own, and the batches are joined into a single DataFrame indexed by timestamp with (metric, ticker) columns.
+    Longer periods and intraday intervals only add rows to that frame.
+
     :param sp_data: A dataframe of stock tickers
-    :return: Pandas dataframe representation of ticker data from
+    :param period: the yfinance period to download, e.g. "1d", "5d" or "1mo"; None when start/end are given
+    :param interval: the yfinance bar size, e.g. "1d", "1h" or "5m"
+    :param start: optional first date to download, used instead of period
+    :param end: optional last date (exclusive) to download
+    :param chunk_size: the number of symbols per download
+    :param max_workers: the maximum number of batches to download at the same time
+    :param retries: the total number of download attempts per batch
+    :param backoff: base delay in seconds between attempts, doubled after every failed attempt
+    :param report: optional list that receives one dictionary per batch with its symbols, attempts, rows and seconds
+    :param provider: where to get the prices from, defaults to yahoo finance
+    :return: Pandas dataframe representation of ticker data from yahoo finance
     """
 
-    symbols = sp_data["Symbol"].unique()
-    symbols_as_string = symbols.__str__().replace("\n", "").replace("' '", " ").replace("']", "").replace("['", "")
+    symbols: list = [str(symbol) for symbol in sp_data["Symbol"].unique()]
+    if not symbols:
+        return pd.DataFrame()
+    chunks: list = [symbols[i:i + chunk_size] for i in range(0, len(symbols), chunk_size)]
+
+    def timed_download(chunk: list) -> tuple:
+        started: float = time.perf_counter()
+        data, attempts = _download_ticker_chunk(chunk, period, interval, start, end, retries, backoff, provider)
+        return data, {"symbols": chunk, "attempts": attempts, "rows": len(data), "seconds": time.perf_counter() - started}
 
-    data = yf.download(symbols_as_string, period="1d")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        results: list = list(executor.map(timed_download, chunks))
 
-    return data.to_dict()
\ No newline at end of file
+    if report is not None:
+        report.extend(record for _, record in results)
+    logger.info(f"Retrieved {period or f'{start} to {end}'} of {interval} ticker data for {len(symbols)} symbols in {len(chunks)} batches")
+    frames: list = [data for data, _ in results if not data.empty]
+    if len(frames) <= 1:
+        return frames[0] if frames else pd.DataFrame()
+    # batches are aligned on their timestamps, a symbol without a bar at some timestamp gets NaN there
+    return pd.concat(frames, axis=1)
@@ -0,0 +1,106 @@
+from __future__ import annotations
+
+import logging
+import re
+
+from data_manipulation.geostore import PLACE_STORE_CRS
+from states import states
+from data_manipulation.lazy import lazy_import
+
+gpd = lazy_import("geopandas")
+pd = lazy_import("pandas")
+
+"""
+The purpose of this module is to geocode the S&P headquarters spatially: every headquarter city is resolved to a
+point, and the point is joined to the census place polygon that contains it. Suburbs, neighbourhoods and other
+names without a polygon of their own then land in the right place without an entry in the city alias table.
+"""
+
+logger: logging.Logger = logging.getLogger("market_change.geocode")
+
+# the census gazetteer NAME carries the legal/statistical area description the TIGER NAME does not, e.g. "Cupertino city"
+_LSAD_SUFFIX: re.Pattern = re.compile(r"(?:\s+(?:[a-z]+|CDP))+$")
+
+
+def load_gazetteer(path: str) -> pd.DataFrame:
+    """
+    This function loads a local gazetteer in the layout of the census place gazetteer files, i.e. a tab separated
+    file with at least USPS, NAME, INTPTLAT and INTPTLONG columns, one row per place.
+
+    :param path: the gazetteer file, e.g. 2019_Gaz_place_national.txt
+    :return: a dataframe with fips, City Name, latitude and longitude columns, one row per city and state
+    """
+
+    gazetteer: pd.DataFrame = pd.read_csv(path, sep="\t", dtype=str, keep_default_na=False)
+    # the last column header of the census files is padded with whitespace
+    gazetteer.columns = gazetteer.columns.str.strip()
+    located: pd.DataFrame = pd.DataFrame({
+        "fips": states.map_series(gazetteer["USPS"].str.strip(), "fips"),
+        "City Name": gazetteer["NAME"].str.strip().str.replace(_LSAD_SUFFIX, "", regex=True),
+        "latitude": pd.to_numeric(gazetteer["INTPTLAT"].str.strip()),
+        "longitude": pd.to_numeric(gazetteer["INTPTLONG"].str.strip()),
+    })
+    return located[located["fips"].notnull()].drop_duplicates(subset=["fips", "City Name"], keep="first").reset_index(drop=True)
+
+
+def gazetteer_from_places(places: gpd.GeoDataFrame) -> pd.DataFrame:
+    """
+    This function builds a gazetteer from the internal points (INTPTLAT/INTPTLON) of the census place records
+    themselves, falling back to a point on the polygon when a place store was written without those attributes.
+
+    :param places: GeoDataFrame with STATEFP, NAME and geometry columns
+    :return: a dataframe with fips, City Name, latitude and longitude columns, one row per city and state
+    """
+
+    if {"INTPTLAT", "INTPTLON"} <= set(places.columns):
+        latitude: pd.Series = pd.to_numeric(places["INTPTLAT"], errors="coerce")
+        longitude: pd.Series = pd.to_numeric(places["INTPTLON"], errors="coerce")
+    else:
+        points: gpd.GeoSeries = places.geometry.representative_point()
+        latitude, longitude = points.y, points.x
+    located: pd.DataFrame = pd.DataFrame({"fips": places["STATEFP"].to_numpy(), "City Name": places["NAME"].to_numpy(),
+                                          "latitude": latitude.to_numpy(), "longitude": longitude.to_numpy()})
+    return located.dropna(subset=["latitude", "longitude"]).drop_duplicates(subset=["fips", "City Name"], keep="first").reset_index(drop=True)
+
+
+def headquarter_points(prepped_sp_data: pd.DataFrame, gazetteer: pd.DataFrame) -> gpd.GeoDataFrame:
+    """
+    :param prepped_sp_data: the output of transform.prepare_sp_companies
+    :param gazetteer: the output of load_gazetteer or gazetteer_from_places
+    :return: the companies as a GeoDataFrame of headquarter points, with an empty geometry where the city is unknown
+    """
+
+    located: pd.DataFrame = prepped_sp_data.merge(gazetteer, how="left", on=["fips", "City Name"], validate="many_to_one")
+    located.index = prepped_sp_data.index
+    points: gpd.GeoSeries = gpd.GeoSeries.from_xy(located.pop("longitude"), located.pop("latitude"), crs=PLACE_STORE_CRS)
+    return gpd.GeoDataFrame(located, geometry=points.where(points.x.notnull()), crs=PLACE_STORE_CRS)
+
+
+def locate_headquarters(prepped_sp_data: pd.DataFrame, places: gpd.GeoDataFrame,
+                        gazetteer: pd.DataFrame | None = None) -> pd.DataFrame:
+    """
+    This function replaces the City Name of every company with the NAME of the census place polygon containing its
+    headquarter point. The point-in-polygon test runs as one geopandas sjoin, which queries an STRtree built over
+    the place polygons, so n headquarters are resolved against m places in O(n log m). Companies whose point is not
+    inside a place of their own state keep their City Name.
+
+    :param prepped_sp_data: the output of transform.prepare_sp_companies
+    :param places: GeoDataFrame with STATEFP, NAME and geometry columns, e.g. read from the place store
+    :param gazetteer: optional output of load_gazetteer, defaults to the internal points of the places themselves
+    :return: the company data with City Name rewritten to the containing place names
+    """
+
+    gazetteer = gazetteer_from_places(places) if gazetteer is None else gazetteer
+    points: gpd.GeoDataFrame = headquarter_points(prepped_sp_data, gazetteer)
+    polygons: gpd.GeoDataFrame = places[["STATEFP", "NAME", "geometry"]].to_crs(points.crs)
+
+    contained: gpd.GeoDataFrame = gpd.sjoin(points[["fips", "geometry"]], polygons, how="inner", predicate="within")
+    # a headquarter only counts as located in a place of its own state, and in the first one when places overlap
+    contained = contained[contained["STATEFP"] == contained["fips"]]
+    place_names: pd.Series = contained.loc[~contained.index.duplicated(keep="first"), "NAME"]
+
+    located: pd.DataFrame = prepped_sp_data.copy()
+    names: pd.Series = place_names.reindex(located.index)
+    located["City Name"] = names.where(names.notnull(), located["City Name"])
+    logger.info(f"Spatially located {len(place_names)} of {int(prepped_sp_data['fips'].notnull().sum())} US headquarters in a place polygon")
+    return located
@@ -0,0 +1,304 @@
+from __future__ import annotations
+
+import glob
+import hashlib
+import json
+import os
+
+from data_manipulation.lazy import lazy_import
+
+gpd = lazy_import("geopandas")
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+shapely = lazy_import("shapely")
+pa = lazy_import("pyarrow")
+pq = lazy_import("pyarrow.parquet")
+
+"""
+The purpose of this module is to hold the census place geometries in a columnar GeoParquet store, so that the
+geometries are written once and later runs only read (memory-mapped) the columns and rows they need, instead of
+passing every coordinate around as a python float inside a json string.
+
+Several census vintages share one vintage store: a directory holding every distinct place polygon once, keyed by the
+GEOID of the place and a hash of its geometry, plus a small index per vintage of the places and the geometry hash
+each of them has in that year. A new vintage only adds the polygons that changed, and two vintages are diffed on
+their indexes without decoding a single geometry.
+"""
+
+
+PLACE_STORE_CRS: str = "EPSG:4269"
+PLACE_STORE_ROW_GROUP_SIZE: int = 2048
+
+
+def places_to_geodataframe(geo_data: str | dict) -> gpd.GeoDataFrame:
+    """
+    This function converts the per state geojson of retrieve_us_city_shape_files into a single GeoDataFrame.
+
+    :param geo_data: a dictionary (or its json string) of state fips code to the FeatureCollection of its places
+    :return: a GeoDataFrame with one row per place, its STATEFP, NAME and other dbf attributes and its geometry
+    """
+
+    if isinstance(geo_data, str):
+        geo_data = json.loads(geo_data)
+
+    frames: list = []
+    for fips, feature_collection in geo_data.items():
+        features: list = feature_collection.get("features", [])
+        if not features:
+            continue
+        state_places: gpd.GeoDataFrame = gpd.GeoDataFrame.from_features(features, crs=PLACE_STORE_CRS)
+        state_places["STATEFP"] = fips
+        frames.append(state_places)
+
+    if not frames:
+        return gpd.GeoDataFrame({"STATEFP": [], "NAME": []}, geometry=gpd.GeoSeries([], crs=PLACE_STORE_CRS))
+    return gpd.GeoDataFrame(pd.concat(frames, ignore_index=True), crs=PLACE_STORE_CRS)
+
+
+def _coverage_path(path: str) -> str:
+    return f"{path}.coverage.json"
+
+
+def write_place_store(places: gpd.GeoDataFrame, path: str, coverage: set | None = None) -> str:
+    """
+    Writes the places to a GeoParquet file. Rows are sorted by STATEFP and NAME and written in small row groups, so
+    the min/max statistics of those two columns act as an index that lets readers skip whole row groups.
+
+    :param places: the output of places_to_geodataframe
+    :param path: the file to write
+    :param coverage: the (state fips, place NAME) tuples the places were filtered to, None if nothing was filtered
+    :return: the path written
+    """
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    ordered: gpd.GeoDataFrame = places.sort_values(["STATEFP", "NAME"], kind="stable").reset_index(drop=True)
+    ordered.to_parquet(path, index=False, row_group_size=PLACE_STORE_ROW_GROUP_SIZE)
+    with open(_coverage_path(path), "w") as f:
+        json.dump(None if coverage is None else sorted(list(place) for place in coverage), f)
+    return path
+
+
+def place_store_covers(path: str, places: set | None = None) -> bool:
+    """
+    :param path: a place store written by write_place_store
+    :param places: the (state fips, place NAME) tuples a caller needs, None for all places
+    :return: whether the store exists and holds every place the caller needs
+    """
+
+    try:
+        with open(_coverage_path(path)) as f:
+            coverage: list | None = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return False
+    if not os.path.exists(path):
+        return False
+    if coverage is None:
+        return True
+    return places is not None and places <= {tuple(place) for place in coverage}
+
+
+def read_place_store(path: str, places: set | None = None, columns: list | None = None) -> gpd.GeoDataFrame:
+    """
+    Reads places back from a GeoParquet store. The file is memory-mapped and only the requested columns are decoded;
+    with places, row groups whose STATEFP statistics cannot match are skipped before the exact pairs are selected.
+
+    :param path: a place store written by write_place_store
+    :param places: optional set of (state fips, place NAME) tuples to read
+    :param columns: optional list of attribute columns to read besides STATEFP, NAME and geometry
+    :return: a GeoDataFrame of the requested places
+    """
+
+    read_columns: list | None = None
+    if columns is not None:
+        read_columns = list(dict.fromkeys(["STATEFP", "NAME", *columns, "geometry"]))
+
+    filters: list | None = None
+    if places is not None:
+        fips_codes: list = sorted({fips for fips, _ in places})
+        names: list = sorted({name for _, name in places})
+        if not fips_codes:
+            return gpd.read_parquet(path, columns=read_columns, memory_map=True).iloc[0:0]
+        filters = [("STATEFP", "in", fips_codes), ("NAME", "in", names)]
+
+    stored: gpd.GeoDataFrame = gpd.read_parquet(path, columns=read_columns, filters=filters, memory_map=True)
+    if places is not None:
+        wanted: pd.MultiIndex = pd.MultiIndex.from_tuples(sorted(places), names=["STATEFP", "NAME"])
+        stored = stored[pd.MultiIndex.from_frame(stored[["STATEFP", "NAME"]]).isin(wanted)]
+    return stored.reset_index(drop=True)
+
+
+def place_store_schema(path: str) -> list:
+    """
+    :param path: a place store written by write_place_store
+    :return: the column names held by the store, without reading any rows
+    """
+
+    return pq.read_schema(path).names
+
+
+VINTAGE_STATUSES: tuple = ("added", "removed", "changed", "renamed")
+
+
+def _write_parquet(table: pa.Table, path: str) -> None:
+    # written aside and moved in place, so a reader never sees half of a file
+    tmp_path: str = f"{path}.{os.getpid()}.tmp"
+    pq.write_table(table, tmp_path, row_group_size=PLACE_STORE_ROW_GROUP_SIZE)
+    os.replace(tmp_path, path)
+
+
+def geometry_hashes(geometries: np.ndarray) -> np.ndarray:
+    """
+    :param geometries: an array of shapely geometries
+    :return: a 128 bit blake2b digest of the normalized WKB of every geometry, as hex strings; None for a missing
+        geometry. Normalizing first makes the hash independent of the ring orientation and starting vertex.
+    """
+
+    wkb: np.ndarray = shapely.to_wkb(shapely.normalize(np.asarray(geometries)))
+    return np.array([None if b is None else hashlib.blake2b(b, digest_size=16).hexdigest() for b in wkb], dtype=object)
+
+
+def place_geoids(places: gpd.GeoDataFrame) -> pd.Series:
+    """
+    :param places: the output of places_to_geodataframe or read_place_store
+    :return: the GEOID of every place, from its GEOID attribute or else from its STATEFP and PLACEFP
+    """
+
+    if "GEOID" in places.columns:
+        return places["GEOID"].astype(str)
+    if "PLACEFP" in places.columns:
+        return places["STATEFP"].astype(str) + places["PLACEFP"].astype(str)
+    raise ValueError("The places need a GEOID or a PLACEFP attribute to be stored by vintage")
+
+
+def _vintage_path(directory: str, vintage: int) -> str:
+    return os.path.join(directory, "vintages", f"{vintage}.parquet")
+
+
+def place_vintages(directory: str) -> list:
+    """
+    :param directory: a vintage store
+    :return: the vintages held by the store, in ascending order
+    """
+
+    return sorted(int(os.path.basename(path)[:-len(".parquet")]) for path in glob.glob(os.path.join(directory, "vintages", "*.parquet")))
+
+
+def _stored_geometry_keys(directory: str) -> pd.MultiIndex:
+    parts: list = sorted(glob.glob(os.path.join(directory, "geometries", "*.parquet")))
+    if not parts:
+        return pd.MultiIndex.from_arrays([[], []], names=["GEOID", "geometry_hash"])
+    stored: pd.DataFrame = pq.read_table(parts, columns=["GEOID", "geometry_hash"]).to_pandas()
+    return pd.MultiIndex.from_frame(stored)
+
+
+def _read_stored_geometries(directory: str, keys: pd.MultiIndex) -> pd.DataFrame:
+    """
+    Reads the geometries of the given (GEOID, geometry hash) keys from the geometry table of a vintage store. The key
+    columns of every row group are read first, and the geometry column only of the row groups holding one of the
+    keys, for just the rows that match, so the boundaries only other vintages reference are never read.
+
+    :param directory: a vintage store
+    :param keys: the (GEOID, geometry_hash) pairs to read
+    :return: a dataframe of GEOID, geometry_hash and the WKB geometry, one row per stored key
+    """
+
+    matched: list = []
+    for part in sorted(glob.glob(os.path.join(directory, "geometries", "*.parquet"))):
+        parquet_file: pq.ParquetFile = pq.ParquetFile(part, memory_map=True)
+        for row_group in range(parquet_file.num_row_groups):
+            stored: pd.DataFrame = parquet_file.read_row_group(row_group, columns=["GEOID", "geometry_hash"]).to_pandas()
+            rows: np.ndarray = np.flatnonzero(pd.MultiIndex.from_frame(stored).isin(keys))
+            if len(rows):
+                geometry: pa.Array = parquet_file.read_row_group(row_group, columns=["geometry"]).column(0).take(pa.array(rows))
+                matched.append(stored.iloc[rows].assign(geometry=geometry.to_numpy(zero_copy_only=False)))
+    if not matched:
+        return pd.DataFrame({"GEOID": [], "geometry_hash": [], "geometry": []})
+    return pd.concat(matched, ignore_index=True).drop_duplicates(subset=["GEOID", "geometry_hash"])
+
+
+def write_place_vintage(directory: str, vintage: int, places: gpd.GeoDataFrame) -> dict:
+    """
+    Adds a vintage to a vintage store. Only the (GEOID, geometry hash) pairs the store does not hold yet are written,
+    to a new part of the geometry table, so the store grows with the boundaries that changed rather than with the
+    number of vintages. Writing a vintage again replaces its index, the geometries already stored are kept.
+
+    :param directory: the vintage store, created when missing
+    :param vintage: the year of the TIGER/Line release the places are from
+    :param places: every place of the vintage, the output of places_to_geodataframe, with a GEOID or PLACEFP
+    :return: a summary of the vintage, its places and the geometries it added and reused
+    """
+
+    os.makedirs(os.path.join(directory, "geometries"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "vintages"), exist_ok=True)
+    located: gpd.GeoDataFrame = places[places.geometry.notna()]
+    geometries: np.ndarray = np.asarray(located.geometry.values)
+    index: pd.DataFrame = pd.DataFrame(located.drop(columns=located.geometry.name)).reset_index(drop=True)
+    index["GEOID"] = place_geoids(located).to_numpy()
+    index["geometry_hash"] = geometry_hashes(geometries)
+
+    keys: pd.MultiIndex = pd.MultiIndex.from_frame(index[["GEOID", "geometry_hash"]])
+    new: np.ndarray = ~keys.isin(_stored_geometry_keys(directory)) & ~keys.duplicated()
+    if new.any():
+        part: str = os.path.join(directory, "geometries", f"{vintage}-{len(glob.glob(os.path.join(directory, 'geometries', '*.parquet'))):05d}.parquet")
+        _write_parquet(pa.table({
+            "GEOID": pa.array(index["GEOID"].to_numpy()[new], pa.string()),
+            "geometry_hash": pa.array(index["geometry_hash"].to_numpy()[new], pa.string()),
+            "geometry": pa.array(shapely.to_wkb(geometries[new]), pa.binary()),
+        }), part)
+    # the index goes in last, a vintage is only listed once all of its geometries are stored
+    ordered: pd.DataFrame = index.sort_values(["STATEFP", "NAME"], kind="stable").reset_index(drop=True)
+    _write_parquet(pa.Table.from_pandas(ordered, preserve_index=False), _vintage_path(directory, vintage))
+
+    return {"vintage": vintage, "places": len(index), "new_geometries": int(new.sum()),
+            "reused_geometries": int(len(index) - keys.duplicated().sum() - new.sum())}
+
+
+def read_place_vintage(directory: str, vintage: int, places: set | None = None) -> gpd.GeoDataFrame:
+    """
+    Reads a vintage back from a vintage store: its index is filtered to the requested places first, and only the
+    geometries those places reference are read and decoded, see _read_stored_geometries.
+
+    :param directory: a vintage store
+    :param vintage: one of place_vintages(directory)
+    :param places: optional set of (state fips, place NAME) tuples to read
+    :return: a GeoDataFrame of the places of the vintage with their attributes, geometry_hash and geometry, like
+        read_place_store
+    """
+
+    index: pd.DataFrame = pq.read_table(_vintage_path(directory, vintage)).to_pandas()
+    if places is not None:
+        wanted: pd.MultiIndex = pd.MultiIndex.from_tuples(sorted(places), names=["STATEFP", "NAME"])
+        index = index[pd.MultiIndex.from_frame(index[["STATEFP", "NAME"]]).isin(wanted)].reset_index(drop=True)
+
+    stored: pd.DataFrame = _read_stored_geometries(directory, pd.MultiIndex.from_frame(index[["GEOID", "geometry_hash"]]))
+    located: pd.DataFrame = index.merge(stored, how="left", on=["GEOID", "geometry_hash"], validate="many_to_one")
+    geometry: gpd.GeoSeries = gpd.GeoSeries(shapely.from_wkb(located.pop("geometry").to_numpy()), crs=PLACE_STORE_CRS)
+    return gpd.GeoDataFrame(located, geometry=geometry, crs=PLACE_STORE_CRS)
+
+
+def diff_place_vintages(directory: str, old: int, new: int) -> pd.DataFrame:
+    """
+    Compares two vintages of a vintage store on their indexes alone: a place whose geometry hash differs changed its
+    boundary, the geometries themselves are never read.
+
+    :param directory: a vintage store
+    :param old: the earlier vintage
+    :param new: the later vintage
+    :return: one row per place that differs, with its GEOID, STATEFP, the NAME in both vintages, the geometry hash in
+        both vintages and its status: added, removed, changed (its boundary) or renamed (same boundary, new NAME)
+    """
+
+    columns: list = ["GEOID", "STATEFP", "NAME", "geometry_hash"]
+    before: pd.DataFrame = pq.read_table(_vintage_path(directory, old), columns=columns).to_pandas()
+    after: pd.DataFrame = pq.read_table(_vintage_path(directory, new), columns=columns).to_pandas()
+    merged: pd.DataFrame = before.merge(after, how="outer", on="GEOID", suffixes=(f"_{old}", f"_{new}"), indicator=True)
+
+    status: np.ndarray = np.select(
+        [merged["_merge"] == "right_only", merged["_merge"] == "left_only",
+         merged[f"geometry_hash_{old}"] != merged[f"geometry_hash_{new}"], merged[f"NAME_{old}"] != merged[f"NAME_{new}"]],
+        list(VINTAGE_STATUSES), default="")
+    merged["STATEFP"] = merged[f"STATEFP_{new}"].fillna(merged[f"STATEFP_{old}"])
+    merged["status"] = status
+    diff: pd.DataFrame = merged[status != ""]
+    return diff[["GEOID", "STATEFP", f"NAME_{old}", f"NAME_{new}", f"geometry_hash_{old}", f"geometry_hash_{new}", "status"]] \
+        .sort_values("GEOID", kind="stable").reset_index(drop=True)
@@ -0,0 +1,80 @@
+import importlib
+import sys
+import threading
+import types
+from typing import Any
+
+"""
+The purpose of this module is to defer the import of the heavy dependencies (pandas, geopandas, yfinance, folium...)
+to their first use, so that the console script, its short subcommands and the process pool workers only pay for the
+libraries they actually touch. A module binds a proxy in place of the import statement:
+
+    pd = lazy_import("pandas")
+
+and uses pd exactly as before. Annotations that name a lazily imported module are kept unevaluated with
+from __future__ import annotations, so defining a function does not import anything.
+"""
+
+_lock: threading.RLock = threading.RLock()
+
+
+class _LazyModule(types.ModuleType):
+    """
+    Stands in for a module until one of its attributes is read, then imports it and forwards every attribute access
+    to it. Setting and deleting attributes are forwarded as well, so that mock.patch("pkg.mod.pd.read_csv") patches
+    the real module, just like it would have with a plain import.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        object.__setattr__(self, "_lazy_module", None)
+
+    def _load(self) -> types.ModuleType:
+        module: types.ModuleType | None = object.__getattribute__(self, "_lazy_module")
+        if module is None:
+            with _lock:
+                module = object.__getattribute__(self, "_lazy_module")
+                if module is None:
+                    module = importlib.import_module(object.__getattribute__(self, "__name__"))
+                    object.__setattr__(self, "_lazy_module", module)
+        return module
+
+    def __getattr__(self, name: str) -> Any:
+        # only called for the attributes the proxy itself does not have, i.e. everything but its name
+        return getattr(self._load(), name)
+
+    def __setattr__(self, name: str, value: Any) -> None:
+        setattr(self._load(), name, value)
+
+    def __delattr__(self, name: str) -> None:
+        delattr(self._load(), name)
+
+    def __dir__(self) -> list:
+        return dir(self._load())
+
+    def __repr__(self) -> str:
+        module: types.ModuleType | None = object.__getattribute__(self, "_lazy_module")
+        name: str = object.__getattribute__(self, "__name__")
+        return repr(module) if module is not None else f"<lazy module '{name}' (not imported)>"
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """
+    :param name: the absolute name of the module, e.g. "pandas" or "lxml.html"
+    :return: the module itself when it was already imported, else a proxy that imports it on first attribute access
+    """
+
+    if name in sys.modules:
+        return sys.modules[name]
+    return _LazyModule(name)
+
+
+def is_imported(module: types.ModuleType) -> bool:
+    """
+    :param module: a module or a proxy returned by lazy_import
+    :return: whether the module behind it has been imported
+    """
+
+    if isinstance(module, _LazyModule):
+        return object.__getattribute__(module, "_lazy_module") is not None
+    return True
@@ -0,0 +1,157 @@
+from __future__ import annotations
+
+import json
+import logging
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from data_manipulation import transform
+from data_manipulation.geostore import places_to_geodataframe
+from data_manipulation.lazy import lazy_import
+
+gpd = lazy_import("geopandas")
+pd = lazy_import("pandas")
+pa = lazy_import("pyarrow")
+np = lazy_import("numpy")
+shapely = lazy_import("shapely")
+
+"""
+The purpose of this module is to spread the join of the companies to their place polygons, and the aggregation by
+city, over a process pool, one state per task. The place geometry is handed to the workers as an Arrow IPC file with
+one record batch per state, which every worker memory-maps once and reads its state's batch from without a copy,
+instead of having the polygons pickled into every task. The workers hand their cities back with the geometry still
+as WKB, which pickles much smaller and faster than GeoJSON dicts, and the parent decodes it once, after the merge.
+"""
+
+logger: logging.Logger = logging.getLogger("market_change.parallel")
+
+# per worker process state, set once by _init_worker instead of being pickled with every task
+_worker_places: pa.ipc.RecordBatchFileReader | None = None
+_worker_change: pd.DataFrame | None = None
+
+
+def write_place_batches(places: gpd.GeoDataFrame, path: str) -> dict:
+    """
+    This function writes the places to an Arrow IPC file with one record batch per state, the geometry as WKB.
+
+    :param places: GeoDataFrame with STATEFP, NAME and geometry columns
+    :param path: the file to write
+    :return: a dictionary of state fips to the index of its record batch
+    """
+
+    schema: pa.Schema = pa.schema([("STATEFP", pa.string()), ("NAME", pa.string()), ("geometry", pa.binary())])
+    batch_index: dict = dict()
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, schema) as writer:
+        for fips, state_places in places.groupby("STATEFP", sort=True):
+            writer.write_batch(pa.record_batch([
+                pa.array(state_places["STATEFP"].to_numpy(dtype=object), pa.string()),
+                pa.array(state_places["NAME"].to_numpy(dtype=object), pa.string()),
+                pa.array(shapely.to_wkb(np.asarray(state_places.geometry.values)), pa.binary()),
+            ], schema=schema))
+            batch_index[fips] = len(batch_index)
+    return batch_index
+
+
+def _init_worker(places_path: str, change_by_symbol_df: pd.DataFrame) -> None:
+    global _worker_places, _worker_change
+    _worker_places = pa.ipc.open_file(pa.memory_map(places_path, "r"))
+    _worker_change = change_by_symbol_df
+
+
+def _join_state(fips: str, batch: int, state_companies: pd.DataFrame) -> tuple:
+    """
+    :return: the state's companies with their state_fips and city (without the geometry, for logging) and its cities
+        aggregated as transform.aggregate_city_frame returns them, but with their geometry as WKB
+    """
+
+    state_places: pa.RecordBatch = _worker_places.get_batch(batch)
+    names: np.ndarray = state_places.column(1).to_numpy(zero_copy_only=False)
+    matches: np.ndarray = np.flatnonzero(np.isin(names, state_companies["City Name"].unique()))
+    wkb: np.ndarray = state_places.column(2).take(pa.array(matches)).to_numpy(zero_copy_only=False)
+    city_data_df: pd.DataFrame = pd.DataFrame({"state_fips": fips, "city": names[matches], "geometry": wkb},
+                                              columns=["state_fips", "city", "geometry"])
+
+    state_sp_data_with_geo: pd.DataFrame = pd.merge(state_companies, city_data_df, how="left", left_on=["fips", "City Name"], right_on=["state_fips", "city"])
+    city_frame: pd.DataFrame = transform.aggregate_city_frame(state_sp_data_with_geo, _worker_change)
+    return state_sp_data_with_geo.drop("geometry", axis=1), city_frame
+
+
+def _geojson_geometries(wkb: np.ndarray) -> list:
+    """
+    :param wkb: an object array of WKB geometries, None where a city has no geometry
+    :return: the geometries as GeoJSON dicts, the way the serial join holds them
+    """
+
+    return [None if g is None else json.loads(g) for g in shapely.to_geojson(shapely.from_wkb(wkb))]
+
+
+def parallel_join_ticker_data_to_geodata(sp_companies: pd.DataFrame, ticker_data: dict | pd.DataFrame,
+                                         geo_data: str | gpd.GeoDataFrame, city_aliases: pd.DataFrame | None = None,
+                                         geocoding: str = "name", gazetteer: pd.DataFrame | None = None,
+                                         max_workers: int | None = None):
+    """
+    This function is the process pool counterpart of transform.join_ticker_data_to_geodata: every state with a
+    headquarter is joined to its places and aggregated by city in a task of its own. A city never spans two states,
+    so the cities of all the states merged back together, in the order the serial join sorts them in, are exactly
+    the serial join's result.
+
+    :param sp_companies: Dataframe of S&P Company data, must include Symbol and Headquarter information
+    :param ticker_data: Yahoo finance dataframe that has close data for all the relevant symbols, or its to_dict() form
+    :param geo_data: jsonlike string of all the city polygon information, or a GeoDataFrame of places with STATEFP,
+        NAME and geometry columns such as fetch.retrieve_us_city_geodataframe returns
+    :param city_aliases: see transform.join_ticker_data_to_geodata
+    :param geocoding: see transform.join_ticker_data_to_geodata
+    :param gazetteer: see transform.join_ticker_data_to_geodata
+    :param max_workers: the number of worker processes, defaults to the number of cpus
+    :return: a geojson object that can be used to create a map from, and the map data
+    """
+
+    prepped_sp_data, geo_data = transform.prepare_geocoded_companies(sp_companies, geo_data, city_aliases, geocoding, gazetteer)
+    # the change is computed once, every worker receives it with its initializer
+    change_by_symbol_df: pd.DataFrame = transform.compute_symbol_change(ticker_data, prepped_sp_data["Symbol"].unique())
+
+    return parallel_aggregate_change_by_city(prepped_sp_data, geo_data, change_by_symbol_df, max_workers)
+
+
+def parallel_aggregate_change_by_city(prepped_sp_data: pd.DataFrame, geo_data: str | gpd.GeoDataFrame,
+                                      change_by_symbol_df: pd.DataFrame, max_workers: int | None = None):
+    """
+    This function geoenhances the companies and sums their change up to their headquarter city, one state per
+    process; it does what transform.geoenhance_companies followed by transform.aggregate_change_by_city does.
+
+    :param prepped_sp_data: the output of transform.prepare_sp_companies (or of geocode.locate_headquarters)
+    :param geo_data: the place geometry, see transform.geoenhance_companies
+    :param change_by_symbol_df: the output of transform.compute_symbol_change
+    :param max_workers: the number of worker processes, defaults to the number of cpus
+    :return: the geojson of the cities and the map data, as transform.aggregate_change_by_city returns them
+    """
+
+    if not isinstance(geo_data, gpd.GeoDataFrame):
+        geo_data = places_to_geodataframe(geo_data)
+    located: pd.DataFrame = prepped_sp_data[prepped_sp_data["fips"].notnull()]
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        places_path: str = os.path.join(tmp_dir, "places.arrow")
+        batch_index: dict = write_place_batches(geo_data[geo_data["STATEFP"].isin(located["fips"].unique())], places_path)
+        shards: list = [(fips, batch_index[fips], state_companies)
+                        for fips, state_companies in located.groupby("fips", sort=True) if fips in batch_index]
+        results: list = []
+        if shards:
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                     initargs=(places_path, change_by_symbol_df)) as executor:
+                results = list(executor.map(_join_state, *zip(*shards)))
+    logger.info(f"Joined the companies of {len(shards)} states on a pool of {max_workers or os.cpu_count()} processes")
+
+    # the companies of states without any place are logged as not geoenhanced, like the serial join does
+    unsharded: pd.DataFrame = prepped_sp_data[~prepped_sp_data["fips"].isin(batch_index)].assign(state_fips=None, city=None)
+    transform.log_geoenhancement(pd.concat([state_companies for state_companies, _ in results] + [unsharded]))
+
+    final_df: pd.DataFrame = pd.concat([city_frame for _, city_frame in results] or [pd.DataFrame(columns=transform.CITY_COLUMNS)], ignore_index=True)
+    # every state numbered its cities from 0; the shards come back in fips order, which is the order the serial join
+    # numbers the cities in (see transform.city_tables), so they are numbered on across the states
+    final_df["id"] = np.arange(len(final_df))
+    final_df["geometry"] = _geojson_geometries(final_df["geometry"].to_numpy(dtype=object))
+
+    map_geometry, map_data = transform.forge_geojson(final_df)
+    return map_geometry, map_data.drop("geometry", axis=1).drop_duplicates()
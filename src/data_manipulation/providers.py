@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import abc
+import hashlib
+import json
+import os
+import pickle
+import threading
+import time
+
+from data_manipulation.cache import ShapeCache
+from data_manipulation.lazy import lazy_import
+
+pd = lazy_import("pandas")
+requests = lazy_import("requests")
+yf = lazy_import("yfinance")
+
+"""
+The purpose of this module is to decouple the fetch methods from where their payloads come from. A provider serves
+the http payloads (the wikipedia tables and the census shape files) and the price downloads; the live provider goes
+to the network, the replay provider serves payloads recorded earlier from a directory, at a configurable latency,
+so that the whole pipeline can be run and benchmarked offline and deterministically.
+"""
+
+
+class Provider(abc.ABC):
+    """
+    The interface the fetch methods get their data through. Subclass it to plug in another source, e.g. an internal
+    price feed, implementing both get and download_prices, and pass an instance as the provider argument of the
+    fetch methods.
+    """
+
+    @abc.abstractmethod
+    def get(self, url: str, timeout: float | None = None, headers: dict | None = None) -> requests.Response:
+        """
+        :param url: the url to GET
+        :param timeout: per-request timeout in seconds
+        :param headers: optional request headers, e.g. the validators of a conditional GET
+        :return: the response, its raise_for_status() is called by the caller
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def download_prices(self, symbols: list, period: str | None = "1d", interval: str = "1d",
+                        start: str | None = None, end: str | None = None) -> pd.DataFrame:
+        """
+        :param symbols: the ticker symbols to download
+        :param period: the period to download, e.g. "1d" or "1mo"; None when start/end are given
+        :param interval: the bar size, e.g. "1d" or "5m"
+        :param start: optional first date to download
+        :param end: optional last date (exclusive) to download
+        :return: a DataFrame indexed by timestamp with (metric, ticker) columns, shaped like yfinance.download
+        """
+        raise NotImplementedError
+
+    def __repr__(self) -> str:
+        # the repr is part of the pipeline's stage fingerprints, so it must be stable across runs
+        return f"{type(self).__name__}()"
+
+
+class LiveProvider(Provider):
+    """
+    Serves http payloads with requests and prices with yfinance.
+    """
+
+    def get(self, url: str, timeout: float | None = None, headers: dict | None = None) -> requests.Response:
+        return requests.get(url, timeout=timeout, headers=headers)
+
+    def download_prices(self, symbols: list, period: str | None = "1d", interval: str = "1d",
+                        start: str | None = None, end: str | None = None) -> pd.DataFrame:
+        # the fetch methods download batches concurrently already, so yfinance must not spawn threads of its own
+        return yf.download(symbols, period=period, interval=interval, start=start, end=end,
+                           group_by="column", auto_adjust=False, threads=False, progress=False)
+
+
+class SessionProvider(LiveProvider):
+    """
+    Serves http payloads over one pooled requests.Session, so repeated requests to the same host reuse their
+    connections. With a cache, every payload is kept on disk with its ETag/Last-Modified validators and later
+    requests for the url are conditional: a 304 from the server is answered from the cache. Requests that carry
+    headers of their own, even none yet (the shape file retrieval manages its cache entries and validators itself),
+    are passed through as is and never stored, so a payload is not kept twice with validators that drift apart.
+    """
+
+    def __init__(self, cache: ShapeCache | None = None, pool_maxsize: int = 16):
+        self.cache: ShapeCache | None = cache
+        self.session: requests.Session = requests.Session()
+        adapter: requests.adapters.HTTPAdapter = requests.adapters.HTTPAdapter(pool_connections=pool_maxsize, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(cache={None if self.cache is None else self.cache.directory!r})"
+
+    def get(self, url: str, timeout: float | None = None, headers: dict | None = None) -> requests.Response:
+        if self.cache is None or headers is not None:
+            return self.session.get(url, timeout=timeout, headers=headers)
+
+        r: requests.Response = self.session.get(url, timeout=timeout, headers=self.cache.conditional_headers(url))
+        if r.status_code == 304:
+            content: bytes | None = self.cache.get_raw(url)
+            if content is not None:
+                # the caller asked unconditionally, so it gets the full payload back
+                r.status_code, r._content = 200, content
+                r.encoding = r.encoding or "utf-8"
+                return r
+            r = self.session.get(url, timeout=timeout)
+        if r.status_code == 200:
+            self.cache.put_raw(url, r.content, etag=r.headers.get("ETag"), last_modified=r.headers.get("Last-Modified"))
+        return r
+
+
+def _url_key(url: str) -> str:
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+def _prices_key(period: str | None, interval: str, start: str | None, end: str | None) -> str:
+    description: str = json.dumps({"period": period, "interval": interval, "start": start, "end": end}, sort_keys=True)
+    return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+
+class ReplayProvider(Provider):
+    """
+    Serves the payloads a RecordingProvider wrote to directory:
+
+        http/<sha256 of url>.bin       the response body
+        http/<sha256 of url>.json      the url, status code and headers
+        prices/<sha256 of request>.pickle  every symbol recorded for a period/interval/start/end
+
+    Every call sleeps for latency seconds first, to stand in for the round trip of the live source. A payload that
+    was never recorded raises FileNotFoundError.
+    """
+
+    def __init__(self, directory: str, latency: float = 0.0):
+        self.directory: str = directory
+        self.latency: float = latency
+        self._prices: dict = dict()
+        self._lock: threading.Lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.directory!r}, latency={self.latency!r})"
+
+    def get(self, url: str, timeout: float | None = None, headers: dict | None = None) -> requests.Response:
+        time.sleep(self.latency)
+        path: str = os.path.join(self.directory, "http", _url_key(url))
+        try:
+            with open(f"{path}.json") as f:
+                meta: dict = json.load(f)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"No recorded payload for {url} in {self.directory}") from None
+
+        r: requests.Response = requests.Response()
+        r.url = url
+        r.headers.update(meta.get("headers", dict()))
+        etag: str | None = r.headers.get("ETag")
+        if etag is not None and (headers or dict()).get("If-None-Match") == etag:
+            r.status_code, r._content = 304, b""
+            return r
+        r.status_code = meta["status_code"]
+        with open(f"{path}.bin", "rb") as f:
+            r._content = f.read()
+        r.encoding = meta.get("encoding")
+        return r
+
+    def download_prices(self, symbols: list, period: str | None = "1d", interval: str = "1d",
+                        start: str | None = None, end: str | None = None) -> pd.DataFrame:
+        time.sleep(self.latency)
+        key: str = _prices_key(period, interval, start, end)
+        with self._lock:
+            if key not in self._prices:
+                path: str = os.path.join(self.directory, "prices", f"{key}.pickle")
+                try:
+                    with open(path, "rb") as f:
+                        self._prices[key] = pickle.load(f)
+                except FileNotFoundError:
+                    raise FileNotFoundError(f"No recorded prices for period={period}, interval={interval}, start={start}, "
+                                            f"end={end} in {self.directory}") from None
+        recorded: pd.DataFrame = self._prices[key]
+        # like yfinance, symbols without data are simply missing from the frame
+        return recorded.loc[:, recorded.columns.get_level_values(1).isin(symbols)]
+
+
+class RecordingProvider(Provider):
+    """
+    Passes every call through to another provider and records its payloads in the layout ReplayProvider reads.
+    """
+
+    def __init__(self, provider: Provider, directory: str):
+        self.provider: Provider = provider
+        self.directory: str = directory
+        self._lock: threading.Lock = threading.Lock()
+        os.makedirs(os.path.join(directory, "http"), exist_ok=True)
+        os.makedirs(os.path.join(directory, "prices"), exist_ok=True)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.provider!r}, {self.directory!r})"
+
+    def get(self, url: str, timeout: float | None = None, headers: dict | None = None) -> requests.Response:
+        r: requests.Response = self.provider.get(url, timeout=timeout, headers=headers)
+        # a 304 only makes sense against the payload recorded before it
+        if r.status_code != 304:
+            path: str = os.path.join(self.directory, "http", _url_key(url))
+            with open(f"{path}.bin", "wb") as f:
+                f.write(r.content)
+            with open(f"{path}.json", "w") as f:
+                json.dump({"url": url, "status_code": r.status_code, "encoding": r.encoding,
+                           "headers": {name: r.headers[name] for name in ("ETag", "Last-Modified", "Content-Type") if name in r.headers}}, f)
+        return r
+
+    def download_prices(self, symbols: list, period: str | None = "1d", interval: str = "1d",
+                        start: str | None = None, end: str | None = None) -> pd.DataFrame:
+        data: pd.DataFrame = self.provider.download_prices(symbols, period=period, interval=interval, start=start, end=end)
+        if not isinstance(data.columns, pd.MultiIndex):
+            return data
+        path: str = os.path.join(self.directory, "prices", f"{_prices_key(period, interval, start, end)}.pickle")
+        # the batches of a download arrive concurrently, every one is merged into the same recording
+        with self._lock:
+            try:
+                with open(path, "rb") as f:
+                    recorded: pd.DataFrame = pickle.load(f)
+                recorded = recorded.loc[:, ~recorded.columns.get_level_values(1).isin(data.columns.get_level_values(1))]
+                data_to_record: pd.DataFrame = pd.concat([recorded, data], axis=1)
+            except FileNotFoundError:
+                data_to_record = data
+            with open(path, "wb") as f:
+                pickle.dump(data_to_record, f, protocol=pickle.HIGHEST_PROTOCOL)
+        return data
+
+
+class MeteredProvider(Provider):
+    """
+    Passes every call through to another provider and counts the bytes it served in bytes_downloaded: the bodies
+    of the http payloads and, as yfinance does not expose what went over the wire, the in-memory size of the price
+    frames.
+    """
+
+    def __init__(self, provider: Provider):
+        self.provider: Provider = provider
+        self.bytes_downloaded: int = 0
+        self._lock: threading.Lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        # metering does not change any payload, so it must not change the pipeline's stage fingerprints either
+        return repr(self.provider)
+
+    def _count(self, n: int) -> None:
+        with self._lock:
+            self.bytes_downloaded += n
+
+    def get(self, url: str, timeout: float | None = None, headers: dict | None = None) -> requests.Response:
+        r: requests.Response = self.provider.get(url, timeout=timeout, headers=headers)
+        self._count(len(r.content or b""))
+        return r
+
+    def download_prices(self, symbols: list, period: str | None = "1d", interval: str = "1d",
+                        start: str | None = None, end: str | None = None) -> pd.DataFrame:
+        data: pd.DataFrame = self.provider.download_prices(symbols, period=period, interval=interval, start=start, end=end)
+        self._count(int(data.memory_usage(deep=True).sum()))
+        return data
+
+
+LIVE_PROVIDER: Provider = LiveProvider()
@@ -0,0 +1,146 @@
+from __future__ import annotations
+
+import io
+import json
+import math
+from typing import Any, Iterable, Iterator, TextIO
+
+from data_manipulation.lazy import lazy_import
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+"""
+The purpose of this module is to serialize dataframes with a geometry column into GeoJSON FeatureCollections,
+feature by feature, so that a collection can be streamed to a file without holding the whole document in memory.
+"""
+
+
+def round_coordinates(coordinates: Any, precision: int) -> Any:
+    """
+    :param coordinates: a geojson coordinates array of any nesting depth
+    :param precision: the number of decimals to keep
+    :return: the same nesting of lists with every coordinate rounded
+    """
+
+    if isinstance(coordinates, (float, int)):
+        return round(coordinates, precision)
+    return [round_coordinates(c, precision) for c in coordinates]
+
+
+def geometry_to_dict(geometry: Any, precision: int | None = None) -> dict | None:
+    """
+    :param geometry: a geojson geometry dictionary, a shapely geometry or None
+    :param precision: optional number of decimals to round the coordinates to
+    :return: the geometry as a geojson dictionary, None for missing geometries
+    """
+
+    if geometry is None or (isinstance(geometry, float) and math.isnan(geometry)):
+        return None
+    if not isinstance(geometry, dict):
+        # shapely geometries and anything else implementing the geo interface
+        geometry = geometry.__geo_interface__
+    if precision is None:
+        return geometry
+    if geometry["type"] == "GeometryCollection":
+        return {"type": "GeometryCollection", "geometries": [geometry_to_dict(g, precision) for g in geometry["geometries"]]}
+    return {"type": geometry["type"], "coordinates": round_coordinates(geometry["coordinates"], precision)}
+
+
+def _property_value(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    if value is pd.NA or value is pd.NaT:
+        return None
+    if isinstance(value, pd.Timestamp):
+        return value.isoformat()
+    return value
+
+
+def iter_features(df: pd.DataFrame, geometry_column: str = "geometry", precision: int | None = None) -> Iterator[dict]:
+    """
+    :param df: dataframe with a geometry column holding geojson dictionaries or shapely geometries
+    :param geometry_column: the name of the geometry column
+    :param precision: optional number of decimals to round the coordinates to
+    :return: an iterator over one geojson Feature dictionary per row, every other column becoming a property
+    """
+
+    property_columns: list = [col for col in df.columns if col != geometry_column]
+    properties: Iterator = df[property_columns].itertuples(index=False, name=None)
+    for values, geometry in zip(properties, df[geometry_column]):
+        yield {
+            "type": "Feature",
+            "properties": {col: _property_value(value) for col, value in zip(property_columns, values)},
+            "geometry": geometry_to_dict(geometry, precision),
+        }
+
+
+def dumps(obj: Any) -> str:
+    """
+    :param obj: a json serializable object, e.g. a geojson Feature dictionary
+    :return: its compact json encoding, using orjson when it is installed
+    """
+
+    if orjson is not None:
+        return orjson.dumps(obj).decode("utf-8")
+    return json.dumps(obj, separators=(",", ":"), allow_nan=False)
+
+
+def write_feature_collection(df: pd.DataFrame, fp: TextIO, geometry_column: str = "geometry",
+                             precision: int | None = None) -> int:
+    """
+    This function writes a dataframe as a GeoJSON FeatureCollection to a text file-like object one feature at a
+    time, so only a single encoded feature is held in memory at once.
+
+    :param df: dataframe with a geometry column holding geojson dictionaries or shapely geometries
+    :param fp: a writable text file-like object
+    :param geometry_column: the name of the geometry column
+    :param precision: optional number of decimals to round the coordinates to
+    :return: the number of features written
+    """
+
+    return write_feature_collection_partitions([df], fp, geometry_column=geometry_column, precision=precision)
+
+
+def write_feature_collection_partitions(partitions: Iterable[pd.DataFrame], fp: TextIO, geometry_column: str = "geometry",
+                                        precision: int | None = None) -> int:
+    """
+    This function writes several dataframes as the features of one GeoJSON FeatureCollection, consuming them one
+    at a time, so a generator of partitions (e.g. one per state) never has to be held in memory as a whole.
+
+    :param partitions: an iterable of dataframes with a geometry column, see write_feature_collection
+    :param fp: a writable text file-like object
+    :param geometry_column: the name of the geometry column
+    :param precision: optional number of decimals to round the coordinates to
+    :return: the number of features written
+    """
+
+    count: int = 0
+    fp.write('{"type":"FeatureCollection","features":[')
+    for df in partitions:
+        for feature in iter_features(df, geometry_column=geometry_column, precision=precision):
+            fp.write("," if count else "")
+            fp.write(dumps(feature))
+            count += 1
+    fp.write("]}")
+    return count
+
+
+def feature_collection_string(df: pd.DataFrame, geometry_column: str = "geometry", precision: int | None = None) -> str:
+    """
+    :param df: dataframe with a geometry column holding geojson dictionaries or shapely geometries
+    :param geometry_column: the name of the geometry column
+    :param precision: optional number of decimals to round the coordinates to
+    :return: the GeoJSON FeatureCollection as a string
+    """
+
+    buffer: io.StringIO = io.StringIO()
+    write_feature_collection(df, buffer, geometry_column=geometry_column, precision=precision)
+    return buffer.getvalue()
@@ -0,0 +1,257 @@
+from __future__ import annotations
+
+import json
+import math
+
+from data_manipulation import serialize
+from data_manipulation.lazy import lazy_import
+
+np = lazy_import("numpy")
+shapely = lazy_import("shapely")
+
+"""
+The purpose of this module is to trade geometric fidelity for page weight before the joined city polygons are
+embedded into a map: simplification at a tolerance tied to the zoom level, coordinate precision truncation and a
+TopoJSON encoding in which borders shared by several cities are stored only once.
+"""
+
+
+TILE_SIZE: int = 256
+
+
+def zoom_tolerance(zoom: int, pixels: float = 0.5) -> float:
+    """
+    :param zoom: the web map zoom level the geometry will be displayed at
+    :param pixels: how many screen pixels of deviation are acceptable
+    :return: the simplification tolerance in degrees of longitude
+    """
+
+    return 360.0 / (TILE_SIZE * 2 ** zoom) * pixels
+
+
+def zoom_precision(zoom: int, pixels: float = 0.5) -> int:
+    """
+    :param zoom: the web map zoom level the geometry will be displayed at
+    :param pixels: how many screen pixels of deviation are acceptable
+    :return: the number of decimals that still resolve the zoom's simplification tolerance
+    """
+
+    return max(0, math.ceil(-math.log10(zoom_tolerance(zoom, pixels)))) + 1
+
+
+def _report_sizes(report: dict | None, before: str, after: str, vertices_before: int, vertices_after: int) -> None:
+    if report is None:
+        return
+    report.update(bytes_before=len(before.encode("utf-8")), bytes_after=len(after.encode("utf-8")),
+                  vertices_before=vertices_before, vertices_after=vertices_after)
+
+
+def simplify_geojson(geo_json: str, zoom: int = 3, pixels: float = 0.5, precision: int | None = None,
+                     report: dict | None = None) -> str:
+    """
+    This function simplifies every feature of a GeoJSON FeatureCollection with a topology-preserving Douglas-Peucker
+    at the tolerance of the zoom level, snaps the result to a grid of the given precision and writes it back out.
+
+    :param geo_json: a GeoJSON FeatureCollection string, e.g. the output of transform.forge_geojson
+    :param zoom: the zoom level the map opens at; higher zoom levels keep more detail
+    :param pixels: how many screen pixels of deviation are acceptable at that zoom
+    :param precision: the number of decimals to keep, defaults to zoom_precision(zoom, pixels)
+    :param report: optional dictionary that receives the byte and vertex counts before and after
+    :return: the simplified GeoJSON FeatureCollection string
+    """
+
+    precision = zoom_precision(zoom, pixels) if precision is None else precision
+    collection: dict = json.loads(geo_json)
+    features: list = collection.get("features", [])
+    geometries: np.ndarray = np.array([None if f.get("geometry") is None else shapely.geometry.shape(f["geometry"]) for f in features], dtype=object)
+
+    simplified: np.ndarray = shapely.simplify(geometries, zoom_tolerance(zoom, pixels), preserve_topology=True)
+    # snapping to the precision grid keeps the polygons valid, rounding afterwards just trims the float noise
+    snapped: np.ndarray = shapely.set_precision(simplified, 10.0 ** -precision)
+
+    for feature, geometry in zip(features, snapped):
+        feature["geometry"] = serialize.geometry_to_dict(geometry, precision)
+
+    simplified_json: str = serialize.dumps({"type": "FeatureCollection", "features": features})
+    _report_sizes(report, geo_json, simplified_json, int(shapely.get_num_coordinates(geometries).sum()),
+                  int(shapely.get_num_coordinates(snapped).sum()))
+    return simplified_json
+
+
+class _TopologyBuilder:
+    """
+    Builds the shared arcs of a TopoJSON topology out of quantized rings and lines.
+
+    A point is a junction when it is visited with different neighbours by different lines, i.e. where a shared
+    border starts or ends. Cutting every ring at its junctions yields arcs that are either unique to one city or
+    identical (possibly reversed) between neighbouring cities, and the identical ones are stored once.
+    """
+
+    def __init__(self, lines: list):
+        self.lines: list = lines
+        self.junctions: set = self._find_junctions(lines)
+        self.arcs: list = []
+        self._arc_index: dict = dict()
+
+    @staticmethod
+    def _find_junctions(lines: list) -> set:
+        neighbours: dict = dict()
+        junctions: set = set()
+        for points, closed in lines:
+            n: int = len(points)
+            for i, point in enumerate(points):
+                if not closed and i in (0, n - 1):
+                    junctions.add(point)
+                    continue
+                pair: tuple = tuple(sorted((points[i - 1], points[(i + 1) % n])))
+                seen: tuple | None = neighbours.setdefault(point, pair)
+                if seen != pair:
+                    junctions.add(point)
+        return junctions
+
+    def _add_arc(self, arc: tuple) -> int:
+        if arc in self._arc_index:
+            return self._arc_index[arc]
+        reversed_arc: tuple = arc[::-1]
+        if reversed_arc in self._arc_index:
+            return ~self._arc_index[reversed_arc]
+        self._arc_index[arc] = len(self.arcs)
+        self.arcs.append(arc)
+        return self._arc_index[arc]
+
+    def cut(self, points: list, closed: bool) -> list:
+        """
+        :param points: quantized points of a ring (without the closing point) or a line
+        :param closed: whether the points form a ring
+        :return: the indices of the arcs making up the ring or line, negative (~i) for reversed arcs
+        """
+
+        if closed:
+            cut_points: list = [i for i, point in enumerate(points) if point in self.junctions]
+            if not cut_points:
+                # a ring sharing no border, start it at its smallest point so an identical ring dedupes
+                start: int = points.index(min(points))
+                rotated: list = points[start:] + points[:start]
+                return [self._add_arc(tuple(rotated + rotated[:1]))]
+            rotated = points[cut_points[0]:] + points[:cut_points[0]]
+            points = rotated + rotated[:1]
+        cut_points = [i for i, point in enumerate(points) if i == 0 or i == len(points) - 1 or point in self.junctions]
+        return [self._add_arc(tuple(points[start:end + 1])) for start, end in zip(cut_points, cut_points[1:])]
+
+
+def _quantize(coordinates: list, translate: tuple, scale: tuple) -> list:
+    points: list = []
+    for x, y in ((c[0], c[1]) for c in coordinates):
+        point: tuple = (int(round((x - translate[0]) / scale[0])), int(round((y - translate[1]) / scale[1])))
+        if not points or points[-1] != point:
+            points.append(point)
+    return points
+
+
+def _rings(coordinates: list, translate: tuple, scale: tuple) -> list:
+    rings: list = []
+    for ring in coordinates:
+        points: list = _quantize(ring, translate, scale)
+        if len(points) > 1 and points[0] == points[-1]:
+            points = points[:-1]
+        rings.append(points)
+    return rings
+
+
+def to_topojson(geo_json: str, zoom: int | None = None, pixels: float = 0.5, quantization: int = 100_000,
+                object_name: str = "places", report: dict | None = None) -> str:
+    """
+    This function converts a GeoJSON FeatureCollection to a quantized, delta-encoded TopoJSON topology in which
+    borders shared between cities are stored as a single arc. With a zoom level, every arc is simplified at the
+    zoom's tolerance; since arcs end at the junctions between cities, neighbours stay seamless after simplification.
+
+    :param geo_json: a GeoJSON FeatureCollection string, e.g. the output of transform.forge_geojson
+    :param zoom: optional zoom level to simplify the arcs for, None keeps every quantized point
+    :param pixels: how many screen pixels of deviation are acceptable at that zoom
+    :param quantization: the number of distinct values per axis of the quantization grid
+    :param object_name: the name of the geometry collection under "objects"
+    :param report: optional dictionary that receives the byte and vertex counts before and after
+    :return: the TopoJSON topology string, usable with folium's topojson="objects.<object_name>"
+    """
+
+    collection: dict = json.loads(geo_json)
+    features: list = collection.get("features", [])
+    geometries: list = [f.get("geometry") for f in features]
+    shapes: np.ndarray = np.array([None if g is None else shapely.geometry.shape(g) for g in geometries], dtype=object)
+    bounds: np.ndarray = shapely.total_bounds(shapes)
+    if np.isnan(bounds).any():
+        bounds = np.array([0.0, 0.0, 1.0, 1.0])
+    translate: tuple = (float(bounds[0]), float(bounds[1]))
+    scale: tuple = (float(bounds[2] - bounds[0]) / (quantization - 1) or 1.0, float(bounds[3] - bounds[1]) / (quantization - 1) or 1.0)
+
+    # first pass: quantize every line so the junctions can be found across all features
+    quantized: list = []
+    lines: list = []
+    for geometry in geometries:
+        if geometry is None:
+            quantized.append(None)
+            continue
+        kind: str = geometry["type"]
+        if kind == "Polygon":
+            parts: list = [_rings(geometry["coordinates"], translate, scale)]
+        elif kind == "MultiPolygon":
+            parts = [_rings(polygon, translate, scale) for polygon in geometry["coordinates"]]
+        elif kind == "LineString":
+            parts = [_quantize(geometry["coordinates"], translate, scale)]
+        elif kind == "MultiLineString":
+            parts = [_quantize(line, translate, scale) for line in geometry["coordinates"]]
+        elif kind == "Point":
+            parts = list(_quantize([geometry["coordinates"]], translate, scale)[0])
+        elif kind == "MultiPoint":
+            parts = [list(_quantize([point], translate, scale)[0]) for point in geometry["coordinates"]]
+        else:
+            raise ValueError(f"Unsupported geometry type for TopoJSON: {kind}")
+        quantized.append((kind, parts))
+        if kind in ("Polygon", "MultiPolygon"):
+            lines.extend((ring, True) for polygon in parts for ring in polygon)
+        elif kind in ("LineString", "MultiLineString"):
+            lines.extend((line, False) for line in parts)
+
+    builder: _TopologyBuilder = _TopologyBuilder(lines)
+    topology_geometries: list = []
+    for feature, item in zip(features, quantized):
+        if item is None:
+            topology_geometries.append({"type": None, "properties": feature.get("properties")})
+            continue
+        kind, parts = item
+        if kind == "Polygon":
+            arcs: list = [builder.cut(ring, True) for ring in parts[0]]
+        elif kind == "MultiPolygon":
+            arcs = [[builder.cut(ring, True) for ring in polygon] for polygon in parts]
+        elif kind == "LineString":
+            arcs = builder.cut(parts[0], False)
+        elif kind == "MultiLineString":
+            arcs = [builder.cut(line, False) for line in parts]
+        else:
+            topology_geometries.append({"type": kind, "coordinates": parts, "properties": feature.get("properties")})
+            continue
+        topology_geometries.append({"type": kind, "arcs": arcs, "properties": feature.get("properties")})
+
+    encoded_arcs: list = []
+    for arc in builder.arcs:
+        points: np.ndarray = np.array(arc, dtype=float)
+        if zoom is not None and len(points) > 2:
+            tolerance: float = zoom_tolerance(zoom, pixels) / min(scale)
+            simplified: np.ndarray = shapely.get_coordinates(shapely.simplify(shapely.LineString(points), tolerance, preserve_topology=False))
+            # a ring arc that collapses below a triangle would vanish, keep it as it is
+            if not (arc[0] == arc[-1] and len(simplified) < 4):
+                points = simplified
+        points = points.astype(np.int64)
+        deltas: np.ndarray = np.vstack([points[:1], np.diff(points, axis=0)])
+        encoded_arcs.append(deltas.tolist())
+
+    topology: dict = {
+        "type": "Topology",
+        "transform": {"scale": list(scale), "translate": list(translate)},
+        "objects": {object_name: {"type": "GeometryCollection", "geometries": topology_geometries}},
+        "arcs": encoded_arcs,
+    }
+    topojson_string: str = serialize.dumps(topology)
+    _report_sizes(report, geo_json, topojson_string, int(shapely.get_num_coordinates(shapes).sum()),
+                  sum(len(arc) for arc in encoded_arcs))
+    return topojson_string
@@ -1,18 +1,36 @@
+from __future__ import annotations
+
 import json
-from typing import Any
+import logging
+import os
+from typing import Any, Iterable, Iterator, TextIO
 
-import numpy as np
-import pandas as pd
-import geopandas as gpd
+from data_manipulation import geocode
+from data_manipulation import serialize
+from data_manipulation.geostore import places_to_geodataframe
 from states import states
+from data_manipulation.lazy import lazy_import
+
+pd = lazy_import("pandas")
+gpd = lazy_import("geopandas")
+np = lazy_import("numpy")
+shapely = lazy_import("shapely")
 
 """
 The purpose of this module is to centrally consolidate data transformation methods that will return 
 dataframes or other data objects that will be used directly as inputs for visualizations.
 """
 
+logger: logging.Logger = logging.getLogger("market_change.transform")
+
+CITY_ALIASES_PATH: str = os.path.join(os.path.dirname(__file__), "city_aliases.csv")
+
+# the columns identifying a headquarter city and the columns of the aggregated cities
+CITY_KEYS: list = ['Headquarters Location', 'City Name', 'State']
+CITY_COLUMNS: list = ['id'] + CITY_KEYS + ['Change', 'Change Mean', 'Companies', 'Top Mover', 'geometry']
 
-def forge_geojson(df: pd.DataFrame) -> Any:
+
+def forge_geojson(df: pd.DataFrame, precision: int | None = None, fp: TextIO | None = None) -> Any:
     """
     This function serves to take a dataframe and transform it into a geojson file.
 
@@ -41,49 +59,80 @@ def forge_geojson(df: pd.DataFrame) -> Any:
         ]
     }'
 
+    Every column but geometry becomes a feature property; rows without a geometry are skipped. The features are
+    encoded one at a time (with orjson when it is installed), so with fp the collection is streamed to the file
+    and never held in memory as a whole.
+
     :param df: dataframe that at the very least a geometry column
-    :return: the geojson representation from above
+    :param precision: optional number of decimals to round the coordinates to
+    :param fp: optional writable text file-like object to stream the collection to instead of returning it
+    :return: the geojson representation from above (None when streamed to fp) and the rows that were written
     """
     cols: list = df.columns.tolist()
     df = df[df["geometry"].notna()]
 
-    for col in cols:
-        df[f"properties_{col}"] = df[col].apply(lambda x: str(f""" "{col}" : "{x}" """))
+    if fp is not None:
+        serialize.write_feature_collection(df[cols], fp, precision=precision)
+        return None, df[cols]
+    return serialize.feature_collection_string(df[cols], precision=precision), df[cols]
+
+
+def load_city_aliases(path: str = CITY_ALIASES_PATH) -> pd.DataFrame:
+    """
+    This function loads the table that maps headquarter cities to the census place they should be drawn as, e.g.
+    suburbs or neighbourhoods without a place polygon of their own to the surrounding city.
+
+    :param path: a csv file with City Name, State and Place Name columns
+    :return: the alias table as a dataframe
+    """
+
+    aliases: pd.DataFrame = pd.read_csv(path, dtype=str, keep_default_na=False)
+    duplicated: pd.DataFrame = aliases[aliases.duplicated(subset=["City Name", "State"], keep=False)]
+    if not duplicated.empty:
+        raise ValueError(f"City aliases must be unique per City Name and State, found duplicates:\n{duplicated}")
+    return aliases
 
-    df['type'] = """{"type": "Feature", "properties": {"""
-    df["suffix"] = """}"""
-    df['constructed_json'] = df['type']
-    for col in cols:
-        df['constructed_json'] = df['constructed_json'].str.cat(df[f"properties_{col}"], sep=',')
-    df['constructed_json'] = df['constructed_json'].apply(lambda x: x.replace('"properties": {,', '"properties": {'))
-    df['constructed_json'] = df['constructed_json'].apply(lambda x: x.replace(' , "geometry"', '}, "geometry"'))
-    df['constructed_json'] = df['constructed_json'].str.cat(df['suffix'], sep='')
-    #some additional cleanup from quote marks
-    df['constructed_json'] = df['constructed_json'].apply(lambda x: x.replace('"geometry" : "{', '"geometry" : {'))
-    df['constructed_json'] = df['constructed_json'].apply(lambda x: x.replace('}" ', '}'))
-    df['constructed_json'] = df['constructed_json'].apply(lambda x: x.replace('\'', '"'))
 
-    consructed_list: list = df['constructed_json'].to_list()
+def apply_city_aliases(df: pd.DataFrame, city_aliases: pd.DataFrame) -> pd.DataFrame:
+    """
+    This function rewrites the City Name column to census place names in one vectorized lookup keyed by
+    (City Name, State), so adding aliases does not add passes over the companies.
 
-    middle_string: str = str(consructed_list)
-    # fix the middle part of the string from the list nonsense
-    middle_string.replace("""[(\'""", """""").replace('''"]\',)''', '''''').replace("\\\\","").replace("""[\'""", """""").replace("""\']""", """""")
-    # fix
-    prefix: str = """{"type": "FeatureCollection", "features": ["""
-    suffix: str = """]}"""
+    :param df: dataframe with City Name and State columns
+    :param city_aliases: the output of load_city_aliases
+    :return: the dataframe with its City Name column normalized
+    """
 
-    return f"""{prefix}{middle_string}{suffix}""".replace("""[\'""", """""").replace("""\']""", """""").replace("""\', \'""", ""","""), df[cols]
+    lookup: dict = dict(zip(zip(city_aliases["City Name"], city_aliases["State"]), city_aliases["Place Name"]))
+    keys: pd.MultiIndex = pd.MultiIndex.from_arrays([df["City Name"], df["State"]])
+    place_names: pd.Index = keys.map(lookup)
+    df["City Name"] = np.where(place_names.isna(), df["City Name"], place_names)
+    return df
 
 
-def join_ticker_data_to_geodata(sp_companies: pd.DataFrame, ticker_data: dict, geo_data: str):
+def unmatched_headquarters(state_sp_data_with_geo: pd.DataFrame) -> pd.DataFrame:
     """
-    This function serves to deserializes the json style string of the geographic data and to combine it with the
-    s&p 500 company list by Headquarters City, combining it with the relevant market information
+    This function lists the US headquarters that did not match a census place polygon; these are the candidates for
+    a new line in the city alias table.
+
+    :param state_sp_data_with_geo: company data joined to the place polygons
+    :return: one row per unmatched City Name and State with the number of companies and their symbols
+    """
+
+    unmatched: pd.DataFrame = state_sp_data_with_geo[state_sp_data_with_geo["name"].notnull() & state_sp_data_with_geo["state_fips"].isnull()]
+    return (unmatched.groupby(["City Name", "State"], sort=True)["Symbol"]
+            .agg(companies="count", symbols=lambda symbols: ", ".join(sorted(symbols)))
+            .reset_index())
+
+
+def prepare_sp_companies(sp_companies: pd.DataFrame, city_aliases: pd.DataFrame | None = None) -> pd.DataFrame:
+    """
+    This function splits the S&P company headquarters into a city name and a state, attaches the state's fips code
+    and normalizes the city names so that they line up with the census place names.
 
     :param sp_companies: Dataframe of S&P Company data, must include Symbol and Headquarter information
-    :param ticker_data: Yahoo finance dataframe that has close data for all the relevant symbols
-    :param geo_data: jsonlike string of all the city polygon information
-    :return: a geojson object that can be used to create a map from
+    :param city_aliases: optional alias table, defaults to the one shipped with the package (see load_city_aliases)
+    :return: the company data with the additional City Name, State, name, abbreviation and fips columns
     """
 
     # First step is to sp_company headquarter information into city name and state, then derive fips code
@@ -98,35 +147,47 @@ def join_ticker_data_to_geodata(sp_companies: pd.DataFrame, ticker_data: dict, g
     [sp_cols.append(col) for col in new_cols]
     sp_companies.columns = sp_cols
 
-    # Given we have a state name now, must go and find its fips code
-    state_info: pd.DataFrame = states.get_states_df()
-
-    # Now simply join sp company data to the state on State name
-    prepped_sp_data: pd.DataFrame = pd.merge(sp_companies, state_info, left_on="State",  right_on="name", how="left")
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "New York" if x == "New York City" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Minneapolis" if x == "Saint Paul" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Indianapolis city (balance)" if x == "Indianapolis" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Sterling" if x == "Dulles" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Tysons" if x == "Tysons Corner" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Wallingford Center" if x == "Wallingford" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Hartford" if x == "Bloomfield" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Hartford" if x == "Farmington" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Harrison" if x == "Purchase" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Rochester" if x == "Penfield" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Trenton" if x == "Ewing" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Hackensack" if x == "Teaneck" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Morristown" if x == "Parsippany" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Beaverton" if x == "Washington County" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Boise City" if x == "Boise" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Nashville-Davidson metropolitan government (balance)" if x == "Nashville" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Reading" if x == "North Reading" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Boston" if x == "Acton" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Mayfield Heights" if x == "Mayfield Village" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Baltimore" if x == "Hunt Valley" else x)
-    prepped_sp_data["City Name"] = prepped_sp_data["City Name"].apply(lambda x: "Philadelphia" if x == "Wayne" else x)
+    # Given we have a state name now, must go and find its fips code; the distinct states are resolved once and
+    # spread over the companies by their codes, instead of merging (and copying) every company column
+    prepped_sp_data: pd.DataFrame = pd.concat([sp_companies, states.map_states(sp_companies["State"])], axis=1)
+    # Normalize the city names to census place names with a single lookup against the alias table
+    prepped_sp_data = apply_city_aliases(prepped_sp_data, load_city_aliases() if city_aliases is None else city_aliases)
+
+    return prepped_sp_data
+
+
+def places_of_interest(prepped_sp_data: pd.DataFrame) -> set:
+    """
+    This function lists the census places the companies are headquartered in, so that the shape file retrieval can
+    skip every other place (and every state without a headquarter) while parsing.
+
+    :param prepped_sp_data: the output of prepare_sp_companies
+    :return: a set of (state fips, city name) tuples
+    """
+
+    located: pd.DataFrame = prepped_sp_data[prepped_sp_data["fips"].notnull()]
+    return set(zip(located["fips"], located["City Name"]))
+
+
+def _city_geometries_from_json(prepped_sp_data: pd.DataFrame, geo_data: str) -> pd.DataFrame:
+    """
+    This function pulls the polygons of the headquarter cities out of the json string of retrieve_us_city_shape_files.
+
+    :param prepped_sp_data: the output of prepare_sp_companies
+    :param geo_data: jsonlike string of all the city polygon information
+    :return: a dataframe of state_fips, city and geometry (as a geojson dictionary)
+    """
 
     # geo_data is a string resulting from a json.dumps() call, needs to be deserialized into something useful
-    geo_data_deserialized = json.loads(geo_data)
+    return _city_geometries_from_dict(prepped_sp_data, json.loads(geo_data))
+
+
+def _city_geometries_from_dict(prepped_sp_data: pd.DataFrame, geo_data_deserialized: dict) -> pd.DataFrame:
+    """
+    :param prepped_sp_data: the output of prepare_sp_companies
+    :param geo_data_deserialized: dictionary of state fips code to the FeatureCollection of its places
+    :return: a dataframe of state_fips, city and geometry (as a geojson dictionary)
+    """
 
     # Only need to iterate over states present in the sp_company data
     fips_iterator = prepped_sp_data[(prepped_sp_data["fips"].notnull())]["fips"].unique()
@@ -142,58 +203,402 @@ def join_ticker_data_to_geodata(sp_companies: pd.DataFrame, ticker_data: dict, g
         # geometry itself is a dictionary of 'type' and 'coordinates'
         # return only the relevant cities geospatial encoding so that it can be added to the sp market data
         state_geo_data = geo_data_deserialized.get(fips)
+        if state_geo_data is None:
+            # the state was filtered out or failed to download, its companies simply stay without a geometry
+            continue
         city_geo_data = state_geo_data.get(f"features")
         city_data = [ {"state_fips":fips, "city" : city.get("properties").get("NAME"), "geometry" : city.get("geometry")} for city in city_geo_data if city.get("properties").get("NAME") in cities_of_interest ]
         for city in city_data:
             city_collection.append(city)
 
-    city_data_df: pd.DataFrame = pd.DataFrame(city_collection)
-    state_sp_data_with_geo: pd.DataFrame = pd.merge(prepped_sp_data, city_data_df, how="left", left_on=["fips", "City Name"], right_on=["state_fips", "city"])
+    return pd.DataFrame(city_collection, columns=["state_fips", "city", "geometry"])
 
-    # Print some checks after grabbing the geolocation
-    print(f"""The number of securities with a US geometry is: {len(state_sp_data_with_geo[state_sp_data_with_geo["state_fips"].notnull()]["Security"])}""")
-    print(f"""The number of securities in the US is: {len(state_sp_data_with_geo[state_sp_data_with_geo["name"].notnull()]["Security"])}""")
-    print(f"""This indicates that {len(state_sp_data_with_geo[state_sp_data_with_geo["name"].notnull()]["Security"]) -len(state_sp_data_with_geo[state_sp_data_with_geo["state_fips"].notnull()]["Security"])} companies failed to be geoenhanced""")
 
-    # With all the S&P data now enriched with geolocation data, time to aggregate up to the city level, figuring out which cities had the biggest change in value over the day
-    # ticker data will have a terrible structure due to the mult-indexing ('<Metric>', '<Ticker>') : {Timestamp('<date> 00:00:00'): <value>}
-    ticker_keys: list = list(ticker_data)
-    open_keys: list = [key for key in ticker_keys if str(key).__contains__('Open')]
-    close_keys: list = [key for key in ticker_keys if str(key).__contains__('Adj Close')]
-    volume_keys: list = [key for key in ticker_keys if str(key).__contains__('Volume')]
+def _city_geometries_from_frame(prepped_sp_data: pd.DataFrame, geo_data: gpd.GeoDataFrame) -> pd.DataFrame:
+    """
+    This function pulls the polygons of the headquarter cities out of a place GeoDataFrame, e.g. the one read from
+    the GeoParquet store. Only the matching rows have their geometry converted to a geojson dictionary.
+
+    :param prepped_sp_data: the output of prepare_sp_companies
+    :param geo_data: GeoDataFrame with STATEFP, NAME and geometry columns
+    :return: a dataframe of state_fips, city and geometry (as a geojson dictionary)
+    """
 
-    symbols: list = prepped_sp_data["Symbol"].tolist()
-    change_by_symbol: list = []
+    wanted: pd.MultiIndex = pd.MultiIndex.from_tuples(sorted(places_of_interest(prepped_sp_data)))
+    matches: gpd.GeoDataFrame = geo_data[pd.MultiIndex.from_frame(geo_data[["STATEFP", "NAME"]]).isin(wanted)]
+    geometries: list = [None if g is None else json.loads(g) for g in shapely.to_geojson(np.asarray(matches.geometry.values))]
+    return pd.DataFrame({"state_fips": matches["STATEFP"].to_numpy(), "city": matches["NAME"].to_numpy(), "geometry": geometries})
 
-    for symbol in symbols:
-        open_value_key = [o for o in open_keys if o[1] == symbol][0]
-        close_value_key = [c for c in close_keys if c[1] == symbol][0]
-        volume_value_key = [v for v in volume_keys if v[1] == symbol][0]
 
-        open_value: float = list(ticker_data.get(open_value_key).values())[0]
-        close_value: float = list(ticker_data.get(close_value_key).values())[0]
-        volume_value: float = list(ticker_data.get(volume_value_key).values())[0]
-        change_value: float = close_value - open_value
-        agg_change: float = change_value * volume_value
+def _ticker_frame(ticker_data: dict | pd.DataFrame) -> pd.DataFrame:
+    """
+    :param ticker_data: yfinance download, either the multi-index DataFrame itself or its to_dict() form
+    :return: the ticker data as a DataFrame indexed by timestamp with (metric, ticker) columns
+    """
+
+    # the dict form has a terrible structure due to the mult-indexing ('<Metric>', '<Ticker>') : {Timestamp('<date> 00:00:00'): <value>}
+    frame: pd.DataFrame = ticker_data if isinstance(ticker_data, pd.DataFrame) else pd.DataFrame(ticker_data)
+    if not isinstance(frame.columns, pd.MultiIndex):
+        raise ValueError("ticker_data must have (metric, ticker) columns as returned by yfinance.download")
+    return frame
+
+
+def compute_symbol_change(ticker_data: dict | pd.DataFrame, symbols: Any = None) -> pd.DataFrame:
+    """
+    This function computes the open, close, volume and volume weighted change of every symbol in one vectorized pass
+    over the ticker data: the first open and the last close of the download, and the volume traded in between. For
+    a single daily session that is the session's own open, close and volume. The adjusted close is used when the
+    download has one.
+
+    :param ticker_data: yfinance download, either the multi-index DataFrame itself or its to_dict() form
+    :param symbols: optional symbols to report on, symbols without ticker data get NaN values
+    :return: a dataframe with Symbol, Open, Close, Volume and Change columns, one row per symbol
+    """
+
+    frame: pd.DataFrame = _ticker_frame(ticker_data).sort_index()
+    metrics: pd.Index = frame.columns.get_level_values(0)
+    close_metric: str = "Adj Close" if "Adj Close" in metrics else "Close"
+
+    # one row per symbol, one column per metric, spanning every bar of the download (e.g. intraday or multi-day)
+    span: pd.DataFrame = pd.DataFrame({
+        "Open": frame["Open"].bfill().iloc[0],
+        "Close": frame[close_metric].ffill().iloc[-1],
+        "Volume": frame["Volume"].sum(min_count=1),
+    })
+    if symbols is not None:
+        span = span.reindex(pd.Index(symbols).unique())
+
+    change_by_symbol_df: pd.DataFrame = pd.DataFrame({
+        "Symbol": span.index.to_numpy(),
+        "Open": span["Open"].to_numpy(dtype=float),
+        "Close": span["Close"].to_numpy(dtype=float),
+        "Volume": span["Volume"].to_numpy(dtype=float),
+    })
+    change_by_symbol_df["Change"] = (change_by_symbol_df["Close"] - change_by_symbol_df["Open"]) * change_by_symbol_df["Volume"]
+    return change_by_symbol_df
+
+
+def compute_daily_symbol_change(ticker_data: dict | pd.DataFrame, symbols: Any = None) -> pd.DataFrame:
+    """
+    This function computes the change of every symbol on every trading day of the ticker data in one vectorized
+    pass: the bars are grouped by day into the day's first open, last close and summed volume, and the result is
+    stacked into a long table. Intraday downloads are thereby rolled up to whole days as well.
+
+    :param ticker_data: yfinance download, either the multi-index DataFrame itself or its to_dict() form
+    :param symbols: optional symbols to report on, symbols without ticker data are left out
+    :return: a long dataframe with Date, Symbol, Open, Close, Volume and Change columns, one row per symbol and day
+    """
+
+    frame: pd.DataFrame = _ticker_frame(ticker_data).sort_index()
+    close_metric: str = "Adj Close" if "Adj Close" in frame.columns.get_level_values(0) else "Close"
+    days: pd.DatetimeIndex = pd.DatetimeIndex(frame.index).normalize()
+
+    daily: pd.DataFrame = pd.concat({
+        "Open": frame["Open"].groupby(days).first(),
+        "Close": frame[close_metric].groupby(days).last(),
+        "Volume": frame["Volume"].groupby(days).sum(min_count=1),
+    }, axis=1)
+    daily.index.name = "Date"
+    daily.columns.names = ["Metric", "Symbol"]
+    daily_change_df: pd.DataFrame = daily.stack(level="Symbol", future_stack=True).reset_index()
+    daily_change_df.columns.name = None
+    daily_change_df = daily_change_df.dropna(subset=["Open", "Close"], how="all")
+    if symbols is not None:
+        daily_change_df = daily_change_df[daily_change_df["Symbol"].isin(pd.Index(symbols))]
+    daily_change_df = daily_change_df.astype({"Open": float, "Close": float, "Volume": float})
+    daily_change_df["Change"] = (daily_change_df["Close"] - daily_change_df["Open"]) * daily_change_df["Volume"]
+    return daily_change_df[["Date", "Symbol", "Open", "Close", "Volume", "Change"]].reset_index(drop=True)
+
+
+def geoenhance_companies(prepped_sp_data: pd.DataFrame, geo_data: str | gpd.GeoDataFrame) -> pd.DataFrame:
+    """
+    This function attaches the polygon of its headquarter place to every company. It only depends on the company
+    list and the place geometry, not on any market data, so its result can be reused across price refreshes.
+
+    :param prepped_sp_data: the output of prepare_sp_companies (or of geocode.locate_headquarters)
+    :param geo_data: jsonlike string of all the city polygon information, or a GeoDataFrame of places with STATEFP,
+        NAME and geometry columns such as fetch.retrieve_us_city_geodataframe returns
+    :return: the company data with the additional state_fips, city and geometry columns
+    """
 
-        change_record: dict = {"Symbol": symbol, "Open": open_value, "Close": close_value, "Volume": volume_value, "Change": agg_change}
-        change_by_symbol.append(change_record)
+    if isinstance(geo_data, gpd.GeoDataFrame):
+        city_data_df: pd.DataFrame = _city_geometries_from_frame(prepped_sp_data, geo_data)
+    else:
+        city_data_df: pd.DataFrame = _city_geometries_from_json(prepped_sp_data, geo_data)
+    state_sp_data_with_geo: pd.DataFrame = pd.merge(prepped_sp_data, city_data_df, how="left", left_on=["fips", "City Name"], right_on=["state_fips", "city"])
+    log_geoenhancement(state_sp_data_with_geo)
+    return state_sp_data_with_geo
 
-    change_by_symbol_df: pd.DataFrame = pd.DataFrame(change_by_symbol)
 
-    # combine the daily change by symbol to the prepped sp dataframe
-    pre_agg_df: pd.DataFrame = state_sp_data_with_geo.merge(change_by_symbol_df, how="left", on="Symbol")
-    pre_agg_df: pd.DataFrame = pre_agg_df.drop_duplicates(keep="first", subset=['Symbol', 'Security', 'City Name', 'State'])
+def log_geoenhancement(state_sp_data_with_geo: pd.DataFrame, counts: dict | None = None) -> None:
+    """
+    This function logs how many US securities were matched to a place polygon and warns about every headquarter
+    that was not.
 
-    # now this data frame can be aggregated by city, give an id to the city, setting up the final geojson prep to output
-    agg_df: pd.DataFrame = pre_agg_df[['Headquarters Location', 'City Name', 'State', 'Change', 'CIK']].groupby(['Headquarters Location', 'City Name', 'State']).agg('sum').reset_index()
+    :param state_sp_data_with_geo: the output of geoenhance_companies, or one partition of it
+    :param counts: optional running totals to add this partition to instead of logging the totals right away
+    """
 
-    # go back ang get the geometry column and necessary joining key
-    geo_df: pd.DataFrame = pre_agg_df[['Headquarters Location', 'City Name', 'State', "geometry"]]
+    # Log some checks after grabbing the geolocation
+    geoenhanced_count: int = len(state_sp_data_with_geo[state_sp_data_with_geo["state_fips"].notnull()]["Security"])
+    us_count: int = len(state_sp_data_with_geo[state_sp_data_with_geo["name"].notnull()]["Security"])
+    for unmatched in unmatched_headquarters(state_sp_data_with_geo).itertuples(index=False):
+        logger.warning(f"No place polygon for {unmatched[0]}, {unmatched[1]} ({unmatched.symbols})")
+    if counts is not None:
+        counts["geoenhanced"] = counts.get("geoenhanced", 0) + geoenhanced_count
+        counts["us"] = counts.get("us", 0) + us_count
+        return
+    logger.info(f"The number of securities with a US geometry is: {geoenhanced_count}")
+    logger.info(f"The number of securities in the US is: {us_count}")
+    logger.info(f"This indicates that {us_count - geoenhanced_count} companies failed to be geoenhanced")
+
+
+def aggregate_change_by_city(state_sp_data_with_geo: pd.DataFrame, change_by_symbol_df: pd.DataFrame):
+    """
+    This function sums the change of the companies up to their headquarter city and forges the map geometry.
 
-    final_df: pd.DataFrame = agg_df.merge(geo_df, how="left", on=['Headquarters Location', 'City Name', 'State'])
+    :param state_sp_data_with_geo: the output of geoenhance_companies
+    :param change_by_symbol_df: the output of compute_symbol_change
+    :return: the geojson of the cities and the map data, as join_ticker_data_to_geodata returns them
+    """
 
     # this final df can then be converted to the necessary geoJSON structure
-    map_geometry, map_data = forge_geojson(final_df)
+    map_geometry, map_data = forge_geojson(aggregate_city_frame(state_sp_data_with_geo, change_by_symbol_df))
 
     return map_geometry, map_data.drop("geometry", axis=1).drop_duplicates()
+
+
+def city_tables(state_sp_data_with_geo: pd.DataFrame) -> tuple:
+    """
+    This function splits the geoenhanced companies into two tables referencing each other by an integer city id:
+    the companies, by Symbol, and the cities, each with its geometry exactly once. A city is the census place the
+    headquarters matched, (state fips, place NAME), so headquarters that are aliased or geocoded to the same place
+    share one city and one polygon; the city keeps the first of their Headquarters Locations, in sort order, as an
+    attribute. Only companies whose headquarter has a geometry are kept, and the ids number the cities by state fips
+    first and place NAME second, so that cities aggregated one state at a time and numbered on across the states in
+    fips order (parallel.py and stream_ticker_data_to_geodata) get the same ids as all of them aggregated at once.
+
+    :param state_sp_data_with_geo: the output of geoenhance_companies, or one partition of it
+    :return: a dataframe of Symbol and id, one row per company, and a dataframe of id, Headquarters Location,
+        City Name, State and geometry, one row per city
+    """
+
+    located: pd.DataFrame = state_sp_data_with_geo[state_sp_data_with_geo["geometry"].notna()]
+    located = located.drop_duplicates(keep="first", subset=['Symbol', 'Security', 'City Name', 'State'])
+    # the sorted codes of the matched places number the cities; a company without a place is dropped, like groupby
+    # drops it
+    located = located[located["state_fips"].notna() & located["city"].notna()]
+    city_id, _ = pd.factorize(pd.MultiIndex.from_frame(located[["state_fips", "city"]]), sort=True)
+
+    companies: pd.DataFrame = pd.DataFrame({"Symbol": located["Symbol"].to_numpy(), "id": city_id})
+    # the first company of every city once they are ordered by their Headquarters Location
+    by_location: np.ndarray = np.lexsort((located["Headquarters Location"].astype(str).to_numpy(), city_id))
+    first: np.ndarray = by_location[np.unique(city_id[by_location], return_index=True)[1]]
+    cities: pd.DataFrame = located.iloc[first][CITY_KEYS + ["geometry"]].reset_index(drop=True)
+    cities.insert(0, "id", city_id[first])
+    return companies, cities
+
+
+def aggregate_city_frame(state_sp_data_with_geo: pd.DataFrame, change_by_symbol_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    This function aggregates the change of the companies up to their headquarter city with a single groupby over
+    the integer city ids, and attaches every city's geometry from the deduplicated city table afterwards, so no
+    geometry or string column is copied per company.
+
+    :param state_sp_data_with_geo: the output of geoenhance_companies, or one partition of it
+    :param change_by_symbol_df: the output of compute_symbol_change
+    :return: one row per headquarter city with its id, Headquarters Location, City Name and State, the summed and
+        mean Change of its companies, the number of Companies, the Top Mover (the symbol with the largest absolute
+        change) and its geometry
+    """
+
+    companies, cities = city_tables(state_sp_data_with_geo)
+    change: pd.Series = change_by_symbol_df.drop_duplicates(subset="Symbol").set_index("Symbol")["Change"]
+    companies["Change"] = companies["Symbol"].map(change).to_numpy(dtype=float)
+
+    stats: pd.DataFrame = companies.groupby("id", sort=True).agg(**{
+        "Change": ("Change", "sum"),
+        "Change Mean": ("Change", "mean"),
+        "Companies": ("Symbol", "size"),
+    })
+    # the first company of every city once they are ranked by their absolute change, ties going to the earlier one
+    ranked: pd.DataFrame = companies.dropna(subset=["Change"])
+    ranked = ranked.iloc[np.argsort(-ranked["Change"].abs().to_numpy(), kind="stable")]
+    stats["Top Mover"] = ranked.drop_duplicates(subset="id").set_index("id")["Symbol"]
+
+    final_df: pd.DataFrame = cities.join(stats, on="id")
+    return final_df[CITY_COLUMNS]
+
+
+def aggregate_daily_change_by_city(state_sp_data_with_geo: pd.DataFrame, daily_change_df: pd.DataFrame) -> tuple:
+    """
+    This function sums the change of the companies up to their headquarter city for every day at once, with a
+    single groupby over the long table of compute_daily_symbol_change. The geometry of every city is serialized
+    once, carrying its integer id property, and the daily values come back as a matrix keyed by that id.
+
+    :param state_sp_data_with_geo: the output of geoenhance_companies
+    :param daily_change_df: the output of compute_daily_symbol_change
+    :return: the geojson of the cities (with id, Headquarters Location, City Name and State properties) and a
+        dataframe indexed by city id with one column of summed Change per day (as YYYY-MM-DD), in feature order
+    """
+
+    companies, cities = city_tables(state_sp_data_with_geo)
+    daily: pd.DataFrame = companies.merge(daily_change_df[["Date", "Symbol", "Change"]], on="Symbol")
+    city_change: pd.DataFrame = daily.groupby(["id", "Date"])["Change"].sum(min_count=1).unstack("Date")
+    city_change = city_change.reindex(index=cities["id"], columns=sorted(daily_change_df["Date"].unique()))
+    city_change.columns = pd.DatetimeIndex(city_change.columns).strftime("%Y-%m-%d")
+    city_change.columns.name = None
+
+    map_geometry, _ = forge_geojson(cities)
+    return map_geometry, city_change
+
+
+def prepare_geocoded_companies(sp_companies: pd.DataFrame, geo_data: str | gpd.GeoDataFrame,
+                               city_aliases: pd.DataFrame | None = None, geocoding: str = "name",
+                               gazetteer: pd.DataFrame | None = None) -> tuple:
+    """
+    :param sp_companies: Dataframe of S&P Company data, must include Symbol and Headquarter information
+    :param geo_data: the place geometry, see join_ticker_data_to_geodata
+    :param city_aliases: see join_ticker_data_to_geodata
+    :param geocoding: see join_ticker_data_to_geodata
+    :param gazetteer: see join_ticker_data_to_geodata
+    :return: the prepared company data with City Name normalized to place names, and the place geometry to use
+    """
+
+    if geocoding == "name":
+        return prepare_sp_companies(sp_companies, city_aliases), geo_data
+    if geocoding == "spatial":
+        if not isinstance(geo_data, gpd.GeoDataFrame):
+            geo_data = places_to_geodataframe(geo_data)
+        no_aliases: pd.DataFrame = pd.DataFrame(columns=["City Name", "State", "Place Name"], dtype=str)
+        prepped_sp_data: pd.DataFrame = prepare_sp_companies(sp_companies, no_aliases if city_aliases is None else city_aliases)
+        return geocode.locate_headquarters(prepped_sp_data, geo_data, gazetteer), geo_data
+    raise ValueError(f"Unknown geocoding {geocoding!r}, expected 'name' or 'spatial'")
+
+
+def join_ticker_data_to_geodata(sp_companies: pd.DataFrame, ticker_data: dict | pd.DataFrame, geo_data: str | gpd.GeoDataFrame,
+                                city_aliases: pd.DataFrame | None = None, geocoding: str = "name",
+                                gazetteer: pd.DataFrame | None = None):
+    """
+    This function serves to deserializes the json style string of the geographic data and to combine it with the
+    s&p 500 company list by Headquarters City, combining it with the relevant market information
+
+    :param sp_companies: Dataframe of S&P Company data, must include Symbol and Headquarter information
+    :param ticker_data: Yahoo finance dataframe that has close data for all the relevant symbols, or its to_dict() form
+    :param geo_data: jsonlike string of all the city polygon information, or a GeoDataFrame of places with STATEFP,
+        NAME and geometry columns such as fetch.retrieve_us_city_geodataframe returns
+    :param city_aliases: optional alias table, defaults to the one shipped with the package (see load_city_aliases)
+        for name geocoding and to no aliases for spatial geocoding
+    :param geocoding: "name" to match headquarters to places by city name, "spatial" to join headquarter points to
+        the place polygons containing them (see geocode.locate_headquarters); spatial geocoding needs every place of
+        the states involved, not only the ones named like a headquarter
+    :param gazetteer: optional output of geocode.load_gazetteer for spatial geocoding, defaults to the place records
+    :return: a geojson object that can be used to create a map from
+    """
+
+    prepped_sp_data, geo_data = prepare_geocoded_companies(sp_companies, geo_data, city_aliases, geocoding, gazetteer)
+    state_sp_data_with_geo: pd.DataFrame = geoenhance_companies(prepped_sp_data, geo_data)
+
+    # With all the S&P data now enriched with geolocation data, time to aggregate up to the city level, figuring out which cities had the biggest change in value over the day
+    change_by_symbol_df: pd.DataFrame = compute_symbol_change(ticker_data, prepped_sp_data["Symbol"].unique())
+
+    return aggregate_change_by_city(state_sp_data_with_geo, change_by_symbol_df)
+
+
+def join_ticker_history_to_geodata(sp_companies: pd.DataFrame, ticker_data: dict | pd.DataFrame, geo_data: str | gpd.GeoDataFrame,
+                                   city_aliases: pd.DataFrame | None = None, geocoding: str = "name",
+                                   gazetteer: pd.DataFrame | None = None) -> tuple:
+    """
+    This function is the time series counterpart of join_ticker_data_to_geodata, for ticker data spanning many
+    trading days, e.g. retrieve_ticker_data(sp_data, period="1y").
+
+    :param sp_companies: Dataframe of S&P Company data, must include Symbol and Headquarter information
+    :param ticker_data: Yahoo finance dataframe of every day to map, or its to_dict() form
+    :param geo_data: see join_ticker_data_to_geodata
+    :param city_aliases: see join_ticker_data_to_geodata
+    :param geocoding: see join_ticker_data_to_geodata
+    :param gazetteer: see join_ticker_data_to_geodata
+    :return: the geojson of the cities and their change per day, as aggregate_daily_change_by_city returns them
+    """
+
+    prepped_sp_data, geo_data = prepare_geocoded_companies(sp_companies, geo_data, city_aliases, geocoding, gazetteer)
+    state_sp_data_with_geo: pd.DataFrame = geoenhance_companies(prepped_sp_data, geo_data)
+    daily_change_df: pd.DataFrame = compute_daily_symbol_change(ticker_data, prepped_sp_data["Symbol"].unique())
+
+    return aggregate_daily_change_by_city(state_sp_data_with_geo, daily_change_df)
+
+
+def iter_geoenhanced_partitions(prepped_sp_data: pd.DataFrame, state_shapes: Iterable[tuple],
+                                counts: dict | None = None) -> Iterator[tuple]:
+    """
+    This function geoenhances the companies one state at a time, as the states arrive from a generator such as
+    fetch.iter_us_city_shape_files. Only the state at hand has its places in memory; states without a headquarter
+    are passed over.
+
+    :param prepped_sp_data: the output of prepare_sp_companies
+    :param state_shapes: an iterable of (state fips, FeatureCollection of its places) tuples
+    :param counts: optional dictionary that receives the running number of geoenhanced and US securities
+    :return: an iterator over (state fips, the state's companies with their state_fips, city and geometry columns)
+    """
+
+    located: pd.DataFrame = prepped_sp_data[prepped_sp_data["fips"].notnull()]
+    companies_by_fips: dict = {fips: companies for fips, companies in located.groupby("fips", sort=False)}
+    for fips, feature_collection in state_shapes:
+        state_companies: pd.DataFrame | None = companies_by_fips.get(fips)
+        if state_companies is None:
+            continue
+        city_data_df: pd.DataFrame = _city_geometries_from_dict(state_companies, {fips: feature_collection})
+        state_sp_data_with_geo: pd.DataFrame = pd.merge(state_companies, city_data_df, how="left", left_on=["fips", "City Name"], right_on=["state_fips", "city"])
+        log_geoenhancement(state_sp_data_with_geo, counts)
+        yield fips, state_sp_data_with_geo
+
+
+def stream_ticker_data_to_geodata(sp_companies: pd.DataFrame, ticker_data: dict | pd.DataFrame, state_shapes: Iterable[tuple],
+                                  fp: TextIO, city_aliases: pd.DataFrame | None = None,
+                                  precision: int | None = None) -> pd.DataFrame:
+    """
+    This function is the streaming counterpart of join_ticker_data_to_geodata: every state is joined, aggregated and
+    written to fp as soon as it arrives, and dropped before the next one is consumed, so the peak memory is that of
+    the largest state rather than of the whole country. Cities never span states, so aggregating per state gives
+    the same cities as aggregating over the whole country, and as long as the states arrive in fips order, like
+    fetch.iter_us_city_shape_files yields them, the same city ids too (see city_tables).
+
+    :param sp_companies: Dataframe of S&P Company data, must include Symbol and Headquarter information
+    :param ticker_data: Yahoo finance dataframe that has close data for all the relevant symbols, or its to_dict() form
+    :param state_shapes: an iterable of (state fips, FeatureCollection of its places), e.g. fetch.iter_us_city_shape_files
+    :param fp: a writable text file-like object that receives the geojson FeatureCollection of the cities
+    :param city_aliases: optional alias table, defaults to the one shipped with the package (see load_city_aliases)
+    :param precision: optional number of decimals to round the coordinates to
+    :return: the map data, as join_ticker_data_to_geodata returns it
+    """
+
+    prepped_sp_data: pd.DataFrame = prepare_sp_companies(sp_companies, city_aliases)
+    change_by_symbol_df: pd.DataFrame = compute_symbol_change(ticker_data, prepped_sp_data["Symbol"].unique())
+    counts: dict = {"geoenhanced": 0, "us": 0}
+    map_data_partitions: list = []
+
+    def city_partitions() -> Iterator[pd.DataFrame]:
+        next_id: int = 0
+        previous_fips: str | None = None
+        for fips, state_sp_data_with_geo in iter_geoenhanced_partitions(prepped_sp_data, state_shapes, counts):
+            if previous_fips is not None and fips < previous_fips:
+                logger.warning(f"State {fips} arrived after {previous_fips}, the city ids will differ from the serial join's")
+            previous_fips = fips
+            final_df: pd.DataFrame = aggregate_city_frame(state_sp_data_with_geo, change_by_symbol_df)
+            # the ids of every partition start at 0, they are numbered on across the states
+            final_df["id"] += next_id
+            next_id += len(final_df)
+            map_data_partitions.append(final_df.drop("geometry", axis=1).drop_duplicates())
+            yield final_df
+
+    written: int = serialize.write_feature_collection_partitions(city_partitions(), fp, precision=precision)
+    # the partitions only count the US securities of the states that arrived, the total comes from the company list
+    us_count: int = int(prepped_sp_data["name"].notnull().sum())
+    logger.info(f"The number of securities with a US geometry is: {counts['geoenhanced']}")
+    logger.info(f"The number of securities in the US is: {us_count}")
+    logger.info(f"This indicates that {us_count - counts['geoenhanced']} companies failed to be geoenhanced")
+    logger.info(f"Streamed {written} cities")
+
+    if not map_data_partitions:
+        return pd.DataFrame(columns=[column for column in CITY_COLUMNS if column != "geometry"])
+    return pd.concat(map_data_partitions, ignore_index=True)
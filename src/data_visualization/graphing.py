@@ -1,7 +1,12 @@
-import pandas as pd
-import seaborn as sns
+from __future__ import annotations
+
 import typing
 
+from data_manipulation.lazy import lazy_import
+
+pd = lazy_import("pandas")
+sns = lazy_import("seaborn")
+
 
 def create_barplot(df: pd.DataFrame, cat: str, quant: str, limit: int = 10, sort_by: str = "desc" ) -> None:
     """
@@ -1,29 +1,83 @@
-import folium
-import geojson
-from pandas import DataFrame
+from __future__ import annotations
+
+import branca.colormap
+from branca.element import MacroElement
+from data_manipulation.lazy import lazy_import
+from jinja2 import Template
+
+folium = lazy_import("folium")
+geojson = lazy_import("geojson")
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
 
 """
 This was chosen to put as a function to produce a very specific map
 """
 
+# the colour of a value by the colour steps of _color_steps, shared by the leaflet layers below; it expects the
+# thresholds and colors variables of the layer's script
+_COLOR_FUNCTION: str = """
+        {% macro color_function() %}
+            function color(value) {
+                if (value === null || value === undefined) { return "#bdbdbd"; }
+                for (var i = 1; i < thresholds.length - 1; i++) {
+                    if (value < thresholds[i]) { return colors[i - 1]; }
+                }
+                return colors[colors.length - 1];
+            }
+        {% endmacro %}
+"""
+
 
-def generate_chloropleth_map(geo_json: str, map_data: DataFrame, cols: list = ["CIK", "Change"]) -> folium.Map:
+def _color_steps(values: np.ndarray, steps: int) -> tuple:
+    """
+    :param values: the values to shade by, non finite values are ignored
+    :param steps: the number of colour steps
+    :return: the steps+1 thresholds spanning the values, the YlGn colour of every step and the legend of the steps
+    """
+
+    finite: np.ndarray = values[np.isfinite(values)]
+    low, high = (float(finite.min()), float(finite.max())) if len(finite) else (0.0, 1.0)
+    if low == high:
+        high = low + 1.0
+    colormap: branca.colormap.LinearColormap = branca.colormap.linear.YlGn_09.scale(low, high)
+    thresholds: list = np.linspace(low, high, steps + 1).tolist()
+    colors: list = [colormap.rgb_hex_str((a + b) / 2) for a, b in zip(thresholds, thresholds[1:])]
+    legend: branca.colormap.StepColormap = branca.colormap.StepColormap(colors, index=thresholds, vmin=low, vmax=high,
+                                                                        caption="Net Market Cap Change By City")
+    return thresholds, colors, legend
+
+
+def _script_json(text: str) -> str:
+    """
+    :param text: a json document
+    :return: the document with <, > and & escaped as unicode escapes, so that a string in it (e.g. a scraped company
+        name containing </script>) cannot close the script block it is embedded into; the json value is unchanged
+    """
+
+    return text.replace("&", "\\u0026").replace("<", "\\u003c").replace(">", "\\u003e")
+
+
+def generate_chloropleth_map(geo_json: str, map_data: pd.DataFrame, cols: list = ["id", "Change"],
+                             topojson: str | None = None) -> folium.Map:
     """
     This function builds the chloropleth style map from a geojson file, a corresponding agg file, and a column set.
 
     :param geo_json: A geojson style string that has the geometry filed and a link to the identifier column in map_data
     :param map_data: A dataframe that has an id column and the field to shade by
     :param cols: A list of columns to shade by
+    :param topojson: the path of the geometry collection (e.g. "objects.places") when geo_json is a TopoJSON topology
     :return:
     """
     m = folium.Map(location=[48, -102], zoom_start=3)
 
     folium.Choropleth(
         geo_data=geojson.loads(geo_json),
+        topojson=topojson,
         name="choropleth",
         data=map_data,
         columns=cols,
-        key_on="feature.properties.CIK",
+        key_on=f"feature.properties.{cols[0]}",
         fill_color="YlGn",
         fill_opacity=0.7,
         line_opacity=0.2,
@@ -32,4 +86,224 @@ def generate_chloropleth_map(geo_json: str, map_data: DataFrame, cols: list = ["
 
     folium.LayerControl().add_to(m)
 
-    return m
\ No newline at end of file
+    return m
+
+
+class _GeoJsonTileLayer(MacroElement):
+    """
+    A leaflet layer that loads {z}/{x}/{y}.geojson tiles for the current view only, colouring every feature by one of
+    its properties with precomputed colour steps, and drops the tiles that scroll out of view.
+    """
+
+    _template = Template(_COLOR_FUNCTION + """
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var tileUrl = {{ this.tile_url|tojson }};
+            var minZoom = {{ this.min_zoom }}, maxZoom = {{ this.max_zoom }};
+            var keyProperty = {{ this.key_property|tojson }}, valueProperty = {{ this.value_property|tojson }};
+            var thresholds = {{ this.thresholds|tojson }}, colors = {{ this.colors|tojson }};
+            var layers = {};
+
+            {{ color_function() }}
+
+            function style(feature) {
+                return {fillColor: color(feature.properties[valueProperty]), fillOpacity: {{ this.fill_opacity }}, stroke: false};
+            }
+
+            function tooltip(feature, layer) {
+                var label = feature.properties["Headquarters Location"] || feature.properties[keyProperty];
+                layer.bindTooltip(label + ": " + feature.properties[valueProperty]);
+            }
+
+            function refresh() {
+                var z = Math.max(minZoom, Math.min(maxZoom, Math.floor(map.getZoom())));
+                var n = Math.pow(2, z), bounds = map.getBounds();
+                function column(lon) { return Math.min(n - 1, Math.max(0, Math.floor((lon + 180) / 360 * n))); }
+                function row(lat) {
+                    lat = Math.max(-85.0511, Math.min(85.0511, lat)) * Math.PI / 180;
+                    return Math.min(n - 1, Math.max(0, Math.floor((1 - Math.asinh(Math.tan(lat)) / Math.PI) / 2 * n)));
+                }
+                var wanted = {};
+                for (var x = column(bounds.getWest()); x <= column(bounds.getEast()); x++) {
+                    for (var y = row(bounds.getNorth()); y <= row(bounds.getSouth()); y++) {
+                        var key = z + "/" + x + "/" + y;
+                        wanted[key] = true;
+                        if (layers[key]) { continue; }
+                        layers[key] = L.geoJSON(null, {style: style, onEachFeature: tooltip}).addTo(map);
+                        (function(key) {
+                            fetch(tileUrl.replace("{z}", z).replace("{x}", key.split("/")[1]).replace("{y}", key.split("/")[2]))
+                                .then(function(response) { return response.ok ? response.json() : null; })
+                                .then(function(data) { if (data && layers[key]) { layers[key].addData(data); } })
+                                .catch(function() {});
+                        })(key);
+                    }
+                }
+                Object.keys(layers).forEach(function(key) {
+                    if (!wanted[key]) { map.removeLayer(layers[key]); delete layers[key]; }
+                });
+            }
+
+            map.on("moveend", refresh);
+            map.whenReady(refresh);
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, tile_url: str, min_zoom: int, max_zoom: int, key_property: str, value_property: str,
+                 thresholds: list, colors: list, fill_opacity: float):
+        super().__init__()
+        self._name = "GeoJsonTileLayer"
+        self.tile_url: str = tile_url
+        self.min_zoom: int = min_zoom
+        self.max_zoom: int = max_zoom
+        self.key_property: str = key_property
+        self.value_property: str = value_property
+        self.thresholds: list = thresholds
+        self.colors: list = colors
+        self.fill_opacity: float = fill_opacity
+
+
+def generate_tiled_chloropleth_map(tile_url: str, map_data: pd.DataFrame, cols: list = ["id", "Change"],
+                                   min_zoom: int = 2, max_zoom: int = 10, steps: int = 6) -> folium.Map:
+    """
+    This function builds the chloropleth style map on top of a tile pyramid written by tiles.generate_vector_tiles,
+    so the page only loads the geometry in view. The tiles are fetched by the browser, so the map has to be served
+    over http together with the tiles (e.g. python -m http.server) rather than opened as a file.
+
+    :param tile_url: url template of the tiles relative to the map page, e.g. "tiles/{z}/{x}/{y}.geojson"
+    :param map_data: A dataframe that has an id column and the field to shade by
+    :param cols: the feature property identifying a city and the property to shade by
+    :param min_zoom: the lowest zoom level of the tile pyramid
+    :param max_zoom: the highest zoom level of the tile pyramid, deeper zooms reuse its tiles
+    :param steps: the number of colour steps
+    :return:
+    """
+    m = folium.Map(location=[48, -102], zoom_start=max(3, min_zoom))
+
+    thresholds, colors, legend = _color_steps(map_data[cols[1]].to_numpy(dtype=float), steps)
+    m.add_child(_GeoJsonTileLayer(tile_url, min_zoom, max_zoom, cols[0], cols[1], thresholds, colors, fill_opacity=0.7))
+    legend.add_to(m)
+
+    return m
+
+
+class _TimeSliderChoropleth(MacroElement):
+    """
+    A leaflet geojson layer coloured by one value per feature and frame, with a slider and a play button stepping
+    through the frames. The geometry is embedded once and the values as a matrix with a row per feature id, so
+    every additional frame only costs one number per feature.
+    """
+
+    _template = Template(_COLOR_FUNCTION + """
+        {% macro script(this, kwargs) %}
+        (function() {
+            var map = {{ this._parent.get_name() }};
+            var data = {{ this.geo_json }};
+            var keyProperty = {{ this.key_property|tojson }}, labelProperty = {{ this.label_property|tojson }};
+            var frames = {{ this.frames|tojson }}, ids = {{ this.ids|tojson }}, values = {{ this.values|tojson }};
+            var thresholds = {{ this.thresholds|tojson }}, colors = {{ this.colors|tojson }};
+            var rows = {}, frame = frames.length - 1, timer = null;
+            ids.forEach(function(id, i) { rows[id] = i; });
+
+            function value(feature) {
+                var row = values[rows[feature.properties[keyProperty]]];
+                return row === undefined ? null : row[frame];
+            }
+
+            {{ color_function() }}
+
+            function style(feature) {
+                return {fillColor: color(value(feature)), fillOpacity: {{ this.fill_opacity }}, weight: 0.5, color: "#555555"};
+            }
+
+            var layer = L.geoJSON(data, {style: style, onEachFeature: function(feature, featureLayer) {
+                featureLayer.bindTooltip(function() {
+                    var v = value(feature);
+                    return feature.properties[labelProperty] + " " + frames[frame] + ": " + (v === null ? "n/a" : v.toLocaleString());
+                });
+            }}).addTo(map);
+
+            var control = L.control({position: "bottomleft"});
+            control.onAdd = function() {
+                var div = L.DomUtil.create("div", "leaflet-bar");
+                div.style.background = "white";
+                div.style.padding = "4px 8px";
+                div.innerHTML = '<button type="button">&#9654;</button> ' +
+                    '<input type="range" min="0" max="' + (frames.length - 1) + '" style="width: 300px; vertical-align: middle"> <span></span>';
+                L.DomEvent.disableClickPropagation(div);
+                return div;
+            };
+            control.addTo(map);
+            var container = control.getContainer();
+            var button = container.querySelector("button"), slider = container.querySelector("input"), label = container.querySelector("span");
+
+            function show(i) {
+                frame = i;
+                slider.value = i;
+                label.textContent = frames[i];
+                layer.setStyle(style);
+            }
+
+            slider.addEventListener("input", function() { show(parseInt(slider.value, 10)); });
+            button.addEventListener("click", function() {
+                if (timer !== null) {
+                    clearInterval(timer);
+                    timer = null;
+                    button.innerHTML = "&#9654;";
+                    return;
+                }
+                button.innerHTML = "&#10074;&#10074;";
+                timer = setInterval(function() { show((frame + 1) % frames.length); }, {{ this.interval }});
+            });
+            show(frame);
+        })();
+        {% endmacro %}
+    """)
+
+    def __init__(self, geo_json: str, key_property: str, label_property: str, frames: list, ids: list, values: list,
+                 thresholds: list, colors: list, fill_opacity: float, interval: int):
+        super().__init__()
+        self._name = "TimeSliderChoropleth"
+        self.geo_json: str = _script_json(geo_json)
+        self.key_property: str = key_property
+        self.label_property: str = label_property
+        self.frames: list = frames
+        self.ids: list = ids
+        self.values: list = values
+        self.thresholds: list = thresholds
+        self.colors: list = colors
+        self.fill_opacity: float = fill_opacity
+        self.interval: int = interval
+
+
+def generate_time_slider_chloropleth_map(geo_json: str, frame_data: pd.DataFrame, key_property: str = "id",
+                                         label_property: str = "Headquarters Location", steps: int = 6,
+                                         interval: int = 500) -> folium.Map:
+    """
+    This function builds an animated chloropleth map with one frame per column of frame_data, e.g. one per trading
+    day. The colour steps span the values of all frames, so the colours are comparable from one frame to the next.
+
+    :param geo_json: A geojson style string whose features carry the key_property, e.g. the geometry returned by
+        transform.aggregate_daily_change_by_city
+    :param frame_data: A dataframe indexed by the key_property values with one column of values per frame, the
+        column names are shown as the frame labels
+    :param key_property: the feature property identifying a row of frame_data
+    :param label_property: the feature property shown in the tooltips
+    :param steps: the number of colour steps
+    :param interval: the milliseconds every frame is shown for while playing
+    :return:
+    """
+    m = folium.Map(location=[48, -102], zoom_start=3)
+
+    matrix: np.ndarray = frame_data.to_numpy(dtype=float)
+    thresholds, colors, legend = _color_steps(matrix, steps)
+
+    # whole numbers keep the matrix compact, the change is in dollars traded anyway
+    values: list = [[None if np.isnan(v) else int(round(v)) for v in row] for row in matrix]
+    ids: list = [i.item() if isinstance(i, np.generic) else i for i in frame_data.index]
+    m.add_child(_TimeSliderChoropleth(geo_json, key_property, label_property, [str(c) for c in frame_data.columns], ids,
+                                      values, thresholds, colors, fill_opacity=0.7, interval=interval))
+    legend.add_to(m)
+
+    return m
@@ -0,0 +1,161 @@
+from __future__ import annotations
+
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator
+
+from data_manipulation import serialize
+from data_manipulation.lazy import lazy_import
+from data_manipulation.simplify import zoom_precision, zoom_tolerance
+
+np = lazy_import("numpy")
+shapely = lazy_import("shapely")
+
+"""
+The purpose of this module is to cut the joined city geometry into a z/x/y pyramid of GeoJSON tiles, laid out like an
+MBTiles/PMTiles export on a plain directory, so that a map only loads the tiles in view instead of every polygon.
+"""
+
+
+MAX_LATITUDE: float = 85.0511287798066
+
+# per worker process copies of the features, set once by _init_worker instead of being pickled with every tile
+_worker_geometries: np.ndarray | None = None
+_worker_properties: list | None = None
+_worker_tree: shapely.STRtree | None = None
+
+
+def tile_bounds(z: int, x: int, y: int) -> tuple:
+    """
+    :param z: zoom level
+    :param x: tile column
+    :param y: tile row, counted from the north like the XYZ scheme leaflet uses
+    :return: the (west, south, east, north) bounds of the tile in degrees
+    """
+
+    n: int = 2 ** z
+
+    def latitude(row: int) -> float:
+        return math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * row / n))))
+
+    return x / n * 360.0 - 180.0, latitude(y + 1), (x + 1) / n * 360.0 - 180.0, latitude(y)
+
+
+def tiles_for_bounds(bounds: tuple, z: int) -> Iterator[tuple]:
+    """
+    :param bounds: (west, south, east, north) in degrees
+    :param z: zoom level
+    :return: an iterator over the (x, y) of every tile at zoom z intersecting the bounds
+    """
+
+    n: int = 2 ** z
+
+    def column(lon: float) -> int:
+        return min(n - 1, max(0, int((lon + 180.0) / 360.0 * n)))
+
+    def row(lat: float) -> int:
+        lat = max(-MAX_LATITUDE, min(MAX_LATITUDE, lat))
+        return min(n - 1, max(0, int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * n)))
+
+    west, south, east, north = bounds
+    for x in range(column(west), column(east) + 1):
+        for y in range(row(north), row(south) + 1):
+            yield x, y
+
+
+def _init_worker(wkb: list, properties: list) -> None:
+    global _worker_geometries, _worker_properties, _worker_tree
+    _worker_geometries = shapely.from_wkb(np.array(wkb, dtype=object))
+    _worker_properties = properties
+    _worker_tree = shapely.STRtree(_worker_geometries)
+
+
+def _render_tile(out_dir: str, z: int, x: int, y: int, pixels: float, buffer: float) -> int:
+    west, south, east, north = tile_bounds(z, x, y)
+    margin_x: float = (east - west) * buffer
+    margin_y: float = (north - south) * buffer
+    candidates: np.ndarray = _worker_tree.query(shapely.box(west - margin_x, south - margin_y, east + margin_x, north + margin_y))
+    if len(candidates) == 0:
+        return 0
+
+    candidates = np.sort(candidates)
+    simplified: np.ndarray = shapely.simplify(_worker_geometries[candidates], zoom_tolerance(z, pixels), preserve_topology=True)
+    clipped: np.ndarray = shapely.clip_by_rect(simplified, west - margin_x, south - margin_y, east + margin_x, north + margin_y)
+    precision: int = zoom_precision(z, pixels)
+    features: list = [
+        {"type": "Feature", "properties": _worker_properties[i], "geometry": serialize.geometry_to_dict(geometry, precision)}
+        for i, geometry in zip(candidates, clipped) if not geometry.is_empty
+    ]
+    if not features:
+        return 0
+
+    tile_dir: str = os.path.join(out_dir, str(z), str(x))
+    os.makedirs(tile_dir, exist_ok=True)
+    with open(os.path.join(tile_dir, f"{y}.geojson"), "w") as f:
+        f.write(serialize.dumps({"type": "FeatureCollection", "features": features}))
+    return len(features)
+
+
+def _render_tiles(out_dir: str, tiles: list, pixels: float, buffer: float) -> int:
+    return sum(1 for z, x, y in tiles if _render_tile(out_dir, z, x, y, pixels, buffer))
+
+
+def generate_vector_tiles(geo_json: str, out_dir: str, min_zoom: int = 2, max_zoom: int = 10, pixels: float = 0.5,
+                          buffer: float = 1 / 64, max_workers: int | None = None, batch_size: int = 64,
+                          name: str = "places") -> dict:
+    """
+    This function writes a GeoJSON FeatureCollection as a pyramid of tiles {out_dir}/{z}/{x}/{y}.geojson. Every tile
+    holds the features intersecting it, simplified for its zoom level and clipped to its (slightly buffered) bounds,
+    with all the feature properties (e.g. the per city Change) kept. Only tiles with features are written. The tiles
+    of all zoom levels are rendered in parallel on a process pool; each worker receives the geometry once, as WKB.
+
+    :param geo_json: a GeoJSON FeatureCollection string, e.g. the output of transform.forge_geojson
+    :param out_dir: the directory to write the pyramid and its metadata.json to
+    :param min_zoom: the lowest zoom level to render
+    :param max_zoom: the highest zoom level to render
+    :param pixels: how many screen pixels of simplification error are acceptable at every zoom level
+    :param buffer: the fraction of a tile's size to keep around it, so polygon edges do not show at tile seams
+    :param max_workers: the number of worker processes, defaults to the number of cpus
+    :param batch_size: the number of tiles a worker renders per task
+    :param name: the name of the layer in the metadata
+    :return: the tileset metadata, also written to {out_dir}/metadata.json
+    """
+
+    features: list = [f for f in json.loads(geo_json).get("features", []) if f.get("geometry") is not None]
+    geometries: np.ndarray = np.array([shapely.geometry.shape(f["geometry"]) for f in features], dtype=object)
+    properties: list = [f.get("properties") or dict() for f in features]
+    os.makedirs(out_dir, exist_ok=True)
+
+    # only the tiles that touch the bounding box of at least one feature need rendering
+    tiles: set = set()
+    for z in range(min_zoom, max_zoom + 1):
+        for bounds in shapely.bounds(geometries):
+            tiles.update((z, x, y) for x, y in tiles_for_bounds(tuple(bounds), z))
+    ordered_tiles: list = sorted(tiles)
+    batches: list = [ordered_tiles[i:i + batch_size] for i in range(0, len(ordered_tiles), batch_size)]
+
+    written: int = 0
+    if batches:
+        with ProcessPoolExecutor(max_workers=max_workers, initializer=_init_worker,
+                                 initargs=(shapely.to_wkb(geometries).tolist(), properties)) as executor:
+            written = sum(executor.map(_render_tiles, [out_dir] * len(batches), batches,
+                                       [pixels] * len(batches), [buffer] * len(batches)))
+
+    total_bounds: list = shapely.total_bounds(geometries).tolist() if len(geometries) else [-180.0, -MAX_LATITUDE, 180.0, MAX_LATITUDE]
+    fields: dict = {key: type(value).__name__ for props in properties for key, value in props.items()}
+    metadata: dict = {
+        "name": name,
+        "format": "geojson",
+        "scheme": "xyz",
+        "minzoom": min_zoom,
+        "maxzoom": max_zoom,
+        "bounds": total_bounds,
+        "center": [(total_bounds[0] + total_bounds[2]) / 2, (total_bounds[1] + total_bounds[3]) / 2, min_zoom],
+        "tiles": written,
+        "vector_layers": [{"id": name, "fields": fields, "minzoom": min_zoom, "maxzoom": max_zoom}],
+    }
+    with open(os.path.join(out_dir, "metadata.json"), "w") as f:
+        json.dump(metadata, f, indent=2)
+    return metadata
@@ -0,0 +1,306 @@
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import sys
+
+from data_manipulation import fetch
+from data_manipulation import geostore
+from data_manipulation import providers
+from data_manipulation import simplify
+from data_manipulation import transform
+from data_manipulation.cache import DEFAULT_CACHE_DIR, ShapeCache
+from data_manipulation.geostore import PLACE_STORE_CRS
+from data_manipulation.lazy import lazy_import
+from pipeline import stages
+from pipeline.metrics import PROFILERS, MetricsRecorder
+from pipeline.runner import Pipeline
+
+gpd = lazy_import("geopandas")
+pd = lazy_import("pandas")
+# the renderers pull in folium and branca, the fetch and join subcommands never touch them
+mapping = lazy_import("data_visualization.mapping")
+tiles = lazy_import("data_visualization.tiles")
+
+"""
+The purpose of this module is the market-change console script. Its subcommands run the map build up to a point:
+
+    market-change fetch     download the S&P 500 list, the ticker data and the place geometry into the caches
+    market-change join      join the market data to the places and write the cities as GeoJSON or GeoParquet
+    market-change render    render the map as a Folium HTML page, as a vector tile pyramid with its page, or as an
+                            animation of every trading day of --period
+    market-change vintages  store several census vintages of the places and report the places that changed
+
+Every subcommand runs the incremental pipeline, so the stages a previous run left valid are not recomputed. The
+environment variables bin/main.py used to read still work as the defaults of the matching options.
+"""
+
+logger: logging.Logger = logging.getLogger("market_change")
+
+DEFAULT_OUTPUT_DIR: str = os.path.join(os.path.expanduser("~"), "Documents", "maps")
+JOIN_FORMATS: tuple = ("geojson", "geoparquet")
+RENDER_FORMATS: tuple = ("html", "tiles", "animation")
+
+
+def _env_int(name: str) -> int | None:
+    return int(os.environ[name]) if os.environ.get(name) else None
+
+
+def _add_common_options(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--cache-dir", default=DEFAULT_CACHE_DIR,
+                        help="directory of the download caches and the place store (default: %(default)s)")
+    parser.add_argument("--pipeline-dir", default=None,
+                        help="directory of the pipeline artifacts (default: the pipeline directory of --cache-dir)")
+    parser.add_argument("--offline", metavar="DIR", default=os.environ.get("MARKET_DATA_REPLAY"),
+                        help="serve every payload from a directory recorded with --record instead of the network "
+                             "[MARKET_DATA_REPLAY]")
+    parser.add_argument("--latency", type=float, default=float(os.environ.get("MARKET_DATA_LATENCY", 0)),
+                        help="seconds every offline payload is delayed by [MARKET_DATA_LATENCY]")
+    parser.add_argument("--record", metavar="DIR", default=os.environ.get("MARKET_DATA_RECORD"),
+                        help="record every payload to a directory for later --offline runs [MARKET_DATA_RECORD]")
+    parser.add_argument("--period", default="1d",
+                        help="the period of ticker data to download, e.g. 1d, 5d, 1mo or 1y (default: %(default)s)")
+    parser.add_argument("--interval", default="1d", help="the bar size of the ticker data (default: %(default)s)")
+    parser.add_argument("--vintage", type=int, default=_env_int("MAP_TIGER_VINTAGE") or fetch.DEFAULT_VINTAGE,
+                        help="the year of the census TIGER/Line places (default: %(default)s) [MAP_TIGER_VINTAGE]")
+    parser.add_argument("--shape-workers", type=int, default=8,
+                        help="number of states whose census shape files are downloaded concurrently (default: %(default)s)")
+    parser.add_argument("--download-workers", type=int, default=4,
+                        help="number of ticker batches downloaded concurrently (default: %(default)s)")
+    parser.add_argument("--join-workers", type=int, default=_env_int("MAP_JOIN_WORKERS"),
+                        help="join and aggregate the states on this many processes instead of serially [MAP_JOIN_WORKERS]")
+    parser.add_argument("--force", action="append", default=[], metavar="STAGE",
+                        help="recompute a pipeline stage even if its artifact is valid, can be repeated")
+    parser.add_argument("--metrics", metavar="FILE", default=os.environ.get("MARKET_CHANGE_METRICS"),
+                        help="write the stage metrics to a .prom file or append them as JSON lines to any other file "
+                             "[MARKET_CHANGE_METRICS]")
+    parser.add_argument("--profile", choices=PROFILERS, default=os.environ.get("MARKET_CHANGE_PROFILE") or None,
+                        help="capture every stage with a profiler into the profile directory next to the output "
+                             "[MARKET_CHANGE_PROFILE]")
+    parser.add_argument("-v", "--verbose", action="store_true", help="log debug messages")
+
+
+def _add_simplification_options(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument("--zoom", type=int, default=3,
+                        help="the zoom level the geometry is simplified for (default: %(default)s)")
+    parser.add_argument("--pixels", type=float, default=0.5,
+                        help="the simplification tolerance in screen pixels at that zoom (default: %(default)s)")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    """
+    :return: the argument parser of the market-change console script
+    """
+
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(prog="market-change", description="S&P 500 market change by headquarter city")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    fetch_parser: argparse.ArgumentParser = commands.add_parser("fetch", help="download the constituents, ticker data and place geometry")
+    _add_common_options(fetch_parser)
+
+    join_parser: argparse.ArgumentParser = commands.add_parser("join", help="join the market data to the places")
+    _add_common_options(join_parser)
+    _add_simplification_options(join_parser)
+    join_parser.add_argument("--format", choices=JOIN_FORMATS, default="geojson", help="the output format (default: %(default)s)")
+    join_parser.add_argument("--simplify", action="store_true", help="simplify the geometry for --zoom before writing it")
+    join_parser.add_argument("-o", "--output", default=None,
+                             help=f"the file to write (default: chloropleth_map.<format> in {DEFAULT_OUTPUT_DIR})")
+    join_parser.add_argument("--streaming", action="store_true", default=bool(os.environ.get("MAP_STREAMING")),
+                             help="join one state at a time straight into a GeoJSON file, bounding the peak memory [MAP_STREAMING]")
+
+    render_parser: argparse.ArgumentParser = commands.add_parser("render", help="render the map")
+    _add_common_options(render_parser)
+    _add_simplification_options(render_parser)
+    render_parser.add_argument("--format", choices=RENDER_FORMATS, default="tiles" if os.environ.get("MAP_TILES") else "html",
+                               help="a single HTML page, a page loading a vector tile pyramid written to the tiles "
+                                    "directory next to it, or an HTML page animating the change of every day of "
+                                    "--period (default: %(default)s) [MAP_TILES]")
+    render_parser.add_argument("--min-zoom", type=int, default=2, help="the lowest zoom level of the tiles (default: %(default)s)")
+    render_parser.add_argument("--max-zoom", type=int, default=10, help="the highest zoom level of the tiles (default: %(default)s)")
+    render_parser.add_argument("--tile-workers", type=int, default=None, help="number of processes rendering the tiles (default: cpus)")
+    render_parser.add_argument("-o", "--output", default=os.path.join(DEFAULT_OUTPUT_DIR, "chloropleth_map.html"),
+                               help="the HTML page to write (default: %(default)s)")
+    render_parser.add_argument("--streaming", action="store_true", default=bool(os.environ.get("MAP_STREAMING")),
+                               help="join one state at a time, bounding the peak memory; html only [MAP_STREAMING]")
+
+    vintages_parser: argparse.ArgumentParser = commands.add_parser("vintages", help="diff the places of census vintages")
+    _add_common_options(vintages_parser)
+    vintages_parser.add_argument("vintages", type=int, nargs="+", metavar="YEAR",
+                                 help="the vintages to store, every one is diffed against the one before it")
+    vintages_parser.add_argument("--store-dir", default=None,
+                                 help="directory of the vintage store (default: the vintages directory of --cache-dir)")
+    vintages_parser.add_argument("--refresh", action="store_true", help="retrieve the vintages again even if they are stored")
+    vintages_parser.add_argument("-o", "--output", default=os.path.join(DEFAULT_OUTPUT_DIR, "place_changes.csv"),
+                                 help="the CSV diff report to write (default: %(default)s)")
+    return parser
+
+
+def _provider(args: argparse.Namespace) -> providers.Provider | None:
+    if args.offline:
+        return providers.ReplayProvider(args.offline, latency=args.latency)
+    if args.record:
+        return providers.RecordingProvider(providers.LIVE_PROVIDER, args.record)
+    return None
+
+
+def _pipeline(args: argparse.Namespace, provider: providers.Provider | None, metrics: MetricsRecorder | None) -> Pipeline:
+    return stages.build_market_change_pipeline(
+        directory=args.pipeline_dir or os.path.join(args.cache_dir, "pipeline"), cache_dir=args.cache_dir,
+        zoom=getattr(args, "zoom", 3), pixels=getattr(args, "pixels", 0.5), provider=provider,
+        join_workers=args.join_workers, metrics=metrics, shape_workers=args.shape_workers,
+        download_workers=args.download_workers, period=args.period, interval=args.interval, vintage=args.vintage)
+
+
+def _run(pipeline: Pipeline, targets: list, force: list) -> dict:
+    outputs: dict = pipeline.run(targets, force=tuple(force))
+    recomputed: list = [entry["stage"] for entry in pipeline.report if entry["status"] != "reused"]
+    logger.info(f"Recomputed {len(recomputed)} of {len(pipeline.report)} stages: {', '.join(recomputed)}")
+    return outputs
+
+
+def _stream_join(args: argparse.Namespace, provider: providers.Provider | None, metrics: MetricsRecorder | None,
+                 path: str) -> pd.DataFrame:
+    """
+    :return: the map data, with the joined cities streamed to the GeoJSON file at path
+    """
+
+    measured = (lambda stage, func: func) if metrics is None else metrics.instrument
+    if metrics is not None:
+        provider = metrics.provider = providers.MeteredProvider(provider or providers.LIVE_PROVIDER)
+    sp_data: pd.DataFrame = measured("retrieve_sp_500", fetch.retrieve_sp_500)(provider=provider)
+    retrieve_ticker_data = measured("retrieve_ticker_data", fetch.retrieve_ticker_data)
+    sp_market_data: pd.DataFrame = retrieve_ticker_data(sp_data, period=args.period, interval=args.interval, provider=provider,
+                                                        max_workers=args.download_workers)
+    places: set = transform.places_of_interest(transform.prepare_sp_companies(sp_data))
+    state_shapes = fetch.iter_us_city_shape_files(max_workers=args.shape_workers, places=places, cache=ShapeCache(args.cache_dir),
+                                                  provider=provider, use_builtin_states=True, vintage=args.vintage)
+    with open(path, "w") as f:
+        map_data: pd.DataFrame = measured("stream_ticker_data_to_geodata", transform.stream_ticker_data_to_geodata)(sp_data, sp_market_data, state_shapes, f)
+    logger.info(f"Successfully streamed us_city_shape_files, market data to {path}")
+    return map_data
+
+
+def write_geoparquet(map_geometry: str, path: str) -> None:
+    """
+    :param map_geometry: the GeoJSON FeatureCollection of the joined cities
+    :param path: the GeoParquet file to write, one row per city with its properties and geometry
+    """
+
+    features: list = json.loads(map_geometry)["features"]
+    cities: gpd.GeoDataFrame = gpd.GeoDataFrame.from_features(features, crs=PLACE_STORE_CRS) if features else \
+        gpd.GeoDataFrame(geometry=gpd.GeoSeries([], crs=PLACE_STORE_CRS))
+    cities.to_parquet(path, index=False)
+
+
+def fetch_command(args: argparse.Namespace, provider: providers.Provider | None, metrics: MetricsRecorder | None) -> None:
+    outputs: dict = _run(_pipeline(args, provider, metrics), ["sp_500", "ticker_data", "places"], args.force)
+    logger.info(f"Fetched {len(outputs['sp_500'])} companies, ticker data for {outputs['ticker_data'].columns.get_level_values(1).nunique()} "
+                f"symbols and {len(outputs['places'])} places")
+
+
+def join_command(args: argparse.Namespace, provider: providers.Provider | None, metrics: MetricsRecorder | None) -> None:
+    path: str = args.output or os.path.join(DEFAULT_OUTPUT_DIR, f"chloropleth_map.{args.format}")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if args.streaming:
+        if args.format != "geojson" or args.simplify:
+            raise SystemExit("--streaming writes unsimplified GeoJSON only")
+        _stream_join(args, provider, metrics, path)
+        return
+
+    target: str = "simplified" if args.simplify else "aggregated"
+    map_geometry, _ = _run(_pipeline(args, provider, metrics), [target], args.force)[target]
+    if args.format == "geoparquet":
+        write_geoparquet(map_geometry, path)
+    else:
+        with open(path, "w") as f:
+            f.write(map_geometry)
+    logger.info(f"Successfully wrote the joined cities to {path}")
+
+
+def render_command(args: argparse.Namespace, provider: providers.Provider | None, metrics: MetricsRecorder | None) -> None:
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    if args.streaming:
+        if args.format != "html":
+            raise SystemExit("--streaming renders html only")
+        geojson_path: str = f"{os.path.splitext(args.output)[0]}.geojson"
+        map_data: pd.DataFrame = _stream_join(args, provider, metrics, geojson_path)
+        with open(geojson_path) as f:
+            map_ready_geo_data: str = simplify.simplify_geojson(f.read(), zoom=args.zoom, pixels=args.pixels)
+        mapping.generate_chloropleth_map(map_ready_geo_data, map_data).save(args.output)
+    elif args.format == "tiles":
+        map_geometry, map_data = _run(_pipeline(args, provider, metrics), ["aggregated"], args.force)["aggregated"]
+        tile_dir: str = os.path.join(os.path.dirname(os.path.abspath(args.output)), "tiles")
+        tile_metadata: dict = tiles.generate_vector_tiles(map_geometry, tile_dir, min_zoom=args.min_zoom, max_zoom=args.max_zoom,
+                                                          pixels=args.pixels, max_workers=args.tile_workers)
+        logger.info(f"Successfully generated {tile_metadata['tiles']:,} vector tiles in {tile_dir}")
+        mapping.generate_tiled_chloropleth_map("tiles/{z}/{x}/{y}.geojson", map_data, min_zoom=args.min_zoom,
+                                               max_zoom=args.max_zoom).save(args.output)
+    else:
+        target: str = "animation_html" if args.format == "animation" else "map_html"
+        map_html: str = _run(_pipeline(args, provider, metrics), [target], args.force)[target]
+        with open(args.output, "w") as f:
+            f.write(map_html)
+    logger.info(f"Successfully generated chloropleth map {args.output}")
+
+
+def vintages_command(args: argparse.Namespace, provider: providers.Provider | None, metrics: MetricsRecorder | None) -> None:
+    store_dir: str = args.store_dir or os.path.join(args.cache_dir, "vintages")
+    measured = (lambda stage, func: func) if metrics is None else metrics.instrument
+    if metrics is not None:
+        provider = metrics.provider = providers.MeteredProvider(provider or providers.LIVE_PROVIDER)
+    vintages: list = sorted(set(args.vintages))
+    for vintage in vintages:
+        places: gpd.GeoDataFrame = measured(f"places_{vintage}", fetch.retrieve_place_vintage)(
+            store_dir, vintage, refresh=args.refresh, cache=ShapeCache(args.cache_dir), provider=provider,
+            use_builtin_states=True, max_workers=args.shape_workers)
+        logger.info(f"Vintage {vintage} holds {len(places)} places")
+
+    diffs: list = [geostore.diff_place_vintages(store_dir, old, new).assign(old=old, new=new)
+                   .rename(columns={f"NAME_{old}": "old_name", f"NAME_{new}": "new_name",
+                                    f"geometry_hash_{old}": "old_geometry_hash", f"geometry_hash_{new}": "new_geometry_hash"})
+                   for old, new in zip(vintages, vintages[1:])]
+    columns: list = ["old", "new", "GEOID", "STATEFP", "old_name", "new_name", "status", "old_geometry_hash", "new_geometry_hash"]
+    report: pd.DataFrame = pd.concat(diffs, ignore_index=True)[columns] if diffs else pd.DataFrame(columns=columns)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    report.to_csv(args.output, index=False)
+    for (old, new), counts in report.groupby(["old", "new"])["status"].value_counts().unstack(fill_value=0).iterrows():
+        logger.info(f"{old} -> {new}: " + ", ".join(f"{count} {status}" for status, count in counts.items()))
+    logger.info(f"Successfully wrote the changes of {len(report)} places to {args.output}")
+
+
+COMMANDS: dict = {"fetch": fetch_command, "join": join_command, "render": render_command, "vintages": vintages_command}
+
+
+def main(argv: list | None = None) -> int:
+    """
+    The entry point of the market-change console script.
+
+    :param argv: the command line arguments, defaults to sys.argv[1:]
+    :return: the exit status
+    """
+
+    args: argparse.Namespace = build_parser().parse_args(argv)
+    if not logger.handlers:
+        handler: logging.StreamHandler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+        logger.addHandler(handler)
+    logger.setLevel(logging.DEBUG if args.verbose else logging.INFO)
+
+    provider: providers.Provider | None = _provider(args)
+    metrics: MetricsRecorder | None = None
+    if args.metrics or args.profile:
+        output: str = getattr(args, "output", None) or os.path.join(DEFAULT_OUTPUT_DIR, "chloropleth_map.html")
+        metrics = MetricsRecorder(profile=args.profile, profile_dir=os.path.join(os.path.dirname(os.path.abspath(output)), "profile"))
+
+    COMMANDS[args.command](args, provider, metrics)
+
+    if metrics is not None and args.metrics:
+        metrics.write(args.metrics)
+        logger.info(f"Wrote the metrics of {len(metrics.records)} stages to {args.metrics}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
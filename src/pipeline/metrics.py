@@ -0,0 +1,224 @@
+from __future__ import annotations
+
+import cProfile
+import functools
+import json
+import logging
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from typing import Any, Callable, Iterator
+
+from data_manipulation.lazy import lazy_import
+
+try:
+    import resource
+except ImportError:  # not available on windows, peak rss is then not recorded
+    resource = None
+
+pd = lazy_import("pandas")
+
+"""
+The purpose of this module is to instrument the stages of the map build: every stage records its wall time, the
+peak resident memory of the process, the bytes it downloaded, the rows it read and wrote and the size of its output,
+so that regressions show on production runs. The metrics are written as JSON lines or as a Prometheus text file,
+and a stage can optionally be captured with cProfile or tracemalloc.
+"""
+
+logger: logging.Logger = logging.getLogger("market_change.pipeline")
+
+PROFILERS: tuple = ("cprofile", "tracemalloc")
+
+
+def peak_rss_bytes() -> int | None:
+    """
+    :return: the high-water mark of the resident memory of this process and its finished children, in bytes
+    """
+
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on linux and in bytes on macos
+    unit: int = 1 if os.uname().sysname == "Darwin" else 1024
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * unit
+
+
+def count_rows(obj: Any) -> int | None:
+    """
+    :param obj: a stage input or output
+    :return: the number of rows of a DataFrame, or of the first DataFrame of a tuple such as the join's
+        (geojson, map data), the number of entries of a dictionary, e.g. the states of the shape files, else None
+    """
+
+    if isinstance(obj, (pd.DataFrame, pd.Series)):
+        return len(obj)
+    if isinstance(obj, dict):
+        return len(obj)
+    if isinstance(obj, tuple):
+        return next((len(item) for item in obj if isinstance(item, pd.DataFrame)), None)
+    return None
+
+
+def size_in_bytes(obj: Any) -> int | None:
+    """
+    :param obj: a stage output
+    :return: the encoded size of a string, the in-memory size of a DataFrame, the sum of both for a tuple, else None
+    """
+
+    if isinstance(obj, str):
+        return len(obj.encode("utf-8"))
+    if isinstance(obj, bytes):
+        return len(obj)
+    if isinstance(obj, pd.DataFrame):
+        return int(obj.memory_usage(deep=True).sum())
+    if isinstance(obj, tuple):
+        sizes: list = [size for size in map(size_in_bytes, obj) if size is not None]
+        return sum(sizes) if sizes else None
+    return None
+
+
+class MetricsRecorder:
+    """
+    Collects one record per measured stage in self.records:
+
+        stage, started, seconds, peak_rss_bytes, bytes_downloaded, rows_in, rows_out, output_bytes
+
+    plus status for stages run by a Pipeline and traced_peak_bytes when capturing with tracemalloc. The downloaded
+    bytes are read off a providers.MeteredProvider, when one is given; give the same provider to the fetch methods.
+    With profile="cprofile" every stage is written to {profile_dir}/{stage}.prof, with profile="tracemalloc" the top
+    allocation sites of every stage to {profile_dir}/{stage}.tracemalloc.txt.
+    """
+
+    def __init__(self, provider: Any = None, profile: str | None = None, profile_dir: str | None = None):
+        if profile is not None and profile not in PROFILERS:
+            raise ValueError(f"Unknown profiler {profile!r}, expected one of {', '.join(PROFILERS)}")
+        self.provider: Any = provider
+        self.profile: str | None = profile
+        self.profile_dir: str | None = profile_dir
+        self.records: list = []
+        self._lock: threading.Lock = threading.Lock()
+        if profile is not None and profile_dir is not None:
+            os.makedirs(profile_dir, exist_ok=True)
+
+    @contextmanager
+    def measure(self, stage: str, rows_in: int | None = None) -> Iterator[dict]:
+        """
+        Measures the body of the with statement as a stage. Set rows_out and output_bytes on the yielded record
+        (e.g. with record.update(...)) to report them.
+
+        :param stage: the name of the stage
+        :param rows_in: optional number of rows the stage reads
+        :return: a context manager yielding the stage's record, which is added to self.records on exit
+        """
+
+        record: dict = {"stage": stage, "started": time.time(), "seconds": None, "peak_rss_bytes": None,
+                        "bytes_downloaded": None, "rows_in": rows_in, "rows_out": None, "output_bytes": None}
+        downloaded: int | None = None if self.provider is None else self.provider.bytes_downloaded
+        profiler: cProfile.Profile | None = cProfile.Profile() if self.profile == "cprofile" else None
+        tracing: bool = self.profile == "tracemalloc" and not tracemalloc.is_tracing()
+        if tracing:
+            tracemalloc.start()
+        elif self.profile == "tracemalloc":
+            tracemalloc.reset_peak()
+        started: float = time.perf_counter()
+        if profiler is not None:
+            profiler.enable()
+        try:
+            yield record
+        finally:
+            if profiler is not None:
+                profiler.disable()
+            record["seconds"] = time.perf_counter() - started
+            record["peak_rss_bytes"] = peak_rss_bytes()
+            if downloaded is not None:
+                record["bytes_downloaded"] = self.provider.bytes_downloaded - downloaded
+            if self.profile == "tracemalloc":
+                record["traced_peak_bytes"] = tracemalloc.get_traced_memory()[1]
+                self._dump_tracemalloc(stage, tracemalloc.take_snapshot())
+                if tracing:
+                    tracemalloc.stop()
+            if profiler is not None and self.profile_dir is not None:
+                profiler.dump_stats(os.path.join(self.profile_dir, f"{stage}.prof"))
+            with self._lock:
+                self.records.append(record)
+            logger.info(f"Stage {stage} took {record['seconds']:.2f}s, rows {record['rows_in']} -> {record['rows_out']}, "
+                        f"output {record['output_bytes']} bytes, downloaded {record['bytes_downloaded']} bytes, "
+                        f"peak rss {record['peak_rss_bytes']} bytes")
+
+    def _dump_tracemalloc(self, stage: str, snapshot: tracemalloc.Snapshot, limit: int = 25) -> None:
+        if self.profile_dir is None:
+            return
+        with open(os.path.join(self.profile_dir, f"{stage}.tracemalloc.txt"), "w") as f:
+            for statistic in snapshot.statistics("lineno")[:limit]:
+                f.write(f"{statistic}\n")
+
+    def instrument(self, stage: str, func: Callable) -> Callable:
+        """
+        :param stage: the name to record the calls under
+        :param func: the function to measure, its rows in are counted from its first argument
+        :return: a wrapper of func that measures every call and records the rows and size of its result
+        """
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with self.measure(stage, rows_in=count_rows(args[0]) if args else None) as record:
+                output: Any = func(*args, **kwargs)
+                record.update(rows_out=count_rows(output), output_bytes=size_in_bytes(output))
+            return output
+
+        return wrapper
+
+    def write_jsonl(self, path: str) -> None:
+        """
+        Appends the records to a JSON lines file, so that the runs of a host accumulate in one file.
+
+        :param path: the file to append to
+        """
+
+        with open(path, "a") as f:
+            for record in self.records:
+                f.write(json.dumps(record, default=str) + "\n")
+
+    def write_prometheus(self, path: str, prefix: str = "market_change_stage") -> None:
+        """
+        Writes the records of the last run of every stage in the Prometheus text exposition format, e.g. for the
+        textfile collector of the node exporter. The file is replaced atomically so a scrape never sees half of it.
+
+        :param path: the .prom file to write
+        :param prefix: the prefix of the metric names
+        """
+
+        latest: dict = {record["stage"]: record for record in self.records}
+        metrics: dict = {
+            "seconds": "Wall time of the stage in seconds",
+            "peak_rss_bytes": "Peak resident memory of the process at the end of the stage",
+            "bytes_downloaded": "Bytes downloaded during the stage",
+            "rows_in": "Rows read by the stage",
+            "rows_out": "Rows written by the stage",
+            "output_bytes": "Size of the output of the stage in bytes",
+            "traced_peak_bytes": "Peak memory traced by tracemalloc during the stage",
+        }
+        lines: list = []
+        for metric, description in metrics.items():
+            samples: list = [(stage, record[metric]) for stage, record in latest.items() if record.get(metric) is not None]
+            if not samples:
+                continue
+            lines.append(f"# HELP {prefix}_{metric} {description}")
+            lines.append(f"# TYPE {prefix}_{metric} gauge")
+            lines.extend(f'{prefix}_{metric}{{stage="{stage}"}} {value}' for stage, value in samples)
+
+        tmp_path: str = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, path)
+
+    def write(self, path: str) -> None:
+        """
+        :param path: a .prom file to write as Prometheus text, any other file to append JSON lines to
+        """
+
+        if path.endswith(".prom"):
+            self.write_prometheus(path)
+        else:
+            self.write_jsonl(path)
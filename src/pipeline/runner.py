@@ -0,0 +1,292 @@
+import hashlib
+import importlib.util
+import inspect
+import json
+import logging
+import os
+import pickle
+import sys
+import threading
+import time
+import types
+from typing import Any, Callable
+
+from data_manipulation.cache import DEFAULT_CACHE_DIR
+from pipeline.metrics import MetricsRecorder, count_rows, size_in_bytes
+
+"""
+The purpose of this module is to run the stages of the map build as a small DAG whose intermediate artifacts are
+persisted, so that a run only recomputes the stages whose inputs actually changed since the previous one.
+"""
+
+logger: logging.Logger = logging.getLogger("market_change.pipeline")
+
+DEFAULT_PIPELINE_DIR: str = os.path.join(DEFAULT_CACHE_DIR, "pipeline")
+
+
+def _code_names(code: types.CodeType) -> set:
+    # the global names read by a function and by the functions, lambdas and comprehensions nested in it
+    names: set = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            names |= _code_names(const)
+    return names
+
+
+def _source_root(module: types.ModuleType | None) -> str | None:
+    # the directory the top-level package (or the lone module) of module was imported from
+    top: types.ModuleType | None = sys.modules.get(module.__name__.partition(".")[0]) if module is not None else None
+    path: str | None = getattr(top, "__file__", None)
+    if path is None:
+        return None
+    path = os.path.dirname(os.path.abspath(path))
+    return os.path.dirname(path) if hasattr(top, "__path__") else path
+
+
+def _first_party_path(name: str, root: str) -> str | None:
+    module: types.ModuleType | None = sys.modules.get(name)
+    if module is not None:
+        path: str | None = getattr(module, "__file__", None)
+    else:
+        # a lazily imported module that was not used yet, located without importing it (or a third party parent)
+        spec = importlib.util.find_spec(name.partition(".")[0])
+        if spec is None or not (spec.origin or "").startswith(root + os.sep):
+            return None
+        spec = importlib.util.find_spec(name)
+        path = spec.origin if spec is not None else None
+    if path is None or not os.path.abspath(path).startswith(root + os.sep) or not path.endswith(".py"):
+        return None
+    return os.path.abspath(path)
+
+
+def dependency_sources(func: Callable) -> dict:
+    """
+    This function finds the modules a stage's code depends on, so that a change to a helper it calls invalidates its
+    artifact just like a change to its own code does. The globals func reads are followed to the modules they are or
+    were defined in, and from there, through every module's globals, to the modules those use in turn. Only first
+    party modules, the ones imported from the same source root as func's own package, are followed; a third party
+    library is pinned by its version, not by this fingerprint. Lazily imported modules that were not used yet are
+    fingerprinted without being imported, and so without following their own dependencies.
+
+    :param func: the function of a stage
+    :return: a dictionary of the path of every module func depends on, relative to the source root, to the sha256
+        of its source
+    """
+
+    root: str | None = _source_root(sys.modules.get(getattr(func, "__module__", None) or ""))
+    code: types.CodeType | None = getattr(func, "__code__", None)
+    if root is None or code is None:
+        return dict()
+
+    sources: dict = dict()
+    seen: set = set()
+    pending: list = [func.__globals__[name] for name in _code_names(code) if name in func.__globals__]
+    while pending:
+        value: Any = pending.pop()
+        if isinstance(value, types.ModuleType):
+            name: str | None = value.__name__
+        elif isinstance(value, (type, types.FunctionType)):
+            name = getattr(value, "__module__", None)
+        else:
+            continue
+        if not name or name in seen:
+            continue
+        seen.add(name)
+        path: str | None = _first_party_path(name, root)
+        if path is None:
+            continue
+        with open(path, "rb") as f:
+            sources[os.path.relpath(path, root)] = hashlib.sha256(f.read()).hexdigest()
+        if name in sys.modules:
+            pending.extend(vars(sys.modules[name]).values())
+    return sources
+
+
+class Stage:
+    """
+    A named step of a pipeline: func is called with the outputs of the input stages, in order, followed by params
+    as keyword arguments. The stage is fingerprinted by its name, version, source code, the source of the first party
+    modules its code depends on (see dependency_sources), params and the fingerprints of its inputs' outputs. Keyword arguments that do not change the output, like worker counts, go in
+    runtime_params instead, which are passed to func without being fingerprinted.
+
+    Stages reading from outside of the pipeline (a website, a market data feed) cannot see whether their source
+    changed, so they carry a ttl instead: their artifact is reused for ttl seconds, ttl=0 re-runs them every time.
+    A re-run stage whose output is byte for byte the same as before leaves every stage downstream of it untouched.
+    """
+
+    def __init__(self, name: str, func: Callable, inputs: tuple = (), params: dict | None = None,
+                 ttl: float | None = None, version: str = "", runtime_params: dict | None = None):
+        self.name: str = name
+        self.func: Callable = func
+        self.inputs: tuple = tuple(inputs)
+        self.params: dict = params or dict()
+        self.ttl: float | None = ttl
+        self.version: str = version
+        self.runtime_params: dict = runtime_params or dict()
+
+    def key(self, input_fingerprints: list) -> str:
+        """
+        :param input_fingerprints: the fingerprints of the outputs of the input stages, in order
+        :return: the fingerprint of this stage's inputs, an artifact is only valid for the key it was computed with
+        """
+
+        try:
+            code: str = inspect.getsource(self.func)
+        except (OSError, TypeError):
+            code = getattr(self.func, "__qualname__", repr(self.func))
+        description: str = json.dumps([self.name, self.version, code, dependency_sources(self.func), self.params, input_fingerprints],
+                                      sort_keys=True, default=str)
+        return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+
+class Pipeline:
+    """
+    A DAG of stages with a pickled artifact per stage and a manifest.json recording, for each stage, the key its
+    artifact was computed with and the sha256 of the artifact itself. With a MetricsRecorder, every stage that is
+    recomputed is measured by it.
+    """
+
+    def __init__(self, directory: str = DEFAULT_PIPELINE_DIR, metrics: MetricsRecorder | None = None):
+        self.directory: str = directory
+        self.stages: dict = dict()
+        self.report: list = []
+        self.metrics: MetricsRecorder | None = metrics
+        os.makedirs(directory, exist_ok=True)
+        self._manifest_path: str = os.path.join(directory, "manifest.json")
+        try:
+            with open(self._manifest_path) as f:
+                self._manifest: dict = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self._manifest = dict()
+
+    def add(self, name: str, func: Callable, inputs: tuple = (), params: dict | None = None,
+            ttl: float | None = None, version: str = "", runtime_params: dict | None = None) -> "Pipeline":
+        """
+        Adds a stage, see Stage for the meaning of the arguments.
+
+        :return: the pipeline itself, so that stages can be chained
+        """
+
+        if name in self.stages:
+            raise ValueError(f"Stage {name} is already part of the pipeline")
+        self.stages[name] = Stage(name, func, inputs, params, ttl, version, runtime_params)
+        return self
+
+    def _artifact_path(self, name: str) -> str:
+        return os.path.join(self.directory, f"{name}.pickle")
+
+    def _save_manifest(self) -> None:
+        tmp_path: str = f"{self._manifest_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._manifest, f, indent=2)
+        os.replace(tmp_path, self._manifest_path)
+
+    def order(self, targets: list | None = None) -> list:
+        """
+        :param targets: the stages to run, defaults to every stage
+        :return: the names of the targets and everything upstream of them, inputs before the stages reading them
+        """
+
+        ordered: list = []
+        visiting: set = set()
+
+        def visit(name: str) -> None:
+            if name in ordered:
+                return
+            if name not in self.stages:
+                raise ValueError(f"Unknown stage {name}")
+            if name in visiting:
+                raise ValueError(f"Stage {name} is part of a cycle")
+            visiting.add(name)
+            for input_name in self.stages[name].inputs:
+                visit(input_name)
+            visiting.discard(name)
+            ordered.append(name)
+
+        for target in (list(self.stages) if targets is None else targets):
+            visit(target)
+        return ordered
+
+    def _is_fresh(self, stage: Stage, key: str, now: float) -> bool:
+        entry: dict | None = self._manifest.get(stage.name)
+        if entry is None or entry.get("key") != key or not os.path.exists(self._artifact_path(stage.name)):
+            return False
+        return stage.ttl is None or now - entry["created"] < stage.ttl
+
+    def _load(self, name: str) -> Any:
+        with open(self._artifact_path(name), "rb") as f:
+            return pickle.load(f)
+
+    def _store(self, name: str, output: Any, key: str) -> str:
+        payload: bytes = pickle.dumps(output, protocol=pickle.HIGHEST_PROTOCOL)
+        fingerprint: str = hashlib.sha256(payload).hexdigest()
+        path: str = self._artifact_path(name)
+        tmp_path: str = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(payload)
+        os.replace(tmp_path, path)
+        self._manifest[name] = {"key": key, "fingerprint": fingerprint, "created": time.time(), "bytes": len(payload)}
+        self._save_manifest()
+        return fingerprint
+
+    def run(self, targets: list | None = None, force: tuple = ()) -> dict:
+        """
+        Runs the targets, recomputing a stage only when its key changed, its ttl expired, its artifact is missing or
+        it is forced. Artifacts of reused stages are only unpickled when a recomputed stage or the caller needs them.
+        What happened to every stage is recorded in self.report.
+
+        :param targets: the stages whose outputs to return, defaults to every stage
+        :param force: names of stages to recompute regardless of their artifacts
+        :return: a dictionary of target stage name to its output
+        """
+
+        targets = list(self.stages) if targets is None else list(targets)
+        outputs: dict = dict()
+        fingerprints: dict = dict()
+        self.report = []
+
+        def output_of(name: str) -> Any:
+            if name not in outputs:
+                outputs[name] = self._load(name)
+            return outputs[name]
+
+        for name in self.order(targets):
+            stage: Stage = self.stages[name]
+            key: str = stage.key([fingerprints[input_name] for input_name in stage.inputs])
+            started: float = time.time()
+            if name not in force and self._is_fresh(stage, key, started):
+                fingerprints[name] = self._manifest[name]["fingerprint"]
+                status: str = "reused"
+            else:
+                previous: str | None = self._manifest.get(name, dict()).get("fingerprint")
+                args: list = [output_of(input_name) for input_name in stage.inputs]
+                kwargs: dict = {**stage.params, **stage.runtime_params}
+                if self.metrics is None:
+                    outputs[name] = stage.func(*args, **kwargs)
+                else:
+                    with self.metrics.measure(name, rows_in=count_rows(args[0]) if args else None) as record:
+                        outputs[name] = stage.func(*args, **kwargs)
+                        record.update(rows_out=count_rows(outputs[name]), output_bytes=size_in_bytes(outputs[name]))
+                fingerprints[name] = self._store(name, outputs[name], key)
+                status = "computed" if fingerprints[name] != previous else "unchanged"
+                if self.metrics is not None:
+                    record["status"] = status
+            seconds: float = time.time() - started
+            self.report.append({"stage": name, "status": status, "seconds": seconds, "fingerprint": fingerprints[name]})
+            logger.info(f"Stage {name} {status} in {seconds:.2f}s")
+
+        return {name: output_of(name) for name in targets}
+
+    def invalidate(self, name: str) -> None:
+        """
+        Forgets the artifact of a stage, forcing it to be recomputed on the next run.
+
+        :param name: the stage to invalidate
+        """
+
+        self._manifest.pop(name, None)
+        self._save_manifest()
+        try:
+            os.remove(self._artifact_path(name))
+        except FileNotFoundError:
+            pass
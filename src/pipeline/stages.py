@@ -0,0 +1,123 @@
+from __future__ import annotations
+
+import os
+
+from data_manipulation import fetch
+from data_manipulation import parallel
+from data_manipulation import simplify
+from data_manipulation import transform
+from data_manipulation.cache import DEFAULT_CACHE_DIR, ShapeCache
+from data_manipulation.lazy import lazy_import
+from data_manipulation.providers import MeteredProvider, Provider, SessionProvider
+from pipeline.metrics import MetricsRecorder
+from pipeline.runner import DEFAULT_PIPELINE_DIR, Pipeline
+
+pd = lazy_import("pandas")
+# folium and branca are only needed by the rendering stages
+mapping = lazy_import("data_visualization.mapping")
+
+"""
+The purpose of this module is to lay the S&P market change map out as pipeline stages. Everything derived from the
+company list and the place geometry is kept apart from the market data, so an intraday price refresh only re-runs
+the change aggregation and the map rendering.
+"""
+
+
+SP_500_TTL: float = 24 * 60 * 60
+PLACES_TTL: float = 30 * 24 * 60 * 60
+
+
+def _retrieve_places(prepared: pd.DataFrame, store_path: str, cache_dir: str, provider: Provider | None,
+                     vintage: int = fetch.DEFAULT_VINTAGE, max_workers: int = 8) -> pd.DataFrame:
+    return fetch.retrieve_us_city_geodataframe(store_path, places=transform.places_of_interest(prepared),
+                                               cache=ShapeCache(cache_dir), provider=provider,
+                                               use_builtin_states=True, max_workers=max_workers, vintage=vintage)
+
+
+def _compute_change(ticker_data: dict | pd.DataFrame, prepared: pd.DataFrame) -> pd.DataFrame:
+    return transform.compute_symbol_change(ticker_data, prepared["Symbol"].unique())
+
+
+def _compute_daily_change(ticker_data: dict | pd.DataFrame, prepared: pd.DataFrame) -> pd.DataFrame:
+    return transform.compute_daily_symbol_change(ticker_data, prepared["Symbol"].unique())
+
+
+def _simplify(aggregated: tuple, zoom: int, pixels: float = 0.5) -> tuple:
+    map_geometry, map_data = aggregated
+    return simplify.simplify_geojson(map_geometry, zoom=zoom, pixels=pixels), map_data
+
+
+def _render(simplified: tuple) -> str:
+    map_geometry, map_data = simplified
+    return mapping.generate_chloropleth_map(map_geometry, map_data).get_root().render()
+
+
+def _render_animation(daily_simplified: tuple) -> str:
+    map_geometry, city_change = daily_simplified
+    return mapping.generate_time_slider_chloropleth_map(map_geometry, city_change).get_root().render()
+
+
+def build_market_change_pipeline(directory: str = DEFAULT_PIPELINE_DIR, cache_dir: str = DEFAULT_CACHE_DIR,
+                                 store_path: str | None = None, zoom: int = 3, sp_500_ttl: float = SP_500_TTL,
+                                 places_ttl: float = PLACES_TTL, provider: Provider | None = None,
+                                 join_workers: int | None = None, metrics: MetricsRecorder | None = None,
+                                 pixels: float = 0.5, shape_workers: int = 8, download_workers: int = 4,
+                                 period: str | None = "1d", interval: str = "1d", vintage: int = fetch.DEFAULT_VINTAGE) -> Pipeline:
+    """
+    This function wires the fetch, transform and mapping steps into a pipeline:
+
+        sp_500 -> prepared -> places -> geoenhanced -> aggregated -> simplified -> map_html
+        sp_500 -> ticker_data -> change (which also reads prepared) -> aggregated
+        ticker_data -> daily_change -> daily_aggregated (which also reads geoenhanced) -> daily_simplified
+            -> animation_html
+
+    The ticker data is fetched on every run; when the prices did not move, nothing downstream of it is recomputed.
+    With join_workers, the aggregated stage skips the geoenhanced stage and joins and aggregates every state on a
+    process pool itself (see parallel.parallel_aggregate_change_by_city).
+
+    :param directory: where the pipeline keeps its artifacts and manifest
+    :param cache_dir: the directory of the ShapeCache of the census downloads
+    :param store_path: the GeoParquet place store, defaults to places_<vintage>.parquet in cache_dir
+    :param zoom: the zoom level the map geometry is simplified for
+    :param pixels: how many screen pixels of simplification error are acceptable at that zoom
+    :param sp_500_ttl: the number of seconds a scraped S&P 500 list is reused for
+    :param places_ttl: the number of seconds the place geometry is reused for
+    :param provider: where the fetch stages get their data from, defaults to the live sources over a pooled session
+        whose responses are cached in the http directory of cache_dir
+    :param join_workers: optional number of processes to join and aggregate the states on, serial by default
+    :param metrics: optional recorder to measure every recomputed stage with; unless it meters a provider already,
+        the provider is metered for it so the fetch stages report the bytes they downloaded
+    :param shape_workers: the number of states whose census shape files are downloaded concurrently
+    :param download_workers: the number of ticker batches that are downloaded concurrently
+    :param period: the period of ticker data to download, e.g. "1y" for a year of frames in animation_html
+    :param interval: the bar size of the ticker data, intraday bars are rolled up to days for animation_html
+    :param vintage: the year of the TIGER/Line release the place geometry is taken from
+    :return: the pipeline, run it with .run(["map_html"])
+    """
+
+    store_path = os.path.join(cache_dir, f"places_{vintage}.parquet") if store_path is None else store_path
+    # a cache of its own, two ShapeCache instances must not share an index
+    provider = SessionProvider(ShapeCache(os.path.join(cache_dir, "http"))) if provider is None else provider
+    if metrics is not None and metrics.provider is None:
+        provider = metrics.provider = MeteredProvider(provider)
+    pipeline: Pipeline = (Pipeline(directory, metrics)
+                          .add("sp_500", fetch.retrieve_sp_500, params={"provider": provider}, ttl=sp_500_ttl)
+                          .add("ticker_data", fetch.retrieve_ticker_data, inputs=("sp_500",), params={"provider": provider, "period": period, "interval": interval},
+                               ttl=0, runtime_params={"max_workers": download_workers})
+                          .add("prepared", transform.prepare_sp_companies, inputs=("sp_500",))
+                          .add("places", _retrieve_places, inputs=("prepared",), params={"store_path": store_path, "cache_dir": cache_dir, "provider": provider, "vintage": vintage},
+                               ttl=places_ttl, runtime_params={"max_workers": shape_workers})
+                          .add("change", _compute_change, inputs=("ticker_data", "prepared"))
+                          .add("geoenhanced", transform.geoenhance_companies, inputs=("prepared", "places")))
+    if join_workers is None:
+        pipeline.add("aggregated", transform.aggregate_change_by_city, inputs=("geoenhanced", "change"))
+    else:
+        pipeline.add("aggregated", parallel.parallel_aggregate_change_by_city, inputs=("prepared", "places", "change"),
+                     runtime_params={"max_workers": join_workers})
+    return (pipeline
+            .add("simplified", _simplify, inputs=("aggregated",), params={"zoom": zoom, "pixels": pixels})
+            .add("map_html", _render, inputs=("simplified",))
+            .add("daily_change", _compute_daily_change, inputs=("ticker_data", "prepared"))
+            .add("daily_aggregated", transform.aggregate_daily_change_by_city, inputs=("geoenhanced", "daily_change"))
+            .add("daily_simplified", _simplify, inputs=("daily_aggregated",), params={"zoom": zoom, "pixels": pixels})
+            .add("animation_html", _render_animation, inputs=("daily_simplified",)))
@@ -1,21 +1,27 @@
-import pandas as pd
+from __future__ import annotations
 
+import functools
+import numbers
+import typing
+from typing import NamedTuple
+
+from data_manipulation.lazy import lazy_import
+
+np = lazy_import("numpy")
+pd = lazy_import("pandas")
+
+
+class State(NamedTuple):
+    """
+    An immutable record of a state or outlying region, as its census name, USPS abbreviation and two-digit FIPS code.
+    """
 
-class State:
     name: str
     abbreviation: str
     fips: str
 
-    def __init__(self, name: str, abbreviation: str, fips: str):
-        self.name = name
-        self.abbreviation = abbreviation
-        self.fips = fips
-
-    def __dict__(self):
-        return {"name": self.name, "abbreviation": self.abbreviation, "fips": self.fips}
-
     def __str__(self):
-        return str(self.__dict__())
+        return str(self._asdict())
 
     def get_fips(self):
         return self.fips
@@ -35,7 +41,7 @@ California = State('California', 'CA', '06')
 Colorado = State('Colorado', 'CO', '08')
 Connecticut = State('Connecticut', 'CT', '09')
 Delaware = State('Delaware', 'DE', '10')
-DistrictOfColumbia = State('District Of Columbia', 'DC', '11')
+DistrictOfColumbia = State('District of Columbia', 'DC', '11')
 Florida = State('Florida', 'FL', '12')
 Georgia = State('Georgia', 'GA', '13')
 Hawaii = State('Hawaii', 'HI', '15')
@@ -65,7 +71,7 @@ NorthDakota = State('North Dakota', 'ND', '38')
 Ohio = State('Ohio', 'OH', '39')
 Oklahoma = State('Oklahoma', 'OK', '40')
 Oregon = State('Oregon', 'OR', '41')
-Pennsylvania = State('Pennsylvania', 'PN', '42')
+Pennsylvania = State('Pennsylvania', 'PA', '42')
 PuertoRico = State('Puerto Rico', 'PR', '72')
 RhodeIsland = State('Rhode Island', 'RI', '44')
 SouthCarolina = State('South Carolina', 'SC', '45')
@@ -77,9 +83,91 @@ Vermont = State('Vermont', 'VT', '50')
 Virginia = State('Virginia', 'VA', '51')
 VirginIslands = State("Virgin Islands", "VI", "78")
 Washington = State('Washington', 'WA', '53')
-WestVirgina = State('West Virgina', 'WV', '54')
+WestVirginia = State('West Virginia', 'WV', '54')
 Wisconsin = State('Wisconsin', 'WI', '55')
 Wyoming = State('Wyoming', 'WY', '56')
+# kept for the callers of the misspelled name
+WestVirgina = WestVirginia
+
+
+STATES: tuple = (Alabama, Alaska, Arizona, Arkansas, California, Colorado, Connecticut, Delaware, DistrictOfColumbia,
+                 Florida, Georgia, Hawaii, Idaho, Illinois, Indiana, Iowa, Kansas, Kentucky, Louisiana, Maine, Maryland,
+                 Massachusetts, Michigan, Minnesota, Mississippi, Missouri, Montana, Nebraska, Nevada, NewHampshire,
+                 NewJersey, NewMexico, NewYork, NorthCarolina, NorthDakota, Ohio, Oklahoma, Oregon, Pennsylvania,
+                 PuertoRico, RhodeIsland, SouthCarolina, SouthDakota, Tennessee, Texas, Utah, Vermont, Virginia,
+                 Washington, WestVirginia, Wisconsin, Wyoming)
+
+# spellings found in headquarter locations and older data next to the census names, abbreviations and fips codes
+VARIANTS: dict = {
+    "Washington DC": DistrictOfColumbia,
+    "Washington, D.C.": DistrictOfColumbia,
+    "West Virgina": WestVirginia,
+    "Commonwealth of Puerto Rico": PuertoRico,
+}
+
+FIELDS: tuple = State._fields
+
+
+def _normalize(key: typing.Any) -> str:
+    # case, periods and repeated whitespace do not matter: "D.C." finds DC, "District Of Columbia" its census name
+    return " ".join(str(key).replace(".", "").split()).casefold()
+
+
+def _index() -> dict:
+    index: dict = dict()
+    for state in STATES:
+        for key in (state.fips, state.abbreviation, state.name):
+            index[_normalize(key)] = state
+    for variant, state in VARIANTS.items():
+        index.setdefault(_normalize(variant), state)
+    return index
+
+
+_BY_KEY: dict = _index()
+
+
+def lookup(key: typing.Any, default: State | None = None) -> State | None:
+    """
+    Finds a state in constant time by its name, abbreviation, fips code or one of the VARIANTS, regardless of case,
+    periods and whitespace. An integer is taken as a fips code.
+
+    :param key: e.g. "Colorado", "co", "08", 8 or "District Of Columbia"
+    :param default: what to return for an unknown key
+    :return: the State, or default
+    """
+
+    if isinstance(key, numbers.Integral) and not isinstance(key, bool):
+        key = f"{key:02d}"
+    elif not isinstance(key, str):
+        return default
+    return _BY_KEY.get(_normalize(key), default)
+
+
+def map_states(values: pd.Series, fields: typing.Iterable[str] = FIELDS) -> pd.DataFrame:
+    """
+    Resolves a whole column of state names, abbreviations or fips codes at once: the column is factorized, only its
+    distinct values are looked up, and every field is then taken from a small array by the integer codes.
+
+    :param values: a series of keys as understood by lookup
+    :param fields: the State fields to return, of name, abbreviation and fips
+    :return: a dataframe with one column per field, aligned with values, None where the key is unknown
+    """
+
+    codes, uniques = pd.factorize(values)
+    states: list = [lookup(unique) for unique in uniques]
+    # the trailing None is what the code -1 of a missing value takes
+    return pd.DataFrame({field: np.array([getattr(state, field, None) for state in states] + [None], dtype=object)[codes]
+                         for field in fields}, index=values.index)
+
+
+def map_series(values: pd.Series, field: str = "fips") -> pd.Series:
+    """
+    :param values: a series of keys as understood by lookup
+    :param field: the State field to return, name, abbreviation or fips
+    :return: the field of every value's state, None where the key is unknown
+    """
+
+    return map_states(values, (field,))[field]
 
 
 def generate_state_list() -> list:
@@ -87,20 +175,17 @@ def generate_state_list() -> list:
 
     :return: A list of all possible states as dictionaries
     """
-    states: list = [Alabama, Alaska, Arizona, Arkansas, California, Colorado, Connecticut, Delaware,
-                        DistrictOfColumbia, Florida, Georgia, Hawaii, Idaho, Illinois, Indiana, Iowa, Kansas,
-                        Kentucky, Louisiana, Maine, Maryland, Massachusetts, Michigan, Minnesota, Mississippi,
-                        Missouri, Montana, Nebraska, Nevada, NewHampshire, NewJersey, NewMexico, NewYork, NorthCarolina,
-                        NorthDakota, Ohio, Oklahoma, Oregon,Pennsylvania, PuertoRico, RhodeIsland, SouthCarolina,
-                        SouthDakota, Tennessee, Texas, Utah, Vermont, Virginia, Washington, WestVirgina, Wisconsin,
-                        Wyoming]
-
-    return [state.__dict__() for state in states]
+    return [state._asdict() for state in STATES]
 
 
 state_list: list = generate_state_list()
 
-state_df: pd.DataFrame = pd.DataFrame(state_list)
+
+def __getattr__(name: str):
+    # state_df is built on its first use, so that importing the states does not import pandas
+    if name == "state_df":
+        return get_states_df()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 def get_states_list() -> list:
@@ -111,9 +196,10 @@ def get_states_list() -> list:
     return state_list
 
 
+@functools.cache
 def get_states_df() -> pd.DataFrame:
     """
 
     :return: Returns the states in the continental us and outlying regions as a pandas dataframe
     """
-    return state_df
\ No newline at end of file
+    return pd.DataFrame(state_list)
\ No newline at end of file
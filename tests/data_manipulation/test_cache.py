@@ -0,0 +1,103 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+from data_manipulation.cache import ShapeCache
+
+
+class TestShapeCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache = ShapeCache(directory=self.tmp_dir.name)
+        self.url = "https://www2.census.gov/geo/tiger/TIGER2019/PLACE/tl_2019_01_place.zip"
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_raw_round_trip_and_counters(self):
+        self.assertIsNone(self.cache.get_raw(self.url))
+        self.cache.put_raw(self.url, b"Duck Duck Goose", etag='"abc"', last_modified="Tue, 01 Oct 2019 00:00:00 GMT")
+
+        self.assertEqual(b"Duck Duck Goose", self.cache.get_raw(self.url))
+        self.assertEqual({"raw": 1, "parsed": 0}, self.cache.hits)
+        self.assertEqual({"raw": 1, "parsed": 0}, self.cache.misses)
+        self.assertEqual({"If-None-Match": '"abc"', "If-Modified-Since": "Tue, 01 Oct 2019 00:00:00 GMT"},
+                         self.cache.conditional_headers(self.url))
+
+    def test_parsed_survives_restart_and_is_dropped_on_new_content(self):
+        self.cache.put_raw(self.url, b"Duck Duck Goose")
+        self.cache.put_parsed(self.url, {"type": "FeatureCollection", "features": []})
+
+        reopened = ShapeCache(directory=self.tmp_dir.name)
+        self.assertEqual({"type": "FeatureCollection", "features": []}, reopened.get_parsed(self.url))
+
+        reopened.put_raw(self.url, b"Goose Goose Duck")
+        self.assertIsNone(reopened.get_parsed(self.url))
+
+    def test_identical_content_is_stored_once(self):
+        other_url = self.url.replace("_01_", "_02_")
+        self.cache.put_raw(self.url, b"Duck Duck Goose")
+        self.cache.put_raw(other_url, b"Duck Duck Goose")
+
+        self.assertEqual(1, len(os.listdir(os.path.join(self.tmp_dir.name, "blobs"))))
+        self.cache.invalidate(self.url)
+        self.assertEqual(b"Duck Duck Goose", self.cache.get_raw(other_url))
+
+    def test_invalidate(self):
+        self.cache.put_raw(self.url, b"Duck Duck Goose")
+        self.cache.put_parsed(self.url, [1, 2, 3])
+        self.cache.invalidate(self.url)
+
+        self.assertIsNone(self.cache.get_raw(self.url))
+        self.assertIsNone(self.cache.get_parsed(self.url))
+        self.assertEqual({}, self.cache.conditional_headers(self.url))
+        self.assertEqual(0, self.cache.size())
+
+    def test_size_based_eviction_drops_least_recently_used(self):
+        cache = ShapeCache(directory=self.tmp_dir.name, max_bytes=25)
+        urls = [self.url.replace("_01_", f"_0{i}_") for i in range(1, 4)]
+        for i, url in enumerate(urls):
+            cache.put_raw(url, bytes([i]) * 10)
+
+        self.assertIsNone(cache.get_raw(urls[0]))
+        self.assertIsNotNone(cache.get_raw(urls[2]))
+        self.assertLessEqual(cache.size(), 25)
+
+    def test_eviction_counts_shared_blobs_once(self):
+        cache = ShapeCache(directory=self.tmp_dir.name, max_bytes=1000)
+        urls = [self.url.replace("_01_", f"_0{i}_") for i in range(1, 6)]
+        for url, content in zip(urls, [b"A" * 10, b"A" * 10, b"B" * 10, b"C" * 10]):
+            cache.put_raw(url, content)
+        cache.max_bytes = 25
+
+        with patch.object(cache, "size", wraps=cache.size) as size:
+            cache.put_raw(urls[4], b"D" * 10)
+
+        # evicting the first url frees nothing, its blob is still used by the second, so it takes three evictions
+        self.assertEqual([None, None, None], [cache.get_raw(url) for url in urls[:3]])
+        self.assertEqual(b"C" * 10, cache.get_raw(urls[3]))
+        self.assertEqual(20, cache.size())
+        self.assertEqual(2, len(os.listdir(os.path.join(self.tmp_dir.name, "blobs"))))
+        self.assertEqual(1, size.call_count)
+
+    def test_hits_are_written_to_the_index_once_per_flush(self):
+        self.cache.put_raw(self.url, b"Duck Duck Goose")
+        self.cache.put_parsed(self.url, [1, 2, 3])
+
+        with patch.object(self.cache, "_save_index", wraps=self.cache._save_index) as save_index:
+            for _ in range(3):
+                self.cache.get_raw(self.url)
+                self.cache.get_parsed(self.url)
+            self.assertEqual(0, save_index.call_count)
+            self.cache.flush()
+            self.cache.close()
+            self.assertEqual(1, save_index.call_count)
+
+        with open(os.path.join(self.tmp_dir.name, "index.json")) as f:
+            self.assertEqual(self.cache._index, json.load(f))
+
+
+if __name__ == '__main__':
+    unittest.main()
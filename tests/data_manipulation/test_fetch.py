@@ -2,12 +2,38 @@ import io
 import json
 import os
 import pandas as pd
+import requests
+import shapefile
+import tempfile
 import unittest
+import zipfile
 from unittest.mock import patch
-from bs4 import BeautifulSoup
 from data_manipulation.fetch import process_wikipedia_table
 from unittest.mock import patch, MagicMock
-from data_manipulation.fetch import process_wikipedia_table, retrieve_sp_500, retrieve_us_city_shape_files, retrieve_ticker_data
+from data_manipulation.cache import ShapeCache
+from data_manipulation.geostore import place_store_covers, place_vintages
+from data_manipulation.fetch import iter_us_city_shape_files, process_wikipedia_table, retrieve_place_vintage, retrieve_sp_500, retrieve_us_city_shape_files, retrieve_ticker_data, retrieve_us_city_geodataframe, tiger_place_url
+
+
+def build_place_zip(fip, places, vintage=2019):
+    """
+    Builds an in-memory census style PLACE zip with one square polygon per (name, x, y) place.
+    """
+    shp, shx, dbf = io.BytesIO(), io.BytesIO(), io.BytesIO()
+    writer = shapefile.Writer(shp=shp, shx=shx, dbf=dbf, shapeType=shapefile.POLYGON)
+    writer.field('STATEFP', 'C', size=2)
+    writer.field('GEOID', 'C', size=7)
+    writer.field('NAME', 'C', size=100)
+    for i, (name, x, y) in enumerate(places):
+        writer.poly([[[x, y], [x, y + 1], [x + 1, y + 1], [x + 1, y], [x, y]]])
+        writer.record(fip, f"{fip}{i:05d}", name)
+    writer.close()
+    archive = io.BytesIO()
+    with zipfile.ZipFile(archive, 'w', compression=zipfile.ZIP_DEFLATED) as z:
+        for extension, member in [('shp', shp), ('shx', shx), ('dbf', dbf)]:
+            z.writestr(f"tl_{vintage}_{fip}_place.{extension}", member.getvalue())
+    return archive.getvalue()
+
 
 class TestFetch(unittest.TestCase):
 
@@ -66,6 +92,21 @@ class TestFetch(unittest.TestCase):
 
         self.assertEqual(result, expected_result)
 
+    @patch('requests.get')
+    def test_process_wikipedia_table_isolates_target_table(self, mock_get):
+        mock_get.return_value.text = """
+        <table class="infobox"><tr><td>Not this one</td></tr></table>
+        <TABLE class='wikitable sortable' id="constituents">
+            <tr><th>Symbol</th><th>Notes</th></tr>
+            <tr><td><a href="/wiki/MMM">MMM</a></td><td><table><tr><td>nested</td></tr></table></td></tr>
+        </TABLE>
+        <table class="wikitable sortable"><tr><td>Second table</td></tr></table>
+        """
+
+        result = process_wikipedia_table("https://en.wikipedia.org/wiki/Some_table")
+
+        self.assertEqual([['Symbol', 'Notes'], ['MMM', 'nested']], result)
+
     @patch('data_manipulation.fetch.process_wikipedia_table')
     def test_retrieve_sp_500(self, mock_process_wikipedia_table):
         # Mock the table data
@@ -108,7 +149,8 @@ class TestFetch(unittest.TestCase):
 
         # Mock the ZipFile object
         mock_zip = MagicMock()
-        mock_zipfile.return_value = mock_zip
+        mock_zip.read.side_effect = lambda name: name.encode()
+        mock_zipfile.return_value.__enter__.return_value = mock_zip
 
         # Mock the shapefile.Reader object
         mock_shape = MagicMock()
@@ -118,28 +160,28 @@ class TestFetch(unittest.TestCase):
         # Call the function
         result = retrieve_us_city_shape_files()
 
-        # Check if the directory was created
-        mock_mkdir.assert_called_with(f"{os.getcwd()}/tmp")
+        # Check that nothing was extracted to a temporary directory
+        mock_mkdir.assert_not_called()
 
         # Check if requests.get was called with the correct URLs
         expected_urls = [
             'https://www2.census.gov/geo/tiger/TIGER2019/PLACE/tl_2019_01_place.zip',
             'https://www2.census.gov/geo/tiger/TIGER2019/PLACE/tl_2019_02_place.zip'
         ]
-        actual_urls = [call[0][0] for call in mock_requests_get.call_args_list]
+        # the states are downloaded concurrently, so the call order is not deterministic
+        actual_urls = sorted(call[0][0] for call in mock_requests_get.call_args_list)
         self.assertEqual(expected_urls, actual_urls)
 
-        # Check if the ZipFile was initialized with the correct content
-        # Not sure why this is not working... TODO: Fix this
-        # mock_zipfile.assert_called_with(io.BytesIO(b'Duck Duck Goose'))
+        # Check if the ZipFile was opened over the downloaded content
+        self.assertEqual([b'Duck Duck Goose', b'Duck Duck Goose'], [call[0][0].getvalue() for call in mock_zipfile.call_args_list])
 
-        # Check if the shapefile.Reader was initialized with the correct path
-        expected_paths = [
-            f"/Users/robertresch/Developer/GeoSpatialVisualization/tmp/tl_2019_01_place.shp",
-            f"/Users/robertresch/Developer/GeoSpatialVisualization/tmp/tl_2019_02_place.shp"
+        # Check if the shapefile.Reader was handed the zip members in memory
+        expected_members = [
+            {'shp': b'tl_2019_01_place.shp', 'shx': b'tl_2019_01_place.shx', 'dbf': b'tl_2019_01_place.dbf'},
+            {'shp': b'tl_2019_02_place.shp', 'shx': b'tl_2019_02_place.shx', 'dbf': b'tl_2019_02_place.dbf'}
         ]
-        actual_paths = [call[0][0] for call in mock_shapefile_reader.call_args_list]
-        self.assertEqual(expected_paths, actual_paths)
+        actual_members = sorted(({key: value.getvalue() for key, value in call.kwargs.items()} for call in mock_shapefile_reader.call_args_list), key=lambda members: members['shp'])
+        self.assertEqual(expected_members, actual_members)
 
         # Check the final result
         expected_result = json.dumps({
@@ -165,23 +207,297 @@ class TestFetch(unittest.TestCase):
         mock_requests_get.side_effect = Exception("Network error")
 
         # Call the function
-        result = retrieve_us_city_shape_files()
+        report = []
+        result = retrieve_us_city_shape_files(report=report)
 
-        # Check if the directory was created
-        mock_mkdir.assert_called_with(f"{os.getcwd()}/tmp")
+        # Check that nothing was extracted to a temporary directory
+        mock_mkdir.assert_not_called()
 
         # Check the final result
         expected_result = json.dumps({})
         self.assertEqual(result, expected_result)
 
+        # Check that every failure was reported instead of swallowed
+        self.assertEqual(['01', '02'], sorted(record['fips'] for record in report))
+        self.assertTrue(all(record['status'] == 'failed' for record in report))
+        self.assertTrue(all('Network error' in record['error'] for record in report))
+
+    @patch('data_manipulation.fetch.time.sleep')
+    @patch('data_manipulation.fetch.process_wikipedia_table')
+    @patch('data_manipulation.fetch.requests.get')
+    @patch('data_manipulation.fetch.zipfile.ZipFile')
+    @patch('data_manipulation.fetch.shapefile.Reader')
+    def test_retrieve_us_city_shape_files_retries(self, mock_shapefile_reader, mock_zipfile, mock_requests_get, mock_process_wikipedia_table, mock_sleep):
+        mock_process_wikipedia_table.return_value = [
+            ['State', 'Numeric code'],
+            ['Alabama', '01']
+        ]
+
+        # The first attempt times out, the second one succeeds
+        mock_response = MagicMock()
+        mock_response.content = b'Duck Duck Goose'
+        mock_requests_get.side_effect = [requests.Timeout("timed out"), mock_response]
+
+        mock_zipfile.return_value.__enter__.return_value.read.return_value = b''
+        mock_shape = MagicMock()
+        mock_shape.__geo_interface__ = {'type': 'FeatureCollection', 'features': []}
+        mock_shapefile_reader.return_value = mock_shape
+
+        report = []
+        result = retrieve_us_city_shape_files(timeout=5, retries=3, backoff=0.5, report=report)
+
+        self.assertEqual(json.dumps({'01': {'type': 'FeatureCollection', 'features': []}}), result)
+        self.assertEqual(2, mock_requests_get.call_count)
+        self.assertEqual(5, mock_requests_get.call_args.kwargs['timeout'])
+        mock_sleep.assert_called_once_with(0.5)
+        self.assertEqual('ok', report[0]['status'])
+        self.assertEqual(2, report[0]['attempts'])
+
+    @patch('data_manipulation.fetch.time.sleep')
+    @patch('data_manipulation.fetch.process_wikipedia_table')
+    @patch('data_manipulation.fetch.requests.get')
+    def test_retrieve_us_city_shape_files_fails_fast_on_client_errors(self, mock_requests_get, mock_process_wikipedia_table, mock_sleep):
+        mock_process_wikipedia_table.return_value = [['State', 'Numeric code'], ['Alabama', '01'], ['Alaska', '02']]
+
+        def respond(status_code):
+            response = requests.Response()
+            response.status_code, response.url = status_code, 'https://www2.census.gov/'
+            return response
+
+        # Alabama's zip is missing, Alaska is rate limited on every attempt
+        mock_requests_get.side_effect = lambda url, **kwargs: respond(404 if '_01_' in url else 429)
+
+        report = []
+        result = retrieve_us_city_shape_files(max_workers=1, retries=3, backoff=0.5, report=report)
+
+        self.assertEqual('{}', result)
+        self.assertEqual([('failed', 1), ('failed', 3)], [(record['status'], record['attempts']) for record in report])
+        self.assertEqual(4, mock_requests_get.call_count)
+        self.assertEqual(2, mock_sleep.call_count)
+
+    @patch('data_manipulation.fetch.time.sleep')
+    @patch('data_manipulation.fetch.process_wikipedia_table')
+    @patch('data_manipulation.fetch.requests.get')
+    def test_retrieve_us_city_shape_files_reports_the_attempts_of_a_bad_payload(self, mock_requests_get, mock_process_wikipedia_table, mock_sleep):
+        mock_process_wikipedia_table.return_value = [['State', 'Numeric code'], ['Alabama', '01']]
+        # the second attempt downloads the zip, which turns out not to be one
+        mock_requests_get.side_effect = [requests.Timeout("timed out"), MagicMock(content=b'Duck Duck Goose')]
+
+        report = []
+        retrieve_us_city_shape_files(retries=3, backoff=0.5, report=report)
+
+        self.assertEqual(('failed', 2), (report[0]['status'], report[0]['attempts']))
+        self.assertTrue(report[0]['error'].startswith('BadZipFile'))
+
+
+    @patch('data_manipulation.fetch.process_wikipedia_table')
+    @patch('data_manipulation.fetch.requests.get')
+    @patch('data_manipulation.fetch.zipfile.ZipFile')
+    @patch('data_manipulation.fetch.shapefile.Reader')
+    def test_retrieve_us_city_shape_files_warm_cache(self, mock_shapefile_reader, mock_zipfile, mock_requests_get, mock_process_wikipedia_table):
+        mock_process_wikipedia_table.return_value = [
+            ['State', 'Numeric code'],
+            ['Alabama', '01']
+        ]
+        mock_response = MagicMock()
+        mock_response.content = b'Duck Duck Goose'
+        mock_response.status_code = 200
+        mock_response.headers = {'ETag': '"abc"'}
+        mock_requests_get.return_value = mock_response
+        mock_zipfile.return_value.__enter__.return_value.read.return_value = b''
+        mock_shape = MagicMock()
+        mock_shape.__geo_interface__ = {'type': 'FeatureCollection', 'features': []}
+        mock_shapefile_reader.return_value = mock_shape
+
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cold = retrieve_us_city_shape_files(cache=ShapeCache(directory=cache_dir))
+
+            # A warm run must neither scrape, download nor parse
+            mock_process_wikipedia_table.reset_mock()
+            mock_requests_get.reset_mock()
+            mock_shapefile_reader.reset_mock()
+            report = []
+            warm_cache = ShapeCache(directory=cache_dir)
+            warm = retrieve_us_city_shape_files(cache=warm_cache, report=report)
+
+        self.assertEqual(cold, warm)
+        mock_process_wikipedia_table.assert_not_called()
+        mock_requests_get.assert_not_called()
+        mock_shapefile_reader.assert_not_called()
+        self.assertEqual('parsed', report[0]['cache'])
+        self.assertEqual(2, warm_cache.hits['parsed'])
+
+    @patch('data_manipulation.fetch.process_wikipedia_table')
+    @patch('data_manipulation.fetch.requests.get')
+    def test_retrieve_us_city_shape_files_reads_zip_in_memory(self, mock_requests_get, mock_process_wikipedia_table):
+        mock_process_wikipedia_table.return_value = [
+            ['State', 'Numeric code'],
+            ['Colorado', '08']
+        ]
+        mock_response = MagicMock()
+        mock_response.content = build_place_zip('08', [('Denver', -105.0, 39.7), ('Boulder', -105.3, 40.0)])
+        mock_requests_get.return_value = mock_response
+
+        result = json.loads(retrieve_us_city_shape_files())
 
-    @patch('data_manipulation.fetch.yf.download')
+        # a zip that is cached but not yet parsed is memory-mapped from the cache instead of downloaded
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = ShapeCache(directory=cache_dir)
+            cache.put_raw(tiger_place_url('08', 2019), mock_response.content)
+            remapped = json.loads(retrieve_us_city_shape_files(cache=cache))
+
+        self.assertEqual(['Denver', 'Boulder'], [feature['properties']['NAME'] for feature in result['08']['features']])
+        self.assertEqual('Polygon', result['08']['features'][0]['geometry']['type'])
+        self.assertEqual(result, remapped)
+        self.assertEqual(1, mock_requests_get.call_count)
+        self.assertFalse(os.path.exists(f"{os.getcwd()}/tmp/tl_2019_08_place.shp"))
+
+    @patch('data_manipulation.fetch.process_wikipedia_table')
+    @patch('data_manipulation.fetch.requests.get')
+    def test_retrieve_us_city_shape_files_places_pushdown(self, mock_requests_get, mock_process_wikipedia_table):
+        mock_process_wikipedia_table.return_value = [
+            ['State', 'Numeric code'],
+            ['Alabama', '01'],
+            ['Colorado', '08']
+        ]
+        mock_response = MagicMock()
+        mock_response.content = build_place_zip('08', [('Denver', -105.0, 39.7), ('Boulder', -105.3, 40.0), ('Aurora', -104.8, 39.7)])
+        mock_requests_get.return_value = mock_response
+
+        with patch('data_manipulation.fetch.shapefile.Reader.shape', autospec=True, side_effect=shapefile.Reader.shape) as mock_shape:
+            result = json.loads(retrieve_us_city_shape_files(places={('08', 'Denver'), ('08', 'Aurora'), ('08', 'Atlantis')}))
+
+        # Alabama has no place of interest, so it is never downloaded
+        self.assertEqual(['https://www2.census.gov/geo/tiger/TIGER2019/PLACE/tl_2019_08_place.zip'], [call[0][0] for call in mock_requests_get.call_args_list])
+        self.assertEqual(['08'], list(result))
+        self.assertEqual(['Denver', 'Aurora'], [feature['properties']['NAME'] for feature in result['08']['features']])
+        # Boulder's polygon is never decoded
+        self.assertEqual([0, 2], [call[0][1] for call in mock_shape.call_args_list])
+
+    @patch('data_manipulation.fetch.process_wikipedia_table')
+    @patch('data_manipulation.fetch.requests.get')
+    def test_retrieve_us_city_shape_files_builtin_states(self, mock_requests_get, mock_process_wikipedia_table):
+        mock_response = MagicMock()
+        mock_response.content = build_place_zip('08', [('Denver', -105.0, 39.7)])
+        mock_requests_get.return_value = mock_response
+
+        result = retrieve_us_city_shape_files(places={('08', 'Denver')}, use_builtin_states=True, serialize=False)
+
+        # the fips codes come from states.states, wikipedia is never asked
+        mock_process_wikipedia_table.assert_not_called()
+        self.assertEqual(['08'], list(result))
+        self.assertEqual(1, mock_requests_get.call_count)
+
+    @patch('data_manipulation.fetch.requests.get')
+    def test_iter_us_city_shape_files_streams_one_state_at_a_time(self, mock_requests_get):
+        zips = {fip: build_place_zip(fip, [(name, -100.0, 40.0)]) for fip, name in [('06', 'Cupertino'), ('08', 'Denver'), ('53', 'Redmond')]}
+        mock_requests_get.side_effect = lambda url, **kwargs: MagicMock(content=zips[url[-12:-10]])
+
+        states = iter_us_city_shape_files(places={('08', 'Denver'), ('06', 'Cupertino'), ('53', 'Redmond')}, use_builtin_states=True)
+        first_fip, first_places = next(states)
+
+        # nothing past the state being consumed has been downloaded yet
+        self.assertEqual(('06', ['Cupertino']), (first_fip, [f['properties']['NAME'] for f in first_places['features']]))
+        self.assertEqual(1, mock_requests_get.call_count)
+        self.assertEqual(['08', '53'], [fip for fip, _ in states])
+        self.assertEqual(3, mock_requests_get.call_count)
+
+    @patch('data_manipulation.fetch.process_wikipedia_table')
+    @patch('data_manipulation.fetch.requests.get')
+    def test_retrieve_us_city_geodataframe(self, mock_requests_get, mock_process_wikipedia_table):
+        mock_process_wikipedia_table.return_value = [
+            ['State', 'Numeric code'],
+            ['Colorado', '08']
+        ]
+        mock_response = MagicMock()
+        mock_response.content = build_place_zip('08', [('Denver', -105.0, 39.7), ('Boulder', -105.3, 40.0)])
+        mock_requests_get.return_value = mock_response
+
+        with tempfile.TemporaryDirectory() as store_dir:
+            store_path = os.path.join(store_dir, 'places.parquet')
+            built = retrieve_us_city_geodataframe(store_path, places={('08', 'Denver')})
+            # the store covers Denver now, so reading it again does not touch the network
+            mock_requests_get.reset_mock()
+            stored = retrieve_us_city_geodataframe(store_path, places={('08', 'Denver')})
+
+        self.assertEqual(['Denver'], built['NAME'].tolist())
+        self.assertEqual('0800000', stored['GEOID'].iloc[0])
+        self.assertTrue(built.geometry.equals(stored.geometry))
+        mock_requests_get.assert_not_called()
+
+    @patch('data_manipulation.fetch.time.sleep')
+    @patch('data_manipulation.fetch.process_wikipedia_table')
+    @patch('data_manipulation.fetch.requests.get')
+    def test_retrieve_us_city_geodataframe_does_not_cover_failed_states(self, mock_requests_get, mock_process_wikipedia_table, mock_sleep):
+        mock_process_wikipedia_table.return_value = [['State', 'Numeric code'], ['Colorado', '08'], ['Washington', '53']]
+        missing = requests.Response()
+        missing.status_code, missing.url = 404, tiger_place_url('53')
+        zips = {tiger_place_url('08'): MagicMock(content=build_place_zip('08', [('Denver', -105.0, 39.7)]))}
+        mock_requests_get.side_effect = lambda url, **kwargs: zips.get(url, missing)
+        places = {('08', 'Denver'), ('53', 'Seattle')}
+
+        with tempfile.TemporaryDirectory() as store_dir:
+            store_path = os.path.join(store_dir, 'places.parquet')
+            built = retrieve_us_city_geodataframe(store_path, places=places)
+            covers_denver = place_store_covers(store_path, {('08', 'Denver')})
+            covers_both = place_store_covers(store_path, places)
+            # once Washington is back, the next run retrieves it instead of trusting the store
+            zips[tiger_place_url('53')] = MagicMock(content=build_place_zip('53', [('Seattle', -122.3, 47.6)]))
+            rebuilt = retrieve_us_city_geodataframe(store_path, places=places)
+
+        self.assertEqual(['Denver'], built['NAME'].tolist())
+        self.assertTrue(covers_denver)
+        self.assertFalse(covers_both)
+        self.assertEqual(['Denver', 'Seattle'], rebuilt['NAME'].tolist())
+
+    @patch('data_manipulation.fetch.requests.get')
+    def test_retrieve_place_vintage(self, mock_requests_get):
+        zips = {tiger_place_url('08', 2019): build_place_zip('08', [('Denver', -105.0, 39.7), ('Boulder', -105.3, 40.0)], 2019),
+                tiger_place_url('08', 2020): build_place_zip('08', [('Denver', -105.0, 39.7), ('Boulder', -105.2, 40.0)], 2020)}
+        mock_requests_get.side_effect = lambda url, **kwargs: MagicMock(content=zips[url])
+
+        with tempfile.TemporaryDirectory() as store_dir:
+            with patch('data_manipulation.fetch.states.get_states_df', return_value=pd.DataFrame({'fips': ['08']})):
+                retrieve_place_vintage(store_dir, 2019, use_builtin_states=True)
+                places = retrieve_place_vintage(store_dir, 2020, places={('08', 'Boulder')}, use_builtin_states=True)
+                # a stored vintage is read without touching the network
+                mock_requests_get.reset_mock()
+                retrieve_place_vintage(store_dir, 2020, use_builtin_states=True)
+            stored = sorted(os.listdir(os.path.join(store_dir, 'geometries')))
+
+        self.assertEqual('https://www2.census.gov/geo/tiger/TIGER2020/PLACE/tl_2020_08_place.zip', tiger_place_url('08', 2020))
+        self.assertEqual(tiger_place_url('08', 2019), tiger_place_url('08'))
+        self.assertEqual(['Boulder'], places['NAME'].tolist())
+        self.assertEqual((-105.2, 40.0, -104.2, 41.0), places.geometry.iloc[0].bounds)
+        mock_requests_get.assert_not_called()
+        # only Boulder moved, so 2020 added a single polygon next to the two of 2019
+        self.assertEqual(['2019-00000.parquet', '2020-00001.parquet'], stored)
+
+    @patch('data_manipulation.fetch.requests.get')
+    def test_retrieve_place_vintage_is_not_stored_partially(self, mock_requests_get):
+        missing = requests.Response()
+        missing.status_code, missing.url = 404, tiger_place_url('53', 2020)
+        zips = {tiger_place_url('08', 2020): MagicMock(content=build_place_zip('08', [('Denver', -105.0, 39.7)], 2020))}
+        mock_requests_get.side_effect = lambda url, **kwargs: zips.get(url, missing)
+
+        with tempfile.TemporaryDirectory() as store_dir:
+            with patch('data_manipulation.fetch.states.get_states_df', return_value=pd.DataFrame({'fips': ['08', '53']})):
+                with self.assertRaises(RuntimeError):
+                    retrieve_place_vintage(store_dir, 2020, use_builtin_states=True)
+                self.assertEqual([], place_vintages(store_dir))
+
+                zips[tiger_place_url('53', 2020)] = MagicMock(content=build_place_zip('53', [('Seattle', -122.3, 47.6)], 2020))
+                places = retrieve_place_vintage(store_dir, 2020, use_builtin_states=True)
+
+        self.assertEqual(['Denver', 'Seattle'], places['NAME'].tolist())
+
+    @patch('data_manipulation.providers.yf.download')
     def test_retrieve_ticker_data(self, mock_yf_download):
         # Mock the yfinance download function
         mock_data = pd.DataFrame({
-            'AAPL': {'Open': 150.0, 'High': 155.0, 'Low': 149.0, 'Close': 154.0, 'Volume': 1000000},
-            'MSFT': {'Open': 250.0, 'High': 255.0, 'Low': 249.0, 'Close': 254.0, 'Volume': 2000000}
-        })
+            ('Open', 'AAPL'): [150.0], ('Close', 'AAPL'): [154.0], ('Volume', 'AAPL'): [1000000],
+            ('Open', 'MSFT'): [250.0], ('Close', 'MSFT'): [254.0], ('Volume', 'MSFT'): [2000000]
+        }, index=[pd.Timestamp('2023-01-01')])
         mock_yf_download.return_value = mock_data
 
         # Create a mock dataframe for S&P 500 data
@@ -192,18 +508,48 @@ class TestFetch(unittest.TestCase):
         # Call the function
         result = retrieve_ticker_data(sp_data)
 
-        # Expected result
-        expected_result = mock_data.to_dict()
+        # Check the result stays the downloaded frame, requested as one batch without yfinance's own threads
+        pd.testing.assert_frame_equal(result, mock_data)
+        mock_yf_download.assert_called_once()
+        self.assertEqual(['AAPL', 'MSFT'], mock_yf_download.call_args.args[0])
+        self.assertEqual(('1d', '1d', False), (mock_yf_download.call_args.kwargs['period'], mock_yf_download.call_args.kwargs['interval'],
+                                               mock_yf_download.call_args.kwargs['threads']))
 
-        # Check the result
-        self.assertEqual(result, expected_result)
+    @patch('data_manipulation.providers.yf.download')
+    def test_retrieve_ticker_data_in_chunks(self, mock_yf_download):
+        index = pd.date_range('2023-01-03 09:30', periods=3, freq='5min')
 
-    @patch('data_manipulation.fetch.yf.download')
-    def test_retrieve_ticker_data_empty(self, mock_yf_download):
-        # Mock the yfinance download function to return an empty dataframe
-        mock_data = pd.DataFrame()
-        mock_yf_download.return_value = mock_data
+        def download(symbols, **kwargs):
+            columns = pd.MultiIndex.from_product([['Open', 'Close', 'Volume'], symbols])
+            return pd.DataFrame(1.0, index=index, columns=columns)
+
+        mock_yf_download.side_effect = download
+        sp_data = pd.DataFrame({'Symbol': ['AAPL', 'MSFT', 'NVDA', 'AAPL', 'GOOG', 'AMZN']})
+
+        report = []
+        result = retrieve_ticker_data(sp_data, period='5d', interval='5m', chunk_size=2, max_workers=2, report=report)
+
+        self.assertEqual(3, mock_yf_download.call_count)
+        self.assertEqual((3, 15), result.shape)
+        self.assertEqual(['AAPL', 'MSFT', 'NVDA', 'GOOG', 'AMZN'], result.columns.get_level_values(1).unique().tolist())
+        self.assertEqual([['AAPL', 'MSFT'], ['NVDA', 'GOOG'], ['AMZN']], [record['symbols'] for record in report])
+        self.assertEqual({'5m'}, {call.kwargs['interval'] for call in mock_yf_download.call_args_list})
+
+    @patch('data_manipulation.fetch.time.sleep')
+    @patch('data_manipulation.providers.yf.download')
+    def test_retrieve_ticker_data_retries_a_batch(self, mock_yf_download, mock_sleep):
+        mock_data = pd.DataFrame({('Open', 'AAPL'): [150.0]}, index=[pd.Timestamp('2023-01-01')])
+        mock_yf_download.side_effect = [requests.ConnectionError("connection reset"), mock_data]
+
+        report = []
+        result = retrieve_ticker_data(pd.DataFrame({'Symbol': ['AAPL']}), retries=3, backoff=0.5, report=report)
+
+        pd.testing.assert_frame_equal(result, mock_data)
+        self.assertEqual(2, report[0]['attempts'])
+        mock_sleep.assert_called_once_with(0.5)
 
+    @patch('data_manipulation.providers.yf.download')
+    def test_retrieve_ticker_data_empty(self, mock_yf_download):
         # Create a mock dataframe for S&P 500 data
         sp_data = pd.DataFrame({
             'Symbol': []
@@ -212,15 +558,14 @@ class TestFetch(unittest.TestCase):
         # Call the function
         result = retrieve_ticker_data(sp_data)
 
-        # Expected result
-        expected_result = mock_data.to_dict()
-
         # Check the result
-        self.assertEqual(result, expected_result)
+        self.assertTrue(result.empty)
+        mock_yf_download.assert_not_called()
 
-    @patch('data_manipulation.fetch.yf.download')
-    def test_retrieve_ticker_data_exception_handling(self, mock_yf_download):
-        # Mock the yfinance download function to raise an exception
+    @patch('data_manipulation.fetch.time.sleep')
+    @patch('data_manipulation.providers.yf.download')
+    def test_retrieve_ticker_data_exception_handling(self, mock_yf_download, mock_sleep):
+        # Mock the yfinance download function to raise an error that asking again will not fix
         mock_yf_download.side_effect = Exception("API error")
 
         # Create a mock dataframe for S&P 500 data
@@ -233,6 +578,25 @@ class TestFetch(unittest.TestCase):
             retrieve_ticker_data(sp_data)
 
         self.assertTrue("API error" in str(context.exception))
+        self.assertEqual(1, mock_yf_download.call_count)
+        mock_sleep.assert_not_called()
+
+    @patch('data_manipulation.fetch.time.sleep')
+    @patch('data_manipulation.providers.yf.download')
+    def test_retrieve_ticker_data_retries_only_transient_http_errors(self, mock_yf_download, mock_sleep):
+        def http_error(status_code):
+            response = requests.Response()
+            response.status_code = status_code
+            return requests.HTTPError(f"{status_code}", response=response)
+
+        mock_yf_download.side_effect = [http_error(503), http_error(429), http_error(404)]
+
+        with self.assertRaises(requests.HTTPError) as context:
+            retrieve_ticker_data(pd.DataFrame({'Symbol': ['AAPL']}), retries=5, backoff=0.5)
+
+        self.assertEqual(3, context.exception.attempts)
+        self.assertEqual(3, mock_yf_download.call_count)
+        self.assertEqual(2, mock_sleep.call_count)
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,86 @@
+import json
+import os
+import tempfile
+import unittest
+import pandas as pd
+from data_manipulation.geocode import gazetteer_from_places, load_gazetteer, locate_headquarters
+from data_manipulation.geostore import places_to_geodataframe
+from data_manipulation.transform import join_ticker_data_to_geodata, prepare_sp_companies
+
+
+def square(x: float, y: float, size: float = 0.1) -> dict:
+    return {"type": "Polygon", "coordinates": [[[x, y], [x + size, y], [x + size, y + size], [x, y + size], [x, y]]]}
+
+
+class TestGeocode(unittest.TestCase):
+
+    def setUp(self):
+        self.sp_companies = pd.DataFrame({
+            'Symbol': ['AAPL', 'MSFT', 'XYZ'],
+            'Security': ['Apple Inc.', 'Microsoft Corp.', 'Nowhere Inc.'],
+            'GICS Sector': ['Information Technology'] * 3,
+            'GICS Sub-Industry': ['Technology Hardware, Storage & Peripherals', 'Systems Software', 'Systems Software'],
+            'Headquarters Location': ['Monta Vista, California', 'Redmond, Washington', 'Nowhere, Washington'],
+            'Date Added': ['1982-11-30', '1991-03-31', '2000-01-01'],
+            'CIK': ['0000320193', '0000789019', '0000000001'],
+            'Founded': ['1977', '1975', '2000']
+        })
+        self.places = places_to_geodataframe({
+            "06": {"type": "FeatureCollection", "features": [
+                {"type": "Feature", "properties": {"NAME": "Cupertino"}, "geometry": square(-122.1, 37.3)}]},
+            "53": {"type": "FeatureCollection", "features": [
+                {"type": "Feature", "properties": {"NAME": "Redmond"}, "geometry": square(-122.2, 47.6)}]},
+        })
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.gazetteer_path = os.path.join(self.tmp_dir.name, "gazetteer.txt")
+        with open(self.gazetteer_path, "w") as f:
+            f.write("USPS\tGEOID\tNAME\tINTPTLAT\tINTPTLONG                                                \n")
+            f.write("CA\t0649270\tMonta Vista CDP\t37.35\t-122.05\n")
+            f.write("WA\t5357535\tRedmond city\t47.65\t-122.15\n")
+            f.write("WA\t5399999\tNowhere town\t46.0\t-120.0\n")
+            f.write("ZZ\t9999999\tSomewhere city\t18.4\t-66.1\n")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_load_gazetteer_strips_area_descriptions(self):
+        gazetteer = load_gazetteer(self.gazetteer_path)
+
+        self.assertEqual(["Monta Vista", "Redmond", "Nowhere"], gazetteer["City Name"].tolist())
+        self.assertEqual(["06", "53", "53"], gazetteer["fips"].tolist())
+        self.assertAlmostEqual(-122.05, gazetteer["longitude"][0])
+
+    def test_gazetteer_from_places_uses_internal_points(self):
+        places = self.places.assign(INTPTLAT=["+37.3500000", "+47.6500000"], INTPTLON=["-122.0500000", "-122.1500000"])
+
+        gazetteer = gazetteer_from_places(places)
+
+        self.assertEqual([37.35, 47.65], gazetteer["latitude"].tolist())
+        self.assertTrue(gazetteer_from_places(self.places)["longitude"].between(-122.2, -122.0).all())
+
+    def test_locate_headquarters_by_containing_polygon(self):
+        prepped = prepare_sp_companies(self.sp_companies)
+
+        located = locate_headquarters(prepped, self.places, load_gazetteer(self.gazetteer_path))
+
+        # the CDP falls inside Cupertino, a point outside of every polygon keeps its name
+        self.assertEqual(["Cupertino", "Redmond", "Nowhere"], located["City Name"].tolist())
+        self.assertEqual(["Monta Vista", "Redmond", "Nowhere"], prepped["City Name"].tolist())
+
+    def test_join_ticker_data_to_geodata_spatial(self):
+        ticker_data = pd.DataFrame({
+            ('Open', 'AAPL'): [150.0], ('Adj Close', 'AAPL'): [155.0], ('Volume', 'AAPL'): [1000000],
+            ('Open', 'MSFT'): [250.0], ('Adj Close', 'MSFT'): [255.0], ('Volume', 'MSFT'): [2000000],
+        }, index=[pd.Timestamp('2023-01-01')])
+
+        map_geometry, map_data = join_ticker_data_to_geodata(self.sp_companies, ticker_data, self.places,
+                                                             geocoding="spatial", gazetteer=load_gazetteer(self.gazetteer_path))
+
+        self.assertEqual(2, len(json.loads(map_geometry)["features"]))
+        self.assertEqual(["Cupertino", "Redmond"], sorted(map_data["City Name"]))
+        with self.assertRaises(ValueError):
+            join_ticker_data_to_geodata(self.sp_companies, ticker_data, self.places, geocoding="fuzzy")
+
+
+if __name__ == '__main__':
+    unittest.main()
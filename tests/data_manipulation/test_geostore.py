@@ -0,0 +1,101 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+
+import pyarrow.parquet as pq
+from data_manipulation.geostore import (diff_place_vintages, place_store_covers, place_vintages, places_to_geodataframe, read_place_store,
+                                        read_place_vintage, write_place_store, write_place_vintage)
+
+
+def square(x, y):
+    return {"type": "Polygon", "coordinates": [[[x, y], [x, y + 1], [x + 1, y + 1], [x + 1, y], [x, y]]]}
+
+
+class TestGeoStore(unittest.TestCase):
+
+    def setUp(self):
+        self.geo_data = {
+            "08": {"type": "FeatureCollection", "features": [
+                {"type": "Feature", "properties": {"NAME": "Denver", "GEOID": "0820000"}, "geometry": square(-105.0, 39.7)},
+                {"type": "Feature", "properties": {"NAME": "Boulder", "GEOID": "0807850"}, "geometry": square(-105.3, 40.0)}
+            ]},
+            "53": {"type": "FeatureCollection", "features": [
+                {"type": "Feature", "properties": {"NAME": "Redmond", "GEOID": "5357535"}, "geometry": square(-122.1, 47.6)}
+            ]}
+        }
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp_dir.name, "places.parquet")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_places_to_geodataframe(self):
+        places = places_to_geodataframe(json.dumps(self.geo_data))
+
+        self.assertEqual(["08", "08", "53"], places["STATEFP"].tolist())
+        self.assertEqual(["Denver", "Boulder", "Redmond"], places["NAME"].tolist())
+        self.assertEqual("EPSG:4269", places.crs.to_string())
+
+    def test_round_trip_reads_only_requested_places(self):
+        write_place_store(places_to_geodataframe(self.geo_data), self.path)
+
+        everything = read_place_store(self.path)
+        self.assertEqual(["Boulder", "Denver", "Redmond"], everything["NAME"].tolist())
+
+        subset = read_place_store(self.path, places={("08", "Denver"), ("53", "Redmond"), ("53", "Denver")}, columns=[])
+        self.assertEqual([("08", "Denver"), ("53", "Redmond")], list(zip(subset["STATEFP"], subset["NAME"])))
+        self.assertEqual(["STATEFP", "NAME", "geometry"], subset.columns.tolist())
+        self.assertEqual((-105.0, 39.7, -104.0, 40.7), subset.geometry.iloc[0].bounds)
+
+    def test_place_store_covers(self):
+        self.assertFalse(place_store_covers(self.path))
+
+        write_place_store(places_to_geodataframe(self.geo_data), self.path, coverage={("08", "Denver"), ("53", "Redmond")})
+        self.assertTrue(place_store_covers(self.path, {("08", "Denver")}))
+        self.assertFalse(place_store_covers(self.path, {("08", "Aurora")}))
+        self.assertFalse(place_store_covers(self.path))
+
+        write_place_store(places_to_geodataframe(self.geo_data), self.path)
+        self.assertTrue(place_store_covers(self.path, {("08", "Aurora")}))
+
+    def test_vintages_share_unchanged_geometries(self):
+        store_dir = os.path.join(self.tmp_dir.name, "vintages")
+        places_2019 = places_to_geodataframe(self.geo_data)
+        places_2020 = places_to_geodataframe({
+            "08": {"type": "FeatureCollection", "features": [
+                # Denver's ring starts at another vertex, which is the same boundary
+                {"type": "Feature", "properties": {"NAME": "Denver", "GEOID": "0820000"},
+                 "geometry": {"type": "Polygon", "coordinates": [square(-105.0, 39.7)["coordinates"][0][1:] + [[-105.0, 40.7]]]}},
+                {"type": "Feature", "properties": {"NAME": "Boulder", "GEOID": "0807850"}, "geometry": square(-105.2, 40.0)},
+                {"type": "Feature", "properties": {"NAME": "Aurora", "GEOID": "0804000"}, "geometry": square(-104.8, 39.7)}
+            ]},
+            "53": {"type": "FeatureCollection", "features": [
+                {"type": "Feature", "properties": {"NAME": "Redmond City", "GEOID": "5357535"}, "geometry": square(-122.1, 47.6)}
+            ]}
+        })
+
+        self.assertEqual({"vintage": 2019, "places": 3, "new_geometries": 3, "reused_geometries": 0},
+                         write_place_vintage(store_dir, 2019, places_2019))
+        self.assertEqual({"vintage": 2020, "places": 4, "new_geometries": 2, "reused_geometries": 2},
+                         write_place_vintage(store_dir, 2020, places_2020))
+        self.assertEqual([2019, 2020], place_vintages(store_dir))
+
+        diff = diff_place_vintages(store_dir, 2019, 2020)
+        self.assertEqual([("0804000", "added"), ("0807850", "changed"), ("5357535", "renamed")], list(zip(diff["GEOID"], diff["status"])))
+        self.assertEqual(["Redmond", "Redmond City"], diff[["NAME_2019", "NAME_2020"]].iloc[2].tolist())
+
+        denver = read_place_vintage(store_dir, 2020, places={("08", "Denver")})
+        self.assertEqual(["0820000"], denver["GEOID"].tolist())
+        self.assertTrue(denver.geometry.iloc[0].equals(places_2019.geometry.iloc[0]))
+        # the 2020 part only holds boundaries 2019 does not reference, its geometry column is never read
+        with patch.object(pq.ParquetFile, "read_row_group", autospec=True, side_effect=pq.ParquetFile.read_row_group) as read_row_group:
+            whole_2019 = read_place_vintage(store_dir, 2019)
+        self.assertEqual(["Boulder", "Denver", "Redmond"], whole_2019["NAME"].tolist())
+        self.assertTrue(whole_2019.geometry.iloc[0].equals(places_2019.geometry.iloc[1]))
+        self.assertEqual(1, sum(call.kwargs["columns"] == ["geometry"] for call in read_row_group.call_args_list))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,50 @@
+import colorsys
+import json
+import os
+import subprocess
+import sys
+import unittest
+from unittest.mock import patch
+from data_manipulation.lazy import _LazyModule, is_imported, lazy_import
+
+
+class TestLazy(unittest.TestCase):
+
+    def test_imports_on_first_attribute_access(self):
+        proxy = _LazyModule("colorsys")
+
+        self.assertFalse(is_imported(proxy))
+        self.assertIn("not imported", repr(proxy))
+        self.assertEqual(colorsys.rgb_to_hsv(1, 0, 0), proxy.rgb_to_hsv(1, 0, 0))
+        self.assertTrue(is_imported(proxy))
+        self.assertIs(lazy_import("colorsys"), colorsys)
+
+    def test_patches_reach_the_module(self):
+        proxy = _LazyModule("colorsys")
+
+        with patch.object(proxy, "rgb_to_hsv", return_value="patched"):
+            self.assertEqual("patched", colorsys.rgb_to_hsv(1, 0, 0))
+        self.assertEqual((0.0, 1.0, 1.0), colorsys.rgb_to_hsv(1, 0, 0))
+
+    def test_cli_import_defers_heavy_dependencies(self):
+        heavy = ["folium", "geopandas", "numpy", "pandas", "pyarrow", "requests", "shapefile", "shapely", "yfinance"]
+        src = os.path.join(os.path.dirname(__file__), "..", "..", "src")
+        script = f"import sys, json; import pipeline.cli; print(json.dumps([m for m in {heavy!r} if m in sys.modules]))"
+
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                                env={**os.environ, "PYTHONPATH": os.path.abspath(src)})
+
+        self.assertEqual([], json.loads(result.stdout))
+
+    def test_map_and_state_imports_defer_pandas(self):
+        src = os.path.join(os.path.dirname(__file__), "..", "..", "src")
+        script = "import sys; import data_visualization.mapping, states.states; print('pandas' in sys.modules)"
+
+        result = subprocess.run([sys.executable, "-c", script], capture_output=True, text=True, check=True,
+                                env={**os.environ, "PYTHONPATH": os.path.abspath(src)})
+
+        self.assertEqual("False", result.stdout.strip())
+
+
+if __name__ == '__main__':
+    unittest.main()
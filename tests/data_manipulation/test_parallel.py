@@ -0,0 +1,102 @@
+import json
+import os
+import tempfile
+import unittest
+
+import pandas as pd
+import pyarrow as pa
+from data_manipulation.geostore import places_to_geodataframe
+from data_manipulation import transform
+from data_manipulation.parallel import _init_worker, _join_state, parallel_join_ticker_data_to_geodata, write_place_batches
+from data_manipulation.transform import join_ticker_data_to_geodata
+
+
+class TestParallel(unittest.TestCase):
+
+    def setUp(self):
+        self.sp_companies = pd.DataFrame({
+            'Symbol': ['AAPL', 'MSFT', 'AMZN', 'DAL', 'SHEL'],
+            'Security': ['Apple Inc.', 'Microsoft Corp.', 'Amazon', 'Delta Air Lines', 'Shell'],
+            'GICS Sector': ['Information Technology'] * 5,
+            'GICS Sub-Industry': ['Hardware'] * 5,
+            'Headquarters Location': ['Cupertino, California', 'Redmond, Washington', 'Seattle, Washington',
+                                      'Atlanta, Georgia', 'London, United Kingdom'],
+            'Date Added': ['1982-11-30'] * 5,
+            'CIK': ['0000320193', '0000789019', '0001018724', '0000027904', '0000000001'],
+            'Founded': ['1977'] * 5
+        })
+        self.ticker_data = {}
+        for i, symbol in enumerate(self.sp_companies['Symbol']):
+            self.ticker_data[('Open', symbol)] = {pd.Timestamp('2023-01-01'): 100.0 + i}
+            self.ticker_data[('Adj Close', symbol)] = {pd.Timestamp('2023-01-01'): 101.0 + 2 * i}
+            self.ticker_data[('Volume', symbol)] = {pd.Timestamp('2023-01-01'): 1000 * (i + 1)}
+
+        def square(x, y):
+            return {"type": "Polygon", "coordinates": [[[x, y], [x + 0.1, y], [x + 0.1, y + 0.1], [x, y + 0.1], [x, y]]]}
+
+        self.geo_data = json.dumps({
+            "06": {"type": "FeatureCollection", "features": [
+                {"type": "Feature", "properties": {"NAME": "Cupertino"}, "geometry": square(-122.0, 37.3)},
+                {"type": "Feature", "properties": {"NAME": "Fresno"}, "geometry": square(-119.8, 36.7)},
+            ]},
+            "53": {"type": "FeatureCollection", "features": [
+                {"type": "Feature", "properties": {"NAME": "Redmond"}, "geometry": square(-122.1, 47.6)},
+                {"type": "Feature", "properties": {"NAME": "Seattle"}, "geometry": square(-122.3, 47.6)},
+            ]},
+        })
+        geo_data_with_atlanta = json.loads(self.geo_data)
+        geo_data_with_atlanta["13"] = {"type": "FeatureCollection", "features": [
+            {"type": "Feature", "properties": {"NAME": "Atlanta"}, "geometry": square(-84.4, 33.7)}]}
+        self.geo_data_with_atlanta = json.dumps(geo_data_with_atlanta)
+
+    def test_parallel_join_matches_serial_join(self):
+        serial_geometry, serial_data = join_ticker_data_to_geodata(self.sp_companies, self.ticker_data, self.geo_data)
+        parallel_geometry, parallel_data = parallel_join_ticker_data_to_geodata(self.sp_companies, self.ticker_data, self.geo_data, max_workers=2)
+
+        self.assertEqual(json.loads(serial_geometry), json.loads(parallel_geometry))
+        pd.testing.assert_frame_equal(serial_data.reset_index(drop=True), parallel_data.reset_index(drop=True))
+        self.assertEqual(len(parallel_data), 3)
+
+    def test_parallel_join_numbers_cities_like_the_serial_join(self):
+        # Atlanta (13) sorts before Cupertino (06) by headquarter, but after it by state
+        serial_geometry, serial_data = join_ticker_data_to_geodata(self.sp_companies, self.ticker_data, self.geo_data_with_atlanta)
+        parallel_geometry, parallel_data = parallel_join_ticker_data_to_geodata(self.sp_companies, self.ticker_data, self.geo_data_with_atlanta, max_workers=2)
+
+        self.assertEqual(['Cupertino', 'Atlanta', 'Redmond', 'Seattle'], serial_data['City Name'].tolist())
+        self.assertEqual(json.loads(serial_geometry), json.loads(parallel_geometry))
+        pd.testing.assert_frame_equal(serial_data.reset_index(drop=True), parallel_data.reset_index(drop=True))
+
+    def test_parallel_join_without_located_companies(self):
+        foreign = self.sp_companies[self.sp_companies['Symbol'] == 'SHEL']
+        map_geometry, map_data = parallel_join_ticker_data_to_geodata(foreign, self.ticker_data, self.geo_data, max_workers=1)
+
+        self.assertEqual(json.loads(map_geometry)["features"], [])
+        self.assertTrue(map_data.empty)
+
+    def test_write_place_batches_one_batch_per_state(self):
+        places = places_to_geodataframe(self.geo_data)
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "places.arrow")
+            batch_index = write_place_batches(places, path)
+            reader = pa.ipc.open_file(pa.memory_map(path, "r"))
+
+            self.assertEqual(batch_index, {"06": 0, "53": 1})
+            self.assertEqual(reader.num_record_batches, 2)
+            self.assertEqual(reader.get_batch(batch_index["53"]).column(1).to_pylist(), ["Redmond", "Seattle"])
+
+    def test_join_state_returns_wkb(self):
+        prepped = transform.prepare_sp_companies(self.sp_companies)
+        places = places_to_geodataframe(self.geo_data)
+        change = transform.compute_symbol_change(self.ticker_data, prepped["Symbol"].unique())
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, "places.arrow")
+            batch_index = write_place_batches(places, path)
+            _init_worker(path, change)
+            _, city_frame = _join_state("53", batch_index["53"], prepped[prepped["fips"] == "53"])
+
+        self.assertEqual(["Redmond", "Seattle"], city_frame["City Name"].tolist())
+        self.assertTrue(all(isinstance(geometry, bytes) for geometry in city_frame["geometry"]))
+
+
+if __name__ == "__main__":
+    unittest.main()
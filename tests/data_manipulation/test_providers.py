@@ -0,0 +1,129 @@
+import tempfile
+import unittest
+from unittest.mock import MagicMock, patch
+import pandas as pd
+from requests import Response
+from data_manipulation.fetch import retrieve_sp_500, retrieve_ticker_data
+from data_manipulation.cache import ShapeCache
+from data_manipulation.providers import MeteredProvider, Provider, RecordingProvider, ReplayProvider, SessionProvider
+
+
+SP_500_URL = "https://en.wikipedia.org/wiki/List_of_S%26P_500_companies"
+SP_500_HTML = """
+<table class="wikitable sortable">
+    <tr><th>Symbol</th><th>Security</th><th>Headquarters Location</th></tr>
+    <tr><td>AAPL</td><td>Apple Inc.</td><td>Cupertino, California</td></tr>
+    <tr><td>MSFT</td><td>Microsoft Corp.</td><td>Redmond, Washington</td></tr>
+</table>
+"""
+
+
+class StubProvider(Provider):
+    """
+    Stands in for the live sources, counting the calls made to it.
+    """
+
+    def __init__(self):
+        self.calls = 0
+
+    def get(self, url, timeout=None, headers=None):
+        self.calls += 1
+        r = Response()
+        r.status_code, r._content, r.encoding = 200, SP_500_HTML.encode("utf-8"), "utf-8"
+        r.headers["ETag"] = '"v1"'
+        return r
+
+    def download_prices(self, symbols, period="1d", interval="1d", start=None, end=None):
+        self.calls += 1
+        columns = pd.MultiIndex.from_product([["Open", "Close", "Volume"], symbols])
+        return pd.DataFrame([[float(i) for i in range(len(columns))]], index=[pd.Timestamp("2023-01-03")], columns=columns)
+
+
+class TestProviders(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.stub = StubProvider()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_provider_requires_both_methods(self):
+        class HttpOnlyProvider(Provider):
+            def get(self, url, timeout=None, headers=None):
+                return None
+
+        with self.assertRaises(TypeError):
+            HttpOnlyProvider()
+        with self.assertRaises(TypeError):
+            Provider()
+
+    @patch('data_manipulation.providers.time.sleep')
+    def test_replay_serves_recorded_constituents(self, mock_sleep):
+        recorded = retrieve_sp_500(provider=RecordingProvider(self.stub, self.tmp_dir.name))
+
+        replayed = retrieve_sp_500(provider=ReplayProvider(self.tmp_dir.name, latency=0.25))
+
+        pd.testing.assert_frame_equal(recorded, replayed)
+        self.assertEqual(["AAPL", "MSFT"], replayed["Symbol"].tolist())
+        self.assertEqual(1, self.stub.calls)
+        mock_sleep.assert_called_once_with(0.25)
+
+    def test_replay_honours_conditional_requests(self):
+        RecordingProvider(self.stub, self.tmp_dir.name).get(SP_500_URL)
+        replay = ReplayProvider(self.tmp_dir.name)
+
+        self.assertEqual(304, replay.get(SP_500_URL, headers={"If-None-Match": '"v1"'}).status_code)
+        self.assertEqual(200, replay.get(SP_500_URL, headers={"If-None-Match": '"v0"'}).status_code)
+        with self.assertRaises(FileNotFoundError):
+            replay.get("https://example.com/not-recorded")
+
+    def test_replay_serves_recorded_prices_across_batches(self):
+        sp_data = pd.DataFrame({"Symbol": ["AAPL", "MSFT", "NVDA"]})
+        recorded = retrieve_ticker_data(sp_data, chunk_size=2, provider=RecordingProvider(self.stub, self.tmp_dir.name))
+
+        # the replay is batched differently than the recording was
+        replayed = retrieve_ticker_data(sp_data, chunk_size=1, provider=ReplayProvider(self.tmp_dir.name))
+
+        pd.testing.assert_frame_equal(recorded.sort_index(axis=1), replayed.sort_index(axis=1))
+        self.assertEqual(2, self.stub.calls)
+        with self.assertRaises(FileNotFoundError):
+            retrieve_ticker_data(sp_data, period="5d", retries=1, provider=ReplayProvider(self.tmp_dir.name))
+
+    def test_session_provider_revalidates_cached_responses(self):
+        provider = SessionProvider(ShapeCache(self.tmp_dir.name))
+        fresh, not_modified = MagicMock(status_code=200, content=b"<html>v1</html>", headers={"ETag": '"v1"'}), MagicMock(status_code=304, encoding=None)
+        provider.session.get = MagicMock(side_effect=[fresh, not_modified])
+
+        first = provider.get(SP_500_URL, timeout=5)
+        second = provider.get(SP_500_URL, timeout=5)
+
+        self.assertIs(fresh, first)
+        self.assertEqual((200, b"<html>v1</html>"), (second.status_code, second._content))
+        self.assertEqual([{}, {"If-None-Match": '"v1"'}], [call.kwargs["headers"] for call in provider.session.get.call_args_list])
+
+        # validators of the caller's own are passed through untouched
+        provider.session.get = MagicMock(return_value=not_modified)
+        self.assertIs(not_modified, provider.get(SP_500_URL, headers={"If-None-Match": '"v0"'}))
+
+        # so is a caller that manages its own cache but has no validators yet, the payload is not stored twice
+        other_url = SP_500_URL + "?cold"
+        provider.session.get = MagicMock(return_value=fresh)
+        self.assertIs(fresh, provider.get(other_url, headers={}))
+        self.assertIsNone(provider.cache.get_raw(other_url))
+
+    def test_metered_provider_counts_downloaded_bytes(self):
+        metered = MeteredProvider(self.stub)
+
+        retrieve_sp_500(provider=metered)
+        self.assertEqual(len(SP_500_HTML.encode("utf-8")), metered.bytes_downloaded)
+        retrieve_ticker_data(pd.DataFrame({"Symbol": ["AAPL"]}), provider=metered)
+        self.assertGreater(metered.bytes_downloaded, len(SP_500_HTML.encode("utf-8")))
+        self.assertEqual(repr(self.stub), repr(metered))
+
+    def test_repr_is_stable(self):
+        self.assertEqual(f"ReplayProvider({self.tmp_dir.name!r}, latency=0.5)", repr(ReplayProvider(self.tmp_dir.name, 0.5)))
+
+
+if __name__ == '__main__':
+    unittest.main()
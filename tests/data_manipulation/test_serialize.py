@@ -0,0 +1,57 @@
+import io
+import json
+import unittest
+import numpy as np
+import pandas as pd
+import shapely
+from data_manipulation.serialize import feature_collection_string, round_coordinates, write_feature_collection
+from data_manipulation.transform import forge_geojson
+
+
+class TestSerialize(unittest.TestCase):
+
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'City Name': ['Cupertino', 'Redmond', 'Atlantis'],
+            'Change': [np.float64(5000000.0), np.nan, 1.0],
+            'CIK': ['0000320193', '0000789019', '0000000001'],
+            'geometry': [
+                {"type": "Point", "coordinates": [-122.03221234, 37.32291234]},
+                shapely.Polygon([(-122.1, 47.6), (-122.1, 47.7), (-122.0, 47.7), (-122.1, 47.6)]),
+                None
+            ]
+        })
+
+    def test_round_coordinates(self):
+        self.assertEqual([[[1.12, 2.0], [3.0, 4.57]]], round_coordinates([[(1.123, 2), (3.0, 4.5678)]], 2))
+
+    def test_write_feature_collection_streams_the_same_document(self):
+        buffer = io.StringIO()
+        count = write_feature_collection(self.df.iloc[:2], buffer, precision=3)
+
+        self.assertEqual(2, count)
+        self.assertEqual(feature_collection_string(self.df.iloc[:2], precision=3), buffer.getvalue())
+        collection = json.loads(buffer.getvalue())
+        self.assertEqual('FeatureCollection', collection['type'])
+        self.assertEqual([-122.032, 37.323], collection['features'][0]['geometry']['coordinates'])
+        self.assertEqual({'City Name': 'Redmond', 'Change': None, 'CIK': '0000789019'}, collection['features'][1]['properties'])
+        self.assertEqual('Polygon', collection['features'][1]['geometry']['type'])
+
+    def test_forge_geojson_skips_rows_without_geometry(self):
+        map_geometry, map_data = forge_geojson(self.df)
+
+        collection = json.loads(map_geometry)
+        self.assertEqual(['0000320193', '0000789019'], [feature['properties']['CIK'] for feature in collection['features']])
+        self.assertEqual(5000000.0, collection['features'][0]['properties']['Change'])
+        self.assertEqual(['Cupertino', 'Redmond'], map_data['City Name'].tolist())
+
+    def test_forge_geojson_to_file(self):
+        buffer = io.StringIO()
+        map_geometry, map_data = forge_geojson(self.df, fp=buffer)
+
+        self.assertIsNone(map_geometry)
+        self.assertEqual(2, len(json.loads(buffer.getvalue())['features']))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+import json
+import unittest
+import shapely
+from data_manipulation.simplify import simplify_geojson, to_topojson, zoom_precision, zoom_tolerance
+
+
+def feature(name, coordinates):
+    return {"type": "Feature", "properties": {"NAME": name}, "geometry": {"type": "Polygon", "coordinates": coordinates}}
+
+
+class TestSimplify(unittest.TestCase):
+
+    def setUp(self):
+        # two neighbouring squares sharing the x = 1 border, the left one with a wiggly, densely sampled top edge
+        wiggles = [[i / 100, 1 + (0.0001 if i % 2 else 0)] for i in range(100, -1, -1)]
+        self.left = [[[0, 0], [1, 0], [1, 0.5], *wiggles, [0, 0]]]
+        self.right = [[[1, 0], [2, 0], [2, 1], [1, 1], [1, 0.5], [1, 0]]]
+        self.geo_json = json.dumps({"type": "FeatureCollection", "features": [feature("Left", self.left), feature("Right", self.right)]})
+
+    def test_zoom_tolerance_halves_per_zoom_level(self):
+        self.assertAlmostEqual(zoom_tolerance(3) / 2, zoom_tolerance(4))
+        self.assertEqual(3, zoom_precision(3))
+
+    def test_simplify_geojson(self):
+        report = {}
+        simplified = json.loads(simplify_geojson(self.geo_json, zoom=3, report=report))
+
+        left = shapely.geometry.shape(simplified["features"][0]["geometry"])
+        self.assertTrue(left.is_valid)
+        self.assertLess(len(left.exterior.coords), 10)
+        self.assertAlmostEqual(1.0, left.area, places=3)
+        self.assertEqual({"NAME": "Left"}, simplified["features"][0]["properties"])
+        self.assertLess(report["bytes_after"], report["bytes_before"])
+        self.assertLess(report["vertices_after"], report["vertices_before"])
+
+    def test_to_topojson_shares_borders(self):
+        topology = json.loads(to_topojson(self.geo_json))
+
+        geometries = topology["objects"]["places"]["geometries"]
+        left_arcs, right_arcs = geometries[0]["arcs"][0], geometries[1]["arcs"][0]
+        # the shared border x = 1 from y = 0 to y = 1 is stored once and walked in opposite directions
+        shared = {arc if arc >= 0 else ~arc for arc in left_arcs} & {arc if arc >= 0 else ~arc for arc in right_arcs}
+        self.assertEqual(1, len(shared))
+        self.assertEqual(3, len(topology["arcs"]))
+        self.assertEqual({"NAME": "Right"}, geometries[1]["properties"])
+
+    def test_to_topojson_round_trips_coordinates(self):
+        topology = json.loads(to_topojson(self.geo_json, quantization=1001))
+        scale, translate = topology["transform"]["scale"], topology["transform"]["translate"]
+
+        def decode(index):
+            arc = topology["arcs"][index if index >= 0 else ~index]
+            x = y = 0
+            points = []
+            for dx, dy in arc:
+                x, y = x + dx, y + dy
+                points.append((round(x * scale[0] + translate[0], 6), round(y * scale[1] + translate[1], 6)))
+            return points if index >= 0 else points[::-1]
+
+        ring = [point for index in topology["objects"]["places"]["geometries"][1]["arcs"][0] for point in decode(index)[:-1]]
+        self.assertTrue(shapely.Polygon(self.right[0]).normalize().equals_exact(shapely.Polygon(ring).normalize(), 1e-3))
+
+    def test_to_topojson_simplifies_arcs(self):
+        report = {}
+        to_topojson(self.geo_json, zoom=3, report=report)
+
+        self.assertLess(report["vertices_after"], 20)
+        self.assertLess(report["bytes_after"], report["bytes_before"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,13 @@
 import unittest
 from unittest.mock import patch
+import numpy as np
 import pandas as pd
 import json
-from data_manipulation.transform import join_ticker_data_to_geodata
+import os
+import io
+import tempfile
+from data_manipulation.geostore import places_to_geodataframe
+from data_manipulation.transform import aggregate_city_frame, compute_daily_symbol_change, geoenhance_companies, join_ticker_history_to_geodata, stream_ticker_data_to_geodata, apply_city_aliases, compute_symbol_change, join_ticker_data_to_geodata, load_city_aliases, places_of_interest, prepare_sp_companies, unmatched_headquarters
 
 class TestTransform(unittest.TestCase):
 
@@ -61,11 +66,199 @@ class TestTransform(unittest.TestCase):
         self.assertFalse(map_data.empty)
 
         # Check if the map_data DataFrame contains the expected columns
-        expected_columns = ['Headquarters Location', 'City Name', 'State', 'Change', 'CIK']
+        expected_columns = ['id', 'Headquarters Location', 'City Name', 'State', 'Change', 'Change Mean', 'Companies', 'Top Mover']
         self.assertTrue(all(column in map_data.columns for column in expected_columns))
 
         # Check if the map_data DataFrame contains the expected number of rows
         self.assertEqual(len(map_data), 2)
+    def test_join_ticker_data_to_geodata_from_geodataframe(self):
+        from_json = join_ticker_data_to_geodata(self.sp_companies, self.ticker_data, self.geo_data)
+        from_frame = join_ticker_data_to_geodata(self.sp_companies, self.ticker_data, places_to_geodataframe(self.geo_data))
+
+        self.assertEqual(json.loads(from_json[0]), json.loads(from_frame[0]))
+        pd.testing.assert_frame_equal(from_json[1], from_frame[1])
+
+    def test_stream_ticker_data_to_geodata(self):
+        map_geometry, map_data = join_ticker_data_to_geodata(self.sp_companies, self.ticker_data, self.geo_data)
+        consumed = []
+
+        def state_shapes():
+            for fips, feature_collection in json.loads(self.geo_data).items():
+                consumed.append(fips)
+                yield fips, feature_collection
+
+        fp = io.StringIO()
+        streamed_data = stream_ticker_data_to_geodata(self.sp_companies, self.ticker_data, state_shapes(), fp)
+
+        self.assertEqual(['06', '53'], consumed)
+        self.assertEqual(json.loads(map_geometry), json.loads(fp.getvalue()))
+        pd.testing.assert_frame_equal(map_data.reset_index(drop=True), streamed_data)
+
+    def test_stream_numbers_cities_like_the_serial_join(self):
+        # the fips order of the states (13, 25, 48) differs from the order of their headquarters
+        sp_companies = pd.DataFrame({
+            'Symbol': ['DAL', 'TSLA', 'BSX'], 'Security': ['Delta Air Lines', 'Tesla', 'Boston Scientific'],
+            'GICS Sector': ['Industrials', 'Consumer Discretionary', 'Health Care'], 'GICS Sub-Industry': ['Airlines', 'Automobiles', 'Equipment'],
+            'Headquarters Location': ['Atlanta, Georgia', 'Austin, Texas', 'Boston, Massachusetts'],
+            'Date Added': ['2013-09-11'] * 3, 'CIK': ['0000027904', '0001318605', '0000885725'], 'Founded': ['1925', '2003', '1979']
+        })
+        ticker_data = {(metric, symbol): {pd.Timestamp('2023-01-01'): value}
+                       for symbol in sp_companies['Symbol'] for metric, value in [('Open', 100.0), ('Adj Close', 101.0), ('Volume', 1000)]}
+        geo_data = {fips: {"type": "FeatureCollection", "features": [
+            {"type": "Feature", "properties": {"NAME": name}, "geometry": {"type": "Point", "coordinates": [x, y]}}]}
+            for fips, name, x, y in [("13", "Atlanta", -84.4, 33.7), ("25", "Boston", -71.1, 42.4), ("48", "Austin", -97.7, 30.3)]}
+
+        map_geometry, map_data = join_ticker_data_to_geodata(sp_companies, ticker_data, json.dumps(geo_data))
+        fp = io.StringIO()
+        streamed_data = stream_ticker_data_to_geodata(sp_companies, ticker_data, iter(geo_data.items()), fp)
+
+        self.assertEqual([(0, 'Atlanta'), (1, 'Boston'), (2, 'Austin')], list(zip(map_data['id'], map_data['City Name'])))
+        self.assertEqual(json.loads(map_geometry), json.loads(fp.getvalue()))
+        pd.testing.assert_frame_equal(map_data.reset_index(drop=True), streamed_data)
+
+    def test_headquarters_of_one_place_share_one_city(self):
+        sp_companies = pd.concat([self.sp_companies, pd.DataFrame({
+            'Symbol': ['XYZ'], 'Security': ['Xyz Corp.'], 'GICS Sector': ['Industrials'], 'GICS Sub-Industry': ['Machinery'],
+            'Headquarters Location': ['Bellevue, Washington'], 'Date Added': ['2000-01-01'], 'CIK': ['0000000001'], 'Founded': ['1900']
+        })], ignore_index=True)
+        ticker_data = {**self.ticker_data, ('Open', 'XYZ'): {pd.Timestamp('2023-01-01'): 10.0},
+                       ('Adj Close', 'XYZ'): {pd.Timestamp('2023-01-01'): 12.0}, ('Volume', 'XYZ'): {pd.Timestamp('2023-01-01'): 1000}}
+        city_aliases = pd.DataFrame({'City Name': ['Bellevue'], 'State': ['Washington'], 'Place Name': ['Redmond']})
+
+        map_geometry, map_data = join_ticker_data_to_geodata(sp_companies, ticker_data, self.geo_data, city_aliases=city_aliases)
+
+        self.assertEqual(['Cupertino', 'Redmond'], [feature['properties']['City Name'] for feature in json.loads(map_geometry)['features']])
+        redmond = map_data[map_data['City Name'] == 'Redmond']
+        change = compute_symbol_change(ticker_data).set_index('Symbol')['Change']
+        self.assertEqual(1, len(redmond))
+        self.assertEqual(['Bellevue, Washington'], redmond['Headquarters Location'].tolist())
+        self.assertEqual(2, redmond['Companies'].iloc[0])
+        self.assertAlmostEqual(change['MSFT'] + change['XYZ'], redmond['Change'].iloc[0])
+
+    def test_apply_city_aliases_is_keyed_by_city_and_state(self):
+        companies = pd.DataFrame({
+            'City Name': ['Wayne', 'Wayne', 'New York City', 'Denver'],
+            'State': ['Pennsylvania', 'New Jersey', 'New York', 'Colorado']
+        })
+
+        result = apply_city_aliases(companies, load_city_aliases())
+
+        self.assertEqual(['Philadelphia', 'Wayne', 'New York', 'Denver'], result['City Name'].tolist())
+
+    def test_load_city_aliases_rejects_duplicates(self):
+        with tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False) as f:
+            f.write('City Name,State,Place Name\nWayne,Pennsylvania,Philadelphia\nWayne,Pennsylvania,Radnor\n')
+        try:
+            with self.assertRaises(ValueError):
+                load_city_aliases(f.name)
+        finally:
+            os.remove(f.name)
+
+    def test_unmatched_headquarters(self):
+        sp_companies = pd.concat([self.sp_companies, pd.DataFrame({
+            'Symbol': ['XYZ'], 'Security': ['Xyz Corp.'], 'GICS Sector': ['Industrials'], 'GICS Sub-Industry': ['Machinery'],
+            'Headquarters Location': ['Atlantis, Washington'], 'Date Added': ['2000-01-01'], 'CIK': ['0000000001'], 'Founded': ['1900']
+        })], ignore_index=True)
+        prepped_sp_data = prepare_sp_companies(sp_companies)
+        joined = prepped_sp_data.assign(state_fips=prepped_sp_data['fips'].where(prepped_sp_data['City Name'] != 'Atlantis'))
+
+        unmatched = unmatched_headquarters(joined)
+
+        self.assertEqual([('Atlantis', 'Washington', 1, 'XYZ')], list(unmatched.itertuples(index=False, name=None)))
+
+    def test_compute_symbol_change(self):
+        expected = pd.DataFrame({
+            'Symbol': ['AAPL', 'MSFT', 'GOOG'],
+            'Open': [150.0, 250.0, np.nan],
+            'Close': [155.0, 255.0, np.nan],
+            'Volume': [1000000.0, 2000000.0, np.nan],
+            'Change': [5000000.0, 10000000.0, np.nan]
+        })
+
+        from_dict = compute_symbol_change(self.ticker_data, ['AAPL', 'MSFT', 'GOOG'])
+        from_frame = compute_symbol_change(pd.DataFrame(self.ticker_data), ['AAPL', 'MSFT', 'GOOG'])
+
+        pd.testing.assert_frame_equal(expected, from_dict)
+        pd.testing.assert_frame_equal(expected, from_frame)
+
+    def test_compute_symbol_change_without_adjusted_close(self):
+        ticker_data = pd.DataFrame({
+            ('Open', 'AAPL'): [150.0, 160.0],
+            ('Close', 'AAPL'): [149.0, 161.0],
+            ('Volume', 'AAPL'): [100.0, 200.0]
+        }, index=pd.to_datetime(['2023-01-01', '2023-01-02']))
+
+        result = compute_symbol_change(ticker_data)
+
+        # a multi session download spans from the first open to the last close
+        self.assertEqual([('AAPL', 150.0, 161.0, 300.0, 3300.0)], list(result.itertuples(index=False, name=None)))
+
+    def test_places_of_interest(self):
+        prepped_sp_data = prepare_sp_companies(self.sp_companies)
+
+        self.assertEqual({('06', 'Cupertino'), ('53', 'Redmond')}, places_of_interest(prepped_sp_data))
+
+class TestDailyChange(unittest.TestCase):
+
+    def setUp(self):
+        self.sp_companies = pd.DataFrame({
+            'Symbol': ['AAPL', 'MSFT', 'AMZN'],
+            'Security': ['Apple Inc.', 'Microsoft Corp.', 'Amazon'],
+            'GICS Sector': ['Information Technology'] * 3,
+            'GICS Sub-Industry': ['Hardware'] * 3,
+            'Headquarters Location': ['Cupertino, California', 'Redmond, Washington', 'Redmond, Washington'],
+            'Date Added': ['1982-11-30'] * 3,
+            'CIK': ['0000320193', '0000789019', '0001018724'],
+            'Founded': ['1977'] * 3
+        })
+        days = pd.DatetimeIndex(['2023-01-02', '2023-01-03', '2023-01-04'])
+        self.ticker_data = pd.DataFrame({
+            ('Open', 'AAPL'): [10.0, 11.0, 12.0], ('Close', 'AAPL'): [11.0, 12.0, 11.0], ('Volume', 'AAPL'): [100, 100, 100],
+            ('Open', 'MSFT'): [20.0, 21.0, np.nan], ('Close', 'MSFT'): [21.0, 20.0, np.nan], ('Volume', 'MSFT'): [10, 10, np.nan],
+            ('Open', 'AMZN'): [30.0, 30.0, 30.0], ('Close', 'AMZN'): [31.0, 31.0, 32.0], ('Volume', 'AMZN'): [1, 1, 1],
+        }, index=days)
+        square = lambda x, y: {"type": "Polygon", "coordinates": [[[x, y], [x + 0.1, y], [x + 0.1, y + 0.1], [x, y + 0.1], [x, y]]]}
+        self.geo_data = json.dumps({
+            "06": {"type": "FeatureCollection", "features": [{"type": "Feature", "properties": {"NAME": "Cupertino"}, "geometry": square(-122.1, 37.3)}]},
+            "53": {"type": "FeatureCollection", "features": [{"type": "Feature", "properties": {"NAME": "Redmond"}, "geometry": square(-122.2, 47.6)}]},
+        })
+
+    def test_aggregate_city_frame(self):
+        prepped = prepare_sp_companies(self.sp_companies)
+        change = pd.DataFrame({"Symbol": ["AAPL", "MSFT", "AMZN"], "Change": [5.0, -7.0, 3.0]})
+
+        final_df = aggregate_city_frame(geoenhance_companies(prepped, self.geo_data), change)
+
+        self.assertEqual([0, 1], final_df["id"].tolist())
+        self.assertEqual(["Cupertino", "Redmond"], final_df["City Name"].tolist())
+        self.assertEqual([5.0, -4.0], final_df["Change"].tolist())
+        self.assertEqual([5.0, -2.0], final_df["Change Mean"].tolist())
+        self.assertEqual([1, 2], final_df["Companies"].tolist())
+        self.assertEqual(["AAPL", "MSFT"], final_df["Top Mover"].tolist())
+        # one geometry per city, however many companies it has
+        self.assertEqual(2, len(final_df))
+
+    def test_compute_daily_symbol_change_rolls_intraday_bars_up(self):
+        bars = pd.DataFrame({
+            ('Open', 'AAPL'): [10.0, 10.5, 12.0], ('Close', 'AAPL'): [10.5, 11.0, 13.0], ('Volume', 'AAPL'): [50, 50, 10],
+        }, index=pd.DatetimeIndex(['2023-01-02 09:30', '2023-01-02 15:30', '2023-01-03 09:30']))
+
+        daily = compute_daily_symbol_change(bars)
+
+        self.assertEqual(['Date', 'Symbol', 'Open', 'Close', 'Volume', 'Change'], daily.columns.tolist())
+        self.assertEqual([(10.0, 11.0, 100.0, 100.0), (12.0, 13.0, 10.0, 10.0)],
+                         list(daily[['Open', 'Close', 'Volume', 'Change']].itertuples(index=False, name=None)))
+
+    def test_join_ticker_history_to_geodata(self):
+        map_geometry, city_change = join_ticker_history_to_geodata(self.sp_companies, self.ticker_data, self.geo_data)
+
+        features = json.loads(map_geometry)["features"]
+        self.assertEqual([(0, "Cupertino"), (1, "Redmond")], [(f["properties"]["id"], f["properties"]["City Name"]) for f in features])
+        self.assertEqual(['2023-01-02', '2023-01-03', '2023-01-04'], city_change.columns.tolist())
+        self.assertEqual([0, 1], city_change.index.tolist())
+        # Redmond sums MSFT and AMZN every day, MSFT has no data on the last one
+        np.testing.assert_array_equal([[100.0, 100.0, -100.0], [11.0, -9.0, 2.0]], city_change.to_numpy())
+
 
 if __name__ == '__main__':
     unittest.main()
\ No newline at end of file
@@ -0,0 +1,36 @@
+import json
+import unittest
+import pandas as pd
+from data_visualization.mapping import generate_tiled_chloropleth_map, generate_time_slider_chloropleth_map
+
+
+class TestMapping(unittest.TestCase):
+
+    def setUp(self):
+        self.geo_json = json.dumps({"type": "FeatureCollection", "features": [
+            {"type": "Feature", "properties": {"id": 0, "Headquarters Location": "Evil</script><script>alert(1)</script>, Texas"},
+             "geometry": {"type": "Polygon", "coordinates": [[[-97.1, 32.7], [-97.0, 32.7], [-97.0, 32.8], [-97.1, 32.8], [-97.1, 32.7]]]}}
+        ]})
+        self.frame_data = pd.DataFrame({"2023-01-02": [5.0], "2023-01-03": [-2.0]}, index=pd.Index([0], name="id"))
+
+    def test_time_slider_escapes_embedded_geojson(self):
+        html = generate_time_slider_chloropleth_map(self.geo_json, self.frame_data).get_root().render()
+
+        self.assertNotIn("Evil</script>", html)
+        self.assertIn("Evil\\u003c/script\\u003e", html)
+        # the escapes are only a different spelling of the same json
+        embedded = html.split("var data = ", 1)[1].split(";\n", 1)[0]
+        self.assertEqual(json.loads(self.geo_json), json.loads(embedded))
+
+    def test_renderers_share_the_colour_steps(self):
+        animated = generate_time_slider_chloropleth_map(self.geo_json, self.frame_data, steps=2).get_root().render()
+        tiled = generate_tiled_chloropleth_map("tiles/{z}/{x}/{y}.geojson", pd.DataFrame({"id": [0, 1], "Change": [-2.0, 5.0]}),
+                                               steps=2).get_root().render()
+
+        for html in (animated, tiled):
+            self.assertEqual(1, html.count("function color(value)"))
+            self.assertIn("var thresholds = [-2.0, 1.5, 5.0]", html)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import json
+import os
+import tempfile
+import unittest
+import pandas as pd
+import shapely
+from data_visualization.mapping import generate_tiled_chloropleth_map
+from data_visualization.tiles import generate_vector_tiles, tile_bounds, tiles_for_bounds
+
+
+class TestTiles(unittest.TestCase):
+
+    def setUp(self):
+        self.geo_json = json.dumps({"type": "FeatureCollection", "features": [
+            {"type": "Feature", "properties": {"CIK": "0000320193", "Change": 5000000.0},
+             "geometry": {"type": "Polygon", "coordinates": [[[-122.1, 37.3], [-122.0, 37.3], [-122.0, 37.4], [-122.1, 37.4], [-122.1, 37.3]]]}},
+            {"type": "Feature", "properties": {"CIK": "0000789019", "Change": -1.0},
+             "geometry": {"type": "Polygon", "coordinates": [[[-122.2, 47.6], [-122.0, 47.6], [-122.0, 47.7], [-122.2, 47.7], [-122.2, 47.6]]]}}
+        ]})
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_tile_bounds(self):
+        west, south, east, north = tile_bounds(0, 0, 0)
+        self.assertEqual((-180.0, 180.0), (west, east))
+        self.assertAlmostEqual(85.0511287798066, north)
+        self.assertEqual([(0, 0), (0, 1), (1, 0), (1, 1)], list(tiles_for_bounds((-180, -80, 180, 80), 1)))
+        self.assertEqual([(0, 0)], list(tiles_for_bounds((-122.1, 37.3, -122.0, 37.4), 1)))
+
+    def test_generate_vector_tiles(self):
+        metadata = generate_vector_tiles(self.geo_json, self.tmp_dir.name, min_zoom=0, max_zoom=8, max_workers=2)
+
+        # one tile per zoom level holds both cities until they split up into separate tiles
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir.name, "0", "0", "0.geojson")))
+        self.assertEqual(metadata, json.load(open(os.path.join(self.tmp_dir.name, "metadata.json"))))
+        self.assertEqual(0, metadata["minzoom"])
+        self.assertEqual({"CIK": "str", "Change": "float"}, metadata["vector_layers"][0]["fields"])
+
+        written = [os.path.join(root, name) for root, _, names in os.walk(self.tmp_dir.name) for name in names if name.endswith(".geojson")]
+        self.assertEqual(metadata["tiles"], len(written))
+        for path in written:
+            z, x, y = (int(part) for part in os.path.relpath(path, self.tmp_dir.name)[:-len(".geojson")].split(os.sep))
+            west, south, east, north = tile_bounds(z, x, y)
+            margin = (east - west) / 64 + 1e-9
+            for feature in json.load(open(path))["features"]:
+                minx, miny, maxx, maxy = shapely.geometry.shape(feature["geometry"]).bounds
+                self.assertGreaterEqual(minx, west - margin)
+                self.assertLessEqual(maxx, east + margin)
+                self.assertIn(feature["properties"]["CIK"], ["0000320193", "0000789019"])
+
+    def test_generate_tiled_chloropleth_map(self):
+        map_data = pd.DataFrame({"CIK": ["0000320193", "0000789019"], "Change": [5000000.0, -1.0]})
+
+        html = generate_tiled_chloropleth_map("tiles/{z}/{x}/{y}.geojson", map_data, max_zoom=8).get_root().render()
+
+        self.assertIn('"tiles/{z}/{x}/{y}.geojson"', html)
+        self.assertIn('"Change"', html)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+import json
+import os
+import tempfile
+import unittest
+from unittest.mock import patch
+import geopandas as gpd
+import pandas as pd
+from data_manipulation.geostore import places_to_geodataframe
+from pipeline import cli
+
+
+class TestCli(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.sp_companies = pd.DataFrame({
+            'Symbol': ['AAPL', 'MSFT'],
+            'Security': ['Apple Inc.', 'Microsoft Corp.'],
+            'GICS Sector': ['Information Technology', 'Information Technology'],
+            'GICS Sub-Industry': ['Technology Hardware, Storage & Peripherals', 'Systems Software'],
+            'Headquarters Location': ['Cupertino, California', 'Redmond, Washington'],
+            'Date Added': ['1982-11-30', '1991-03-31'],
+            'CIK': ['0000320193', '0000789019'],
+            'Founded': ['1977', '1975']
+        })
+        square = lambda x, y: {"type": "Polygon", "coordinates": [[[x, y], [x + 0.1, y], [x + 0.1, y + 0.1], [x, y + 0.1], [x, y]]]}
+        self.places = places_to_geodataframe({
+            "06": {"type": "FeatureCollection", "features": [{"type": "Feature", "properties": {"NAME": "Cupertino"}, "geometry": square(-122.1, 37.3)}]},
+            "53": {"type": "FeatureCollection", "features": [{"type": "Feature", "properties": {"NAME": "Redmond"}, "geometry": square(-122.2, 47.6)}]},
+        })
+        self.ticker_data = pd.DataFrame({
+            ('Open', 'AAPL'): [150.0], ('Adj Close', 'AAPL'): [155.0], ('Volume', 'AAPL'): [1000000],
+            ('Open', 'MSFT'): [250.0], ('Adj Close', 'MSFT'): [255.0], ('Volume', 'MSFT'): [2000000],
+        }, index=[pd.Timestamp('2023-01-01')])
+
+        patches = [patch('data_manipulation.fetch.retrieve_sp_500', return_value=self.sp_companies),
+                   patch('data_manipulation.fetch.retrieve_ticker_data', return_value=self.ticker_data),
+                   patch('data_manipulation.fetch.retrieve_us_city_geodataframe', return_value=self.places)]
+        self.mocks = [p.start() for p in patches]
+        for p in patches:
+            self.addCleanup(p.stop)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def run_cli(self, *argv):
+        return cli.main([*argv, "--cache-dir", self.tmp_dir.name])
+
+    def test_options_default_to_the_environment(self):
+        with patch.dict(os.environ, {"MAP_JOIN_WORKERS": "3", "MAP_TILES": "1", "MARKET_DATA_REPLAY": "/replay"}):
+            args = cli.build_parser().parse_args(["render"])
+
+        self.assertEqual((3, "tiles", "/replay"), (args.join_workers, args.format, args.offline))
+        self.assertEqual("geojson", cli.build_parser().parse_args(["join"]).format)
+        with self.assertRaises(SystemExit):
+            cli.build_parser().parse_args(["join", "--format", "tiles"])
+
+    def test_fetch_then_join_reuses_the_fetched_stages(self):
+        self.assertEqual(0, self.run_cli("fetch"))
+        output = os.path.join(self.tmp_dir.name, "cities.geojson")
+        self.assertEqual(0, self.run_cli("join", "-o", output, "--download-workers", "2"))
+
+        # the ticker data is refreshed on every run, everything else was fetched once
+        self.assertEqual([1, 2, 1], [mock.call_count for mock in self.mocks])
+        self.assertEqual(2, self.mocks[1].call_args.kwargs["max_workers"])
+        with open(output) as f:
+            self.assertEqual({"Cupertino", "Redmond"}, {feature["properties"]["City Name"] for feature in json.load(f)["features"]})
+
+    def test_join_to_geoparquet(self):
+        output = os.path.join(self.tmp_dir.name, "cities.parquet")
+        self.run_cli("join", "--format", "geoparquet", "-o", output)
+
+        cities = gpd.read_parquet(output)
+        self.assertEqual({"Cupertino": 5000000.0, "Redmond": 10000000.0}, dict(zip(cities["City Name"], cities["Change"])))
+
+    def test_render_html_with_metrics(self):
+        output = os.path.join(self.tmp_dir.name, "maps", "map.html")
+        metrics = os.path.join(self.tmp_dir.name, "metrics.prom")
+        self.run_cli("render", "-o", output, "--zoom", "5", "--pixels", "1", "--metrics", metrics)
+
+        with open(output) as f:
+            self.assertIn("Cupertino", f.read())
+        with open(metrics) as f:
+            self.assertIn('market_change_stage_seconds{stage="map_html"}', f.read())
+
+    def test_render_animation(self):
+        self.mocks[1].return_value = pd.DataFrame({
+            ('Open', 'AAPL'): [150.0, 155.0], ('Adj Close', 'AAPL'): [155.0, 150.0], ('Volume', 'AAPL'): [1000, 1000],
+            ('Open', 'MSFT'): [250.0, 255.0], ('Adj Close', 'MSFT'): [255.0, 256.0], ('Volume', 'MSFT'): [2000, 2000],
+        }, index=pd.DatetimeIndex(['2023-01-02', '2023-01-03']))
+        output = os.path.join(self.tmp_dir.name, "animation.html")
+        self.run_cli("render", "--format", "animation", "--period", "5d", "-o", output)
+
+        self.assertEqual("5d", self.mocks[1].call_args.kwargs["period"])
+        with open(output) as f:
+            html = f.read()
+        self.assertIn('["2023-01-02", "2023-01-03"]', html)
+        self.assertIn("[[5000, -5000], [10000, 2000]]", html)
+        self.assertEqual(1, html.count("Cupertino, California"))
+
+    def test_vintages_report(self):
+        square = lambda x, y: {"type": "Polygon", "coordinates": [[[x, y], [x + 0.1, y], [x + 0.1, y + 0.1], [x, y + 0.1], [x, y]]]}
+        vintages = {
+            2019: {"08": {"type": "FeatureCollection", "features": [
+                {"type": "Feature", "properties": {"NAME": "Denver", "GEOID": "0820000"}, "geometry": square(-105.0, 39.7)},
+                {"type": "Feature", "properties": {"NAME": "Boulder", "GEOID": "0807850"}, "geometry": square(-105.3, 40.0)}]}},
+            2020: {"08": {"type": "FeatureCollection", "features": [
+                {"type": "Feature", "properties": {"NAME": "Denver", "GEOID": "0820000"}, "geometry": square(-105.0, 39.8)}]}},
+        }
+        output = os.path.join(self.tmp_dir.name, "changes.csv")
+        with patch('data_manipulation.fetch.retrieve_us_city_shape_files', side_effect=lambda vintage, **kwargs: vintages[vintage]) as mock:
+            self.run_cli("vintages", "2020", "2019", "-o", output)
+
+        self.assertEqual([2019, 2020], [call.kwargs["vintage"] for call in mock.call_args_list])
+        report = pd.read_csv(output, dtype=str)
+        self.assertEqual([("0807850", "removed"), ("0820000", "changed")], list(zip(report["GEOID"], report["status"])))
+        self.assertEqual({"2019"}, set(report["old"]))
+
+    def test_vintage_selects_the_place_store(self):
+        self.run_cli("fetch", "--vintage", "2020")
+
+        self.assertEqual(os.path.join(self.tmp_dir.name, "places_2020.parquet"), self.mocks[2].call_args.args[0])
+        self.assertEqual(2020, self.mocks[2].call_args.kwargs["vintage"])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,101 @@
+import json
+import os
+import tempfile
+import unittest
+import pandas as pd
+from pipeline.metrics import MetricsRecorder, count_rows, size_in_bytes
+from pipeline.runner import Pipeline
+
+
+class CountingProvider:
+    """
+    Stands in for a providers.MeteredProvider.
+    """
+
+    def __init__(self):
+        self.bytes_downloaded = 0
+
+
+class TestMetrics(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_count_rows_and_size_in_bytes(self):
+        df = pd.DataFrame({"a": [1, 2, 3]})
+
+        self.assertEqual(3, count_rows(df))
+        self.assertEqual(3, count_rows(("{}", df)))
+        self.assertEqual(2, count_rows({"06": {}, "53": {}}))
+        self.assertIsNone(count_rows("{}"))
+        self.assertEqual(len("é".encode("utf-8")), size_in_bytes("é"))
+        self.assertEqual(2 + size_in_bytes(df), size_in_bytes(("{}", df)))
+        self.assertIsNone(size_in_bytes(object()))
+
+    def test_instrument_records_rows_bytes_and_downloads(self):
+        provider = CountingProvider()
+        metrics = MetricsRecorder(provider=provider)
+
+        def download(df):
+            provider.bytes_downloaded += 100
+            return df.head(1)
+
+        output = metrics.instrument("download", download)(pd.DataFrame({"a": [1, 2, 3]}))
+
+        self.assertEqual(1, len(output))
+        record = metrics.records[0]
+        self.assertEqual(("download", 3, 1, 100), (record["stage"], record["rows_in"], record["rows_out"], record["bytes_downloaded"]))
+        self.assertGreaterEqual(record["seconds"], 0)
+        self.assertGreater(record["peak_rss_bytes"], 0)
+
+    def test_exports(self):
+        metrics = MetricsRecorder()
+        with metrics.measure("render", rows_in=2) as record:
+            record.update(rows_out=2, output_bytes=10)
+        jsonl_path = os.path.join(self.tmp_dir.name, "metrics.jsonl")
+        prom_path = os.path.join(self.tmp_dir.name, "metrics.prom")
+
+        metrics.write(jsonl_path)
+        metrics.write(jsonl_path)
+        metrics.write(prom_path)
+
+        with open(jsonl_path) as f:
+            lines = [json.loads(line) for line in f]
+        self.assertEqual(2, len(lines))
+        self.assertEqual(10, lines[0]["output_bytes"])
+        with open(prom_path) as f:
+            prom = f.read()
+        self.assertIn("# TYPE market_change_stage_seconds gauge", prom)
+        self.assertIn('market_change_stage_output_bytes{stage="render"} 10', prom)
+        self.assertNotIn("bytes_downloaded", prom)
+
+    def test_profilers_capture_every_stage(self):
+        profile_dir = os.path.join(self.tmp_dir.name, "profile")
+        for profile, suffix in (("cprofile", ".prof"), ("tracemalloc", ".tracemalloc.txt")):
+            metrics = MetricsRecorder(profile=profile, profile_dir=profile_dir)
+            with metrics.measure("join"):
+                [str(i) for i in range(1000)]
+            self.assertTrue(os.path.exists(os.path.join(profile_dir, f"join{suffix}")))
+        self.assertGreater(metrics.records[0]["traced_peak_bytes"], 0)
+
+        with self.assertRaises(ValueError):
+            MetricsRecorder(profile="perf")
+
+    def test_pipeline_measures_recomputed_stages(self):
+        metrics = MetricsRecorder()
+        pipeline = (Pipeline(self.tmp_dir.name, metrics)
+                    .add("companies", lambda: pd.DataFrame({"Symbol": ["AAPL", "MSFT"]}))
+                    .add("symbols", lambda companies: tuple(companies["Symbol"]), inputs=("companies",)))
+
+        pipeline.run(["symbols"])
+        pipeline.run(["symbols"])
+
+        self.assertEqual([("companies", "computed", None, 2), ("symbols", "computed", 2, None)],
+                         [(r["stage"], r["status"], r["rows_in"], r["rows_out"]) for r in metrics.records])
+
+
+if __name__ == '__main__':
+    unittest.main()
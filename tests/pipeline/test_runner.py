@@ -0,0 +1,161 @@
+import importlib
+import os
+import sys
+import tempfile
+import unittest
+from unittest.mock import patch
+from pipeline.runner import Pipeline, dependency_sources
+
+
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.calls = []
+        self.prices = [1.0, 2.0]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def build(self) -> Pipeline:
+        def companies():
+            self.calls.append("companies")
+            return ["AAPL", "MSFT"]
+
+        def prices(companies):
+            self.calls.append("prices")
+            return dict(zip(companies, self.prices))
+
+        def geometry(companies, scale):
+            self.calls.append("geometry")
+            return {company: len(company) * scale for company in companies}
+
+        def aggregate(geometry, prices):
+            self.calls.append("aggregate")
+            return {company: geometry[company] * prices[company] for company in geometry}
+
+        return (Pipeline(self.tmp_dir.name)
+                .add("companies", companies, ttl=60)
+                .add("prices", prices, inputs=("companies",), ttl=0)
+                .add("geometry", geometry, inputs=("companies",), params={"scale": 2})
+                .add("aggregate", aggregate, inputs=("geometry", "prices")))
+
+    def test_first_run_computes_every_stage(self):
+        pipeline = self.build()
+
+        outputs = pipeline.run(["aggregate"])
+
+        self.assertEqual({"aggregate": {"AAPL": 8.0, "MSFT": 16.0}}, outputs)
+        self.assertEqual(["companies", "geometry", "prices", "aggregate"], self.calls)
+        self.assertEqual({"computed"}, {entry["status"] for entry in pipeline.report})
+        self.assertTrue(os.path.exists(os.path.join(self.tmp_dir.name, "manifest.json")))
+
+    def test_only_stages_downstream_of_changed_prices_rerun(self):
+        self.build().run(["aggregate"])
+        self.calls.clear()
+
+        self.prices = [1.0, 3.0]
+        pipeline = self.build()
+        outputs = pipeline.run(["aggregate"])
+
+        self.assertEqual({"AAPL": 8.0, "MSFT": 24.0}, outputs["aggregate"])
+        self.assertEqual(["prices", "aggregate"], self.calls)
+        self.assertEqual({"companies": "reused", "prices": "computed", "geometry": "reused", "aggregate": "computed"},
+                         {entry["stage"]: entry["status"] for entry in pipeline.report})
+
+    def test_unchanged_prices_leave_downstream_untouched(self):
+        self.build().run(["aggregate"])
+        self.calls.clear()
+
+        pipeline = self.build()
+        outputs = pipeline.run(["aggregate"])
+
+        self.assertEqual({"AAPL": 8.0, "MSFT": 16.0}, outputs["aggregate"])
+        self.assertEqual(["prices"], self.calls)
+        self.assertEqual("unchanged", {entry["stage"]: entry["status"] for entry in pipeline.report}["prices"])
+
+    def test_ttl_expiry_and_force(self):
+        self.build().run(["aggregate"])
+        self.calls.clear()
+
+        with patch("pipeline.runner.time.time", return_value=os.path.getmtime(os.path.join(self.tmp_dir.name, "manifest.json")) + 120):
+            self.build().run(["companies"])
+        self.assertEqual(["companies"], self.calls)
+
+        self.calls.clear()
+        self.build().run(["geometry"], force=("geometry",))
+        self.assertEqual(["geometry"], self.calls)
+
+    def test_changed_params_invalidate_the_stage(self):
+        self.build().run(["geometry"])
+        self.calls.clear()
+
+        pipeline = self.build()
+        pipeline.stages["geometry"].params = {"scale": 3}
+        outputs = pipeline.run(["geometry"])
+
+        self.assertEqual({"AAPL": 12, "MSFT": 12}, outputs["geometry"])
+        self.assertEqual(["geometry"], self.calls)
+
+    def test_invalidate(self):
+        pipeline = self.build()
+        pipeline.run(["geometry"])
+        self.calls.clear()
+
+        pipeline.invalidate("geometry")
+        pipeline.run(["geometry"])
+
+        self.assertEqual(["geometry"], self.calls)
+
+    def test_order_rejects_cycles_and_unknown_stages(self):
+        pipeline = Pipeline(self.tmp_dir.name).add("a", lambda b: b, inputs=("b",)).add("b", lambda a: a, inputs=("a",))
+
+        with self.assertRaises(ValueError):
+            pipeline.order(["a"])
+        with self.assertRaises(ValueError):
+            pipeline.order(["c"])
+        with self.assertRaises(ValueError):
+            pipeline.add("a", lambda: None)
+
+    def test_runtime_params_are_not_fingerprinted(self):
+        def build(workers):
+            return Pipeline(self.tmp_dir.name).add("scaled", lambda factor, workers: factor * 2, params={"factor": 3},
+                                                    runtime_params={"workers": workers})
+
+        build(1).run()
+        pipeline = build(8)
+        outputs = pipeline.run()
+
+        self.assertEqual({"scaled": 6}, outputs)
+        self.assertEqual("reused", pipeline.report[0]["status"])
+
+    def test_changed_helper_module_invalidates_the_stage(self):
+        src_dir = os.path.join(self.tmp_dir.name, "src")
+        os.makedirs(os.path.join(src_dir, "helperpkg"))
+        open(os.path.join(src_dir, "helperpkg", "__init__.py"), "w").close()
+        with open(os.path.join(src_dir, "helperpkg", "stages.py"), "w") as f:
+            f.write("from helperpkg import helpers\n\n\ndef double(value):\n    return helpers.scale(value)\n")
+        with open(os.path.join(src_dir, "helperpkg", "helpers.py"), "w") as f:
+            f.write("def scale(value):\n    return value * 2\n")
+        sys.path.insert(0, src_dir)
+        self.addCleanup(sys.path.remove, src_dir)
+        self.addCleanup(lambda: [sys.modules.pop(name, None) for name in ("helperpkg", "helperpkg.stages", "helperpkg.helpers")])
+        stages = importlib.import_module("helperpkg.stages")
+
+        def build():
+            return Pipeline(os.path.join(self.tmp_dir.name, "pipeline")).add("doubled", stages.double, params={"value": 3})
+
+        self.assertEqual({os.path.join("helperpkg", "helpers.py")}, set(dependency_sources(stages.double)))
+        self.assertEqual({"doubled": 6}, build().run())
+        with open(os.path.join(src_dir, "helperpkg", "helpers.py"), "w") as f:
+            f.write("def scale(value):\n    return value * 10\n")
+        importlib.reload(stages.helpers)
+        pipeline = build()
+        outputs = pipeline.run()
+
+        self.assertEqual({"doubled": 30}, outputs)
+        self.assertEqual("computed", pipeline.report[0]["status"])
+
+
+if __name__ == '__main__':
+    unittest.main()
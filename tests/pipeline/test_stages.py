@@ -0,0 +1,84 @@
+import json
+import tempfile
+import unittest
+from unittest.mock import patch
+import pandas as pd
+from data_manipulation.geostore import places_to_geodataframe
+from pipeline.stages import build_market_change_pipeline
+
+
+class TestMarketChangePipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.sp_companies = pd.DataFrame({
+            'Symbol': ['AAPL', 'MSFT'],
+            'Security': ['Apple Inc.', 'Microsoft Corp.'],
+            'GICS Sector': ['Information Technology', 'Information Technology'],
+            'GICS Sub-Industry': ['Technology Hardware, Storage & Peripherals', 'Systems Software'],
+            'Headquarters Location': ['Cupertino, California', 'Redmond, Washington'],
+            'Date Added': ['1982-11-30', '1991-03-31'],
+            'CIK': ['0000320193', '0000789019'],
+            'Founded': ['1977', '1975']
+        })
+        square = lambda x, y: {"type": "Polygon", "coordinates": [[[x, y], [x + 0.1, y], [x + 0.1, y + 0.1], [x, y + 0.1], [x, y]]]}
+        self.places = places_to_geodataframe({
+            "06": {"type": "FeatureCollection", "features": [{"type": "Feature", "properties": {"NAME": "Cupertino"}, "geometry": square(-122.1, 37.3)}]},
+            "53": {"type": "FeatureCollection", "features": [{"type": "Feature", "properties": {"NAME": "Redmond"}, "geometry": square(-122.2, 47.6)}]},
+        })
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def ticker_data(self, msft_close: float) -> pd.DataFrame:
+        return pd.DataFrame({
+            ('Open', 'AAPL'): [150.0], ('Adj Close', 'AAPL'): [155.0], ('Volume', 'AAPL'): [1000000],
+            ('Open', 'MSFT'): [250.0], ('Adj Close', 'MSFT'): [msft_close], ('Volume', 'MSFT'): [2000000],
+        }, index=[pd.Timestamp('2023-01-01')])
+
+    @patch('data_manipulation.fetch.retrieve_us_city_geodataframe')
+    @patch('data_manipulation.fetch.retrieve_ticker_data')
+    @patch('data_manipulation.fetch.retrieve_sp_500')
+    def test_price_refresh_only_reruns_aggregation_and_rendering(self, mock_sp_500, mock_ticker_data, mock_places):
+        mock_sp_500.return_value = self.sp_companies
+        mock_ticker_data.return_value = self.ticker_data(255.0)
+        mock_places.return_value = self.places
+
+        first = build_market_change_pipeline(self.tmp_dir.name, cache_dir=self.tmp_dir.name)
+        first_html = first.run(["map_html"])["map_html"]
+
+        mock_ticker_data.return_value = self.ticker_data(260.0)
+        second = build_market_change_pipeline(self.tmp_dir.name, cache_dir=self.tmp_dir.name)
+        second_html = second.run(["map_html"])["map_html"]
+
+        self.assertEqual(1, mock_sp_500.call_count)
+        self.assertEqual(1, mock_places.call_count)
+        self.assertEqual(2, mock_ticker_data.call_count)
+        recomputed = [entry["stage"] for entry in second.report if entry["status"] != "reused"]
+        self.assertEqual(["ticker_data", "change", "aggregated", "simplified", "map_html"], recomputed)
+        self.assertNotEqual(first_html, second_html)
+
+        aggregated = second.run(["aggregated"])["aggregated"]
+        self.assertEqual(2, len(json.loads(aggregated[0])["features"]))
+        self.assertEqual({"Cupertino": 5000000.0, "Redmond": 20000000.0}, dict(zip(aggregated[1]["City Name"], aggregated[1]["Change"])))
+
+    @patch('data_manipulation.fetch.retrieve_us_city_geodataframe')
+    @patch('data_manipulation.fetch.retrieve_ticker_data')
+    @patch('data_manipulation.fetch.retrieve_sp_500')
+    def test_join_workers_aggregate_like_the_serial_stages(self, mock_sp_500, mock_ticker_data, mock_places):
+        mock_sp_500.return_value = self.sp_companies
+        mock_ticker_data.return_value = self.ticker_data(255.0)
+        mock_places.return_value = self.places
+
+        serial = build_market_change_pipeline(f"{self.tmp_dir.name}/serial", cache_dir=self.tmp_dir.name)
+        pooled = build_market_change_pipeline(f"{self.tmp_dir.name}/pooled", cache_dir=self.tmp_dir.name, join_workers=2)
+        serial_geometry, serial_data = serial.run(["aggregated"])["aggregated"]
+        pooled_geometry, pooled_data = pooled.run(["aggregated"])["aggregated"]
+
+        self.assertNotIn("geoenhanced", pooled.order(["aggregated"]))
+        self.assertEqual(json.loads(serial_geometry), json.loads(pooled_geometry))
+        pd.testing.assert_frame_equal(serial_data.reset_index(drop=True), pooled_data.reset_index(drop=True))
+
+
+if __name__ == '__main__':
+    unittest.main()
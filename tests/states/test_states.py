@@ -0,0 +1,41 @@
+import unittest
+import pandas as pd
+from states import states
+
+
+class TestStates(unittest.TestCase):
+
+    def test_lookup_by_every_key(self):
+        for key in ("Colorado", "colorado", "CO", "08", 8):
+            self.assertIs(states.Colorado, states.lookup(key))
+        for key in ("District of Columbia", "District Of Columbia", "D.C.", "Washington, D.C."):
+            self.assertIs(states.DistrictOfColumbia, states.lookup(key))
+        self.assertEqual("West Virginia", states.lookup("West Virgina").name)
+        self.assertEqual("PA", states.lookup("Pennsylvania").abbreviation)
+        self.assertIsNone(states.lookup("Narnia"))
+        self.assertIsNone(states.lookup(None))
+
+    def test_states_are_immutable(self):
+        with self.assertRaises(AttributeError):
+            states.Colorado.fips = "99"
+
+    def test_map_states(self):
+        values = pd.Series(["New York", None, "Narnia", "ny", "Washington, D.C."], index=[5, 6, 7, 8, 9])
+
+        mapped = states.map_states(values)
+
+        self.assertEqual(["name", "abbreviation", "fips"], mapped.columns.tolist())
+        self.assertEqual(values.index.tolist(), mapped.index.tolist())
+        self.assertEqual(["36", None, None, "36", "11"], mapped["fips"].tolist())
+        self.assertEqual(["NY", None, None, "NY", "DC"], states.map_series(values, "abbreviation").tolist())
+
+    def test_states_df(self):
+        state_df = states.get_states_df()
+
+        self.assertIs(state_df, states.state_df)
+        self.assertEqual(len(states.STATES), len(state_df))
+        self.assertEqual(["name", "abbreviation", "fips"], state_df.columns.tolist())
+
+
+if __name__ == '__main__':
+    unittest.main()